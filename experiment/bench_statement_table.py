@@ -0,0 +1,74 @@
+"""
+statement_table.parse_statement_table と以前の statements_data(BeautifulSoup) の結果と速さを比べる
+
+    python experiment/bench_statement_table.py R2.htm R4.htm R7.htm
+    python experiment/bench_statement_table.py --repeat 50   # edgar_serverが生成するR fileで比べる
+
+headers, sections, data がすべて同じであることを確認してから時間を計る
+"""
+import os
+import sys
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'src'))
+sys.path.append(os.path.join(ROOT, 'experiment'))
+
+import financial_statement
+from statement_table import parse_statement_table
+
+
+def generated_reports(filings=10):
+    from edgar_server import Filing, FIRST_CIK
+    return {f'{FIRST_CIK + i}/{name}': Filing(FIRST_CIK + i, 2019, 1, i).report(name).encode('utf-8')
+            for i in range(filings) for name in ('R2.htm', 'R4.htm', 'R7.htm')}
+
+
+def compare(name, content):
+    """2つの実装の結果が同じか確かめる。違うときは違うキーを返す"""
+    statement = financial_statement.FinancialStatement(None)
+    expected = statement.statements_data_soup(name, name, content)[0]
+    actual = parse_statement_table(content, name)
+    return [key for key in ('headers', 'sections', 'data') if expected[key] != actual[key]]
+
+
+def bench(function, reports, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for name, content in reports.items():
+            function(name, content)
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='R fileのパーサーのベンチマーク')
+    parser.add_argument('paths', nargs='*', help='R fileのパス。指定がなければ生成したR fileを使う')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.paths:
+        reports = {}
+        for path in args.paths:
+            with open(path, 'rb') as f:
+                reports[path] = f.read()
+    else:
+        reports = generated_reports()
+
+    mismatches = {name: keys for name, keys in ((name, compare(name, content)) for name, content in reports.items()) if keys}
+    for name, keys in mismatches.items():
+        print(f'MISMATCH {name}: {keys}')
+
+    statement = financial_statement.FinancialStatement(None)
+    soup_seconds = bench(lambda name, content: statement.statements_data_soup(name, name, content), reports, args.repeat)
+    lxml_seconds = bench(lambda name, content: parse_statement_table(content, name), reports, args.repeat)
+    count = len(reports) * args.repeat
+    print(f'{len(reports)} reports, {len(mismatches)} mismatches')
+    print(f'statements_data (BeautifulSoup) {1000 * soup_seconds / count:8.3f} ms/report')
+    print(f'parse_statement_table (lxml)    {1000 * lxml_seconds / count:8.3f} ms/report')
+    print(f'speedup                         {soup_seconds / lxml_seconds:8.2f}x')
+    return mismatches
+
+
+if __name__ == '__main__':
+    main()
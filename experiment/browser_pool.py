@@ -0,0 +1,200 @@
+import time
+import queue
+import logging
+import threading
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+
+logger = logging.getLogger(__name__)
+
+# 各セッションの終わりを伝える
+_DONE = object()
+
+
+def create_driver(command_executor='http://localhost:4444/wd/hub'):
+    '''
+    Selenium Server にheadlessのChromeのセッションを作るメソッド
+    '''
+    # Chrome のオプションを設定する
+    options = webdriver.ChromeOptions()
+    options.add_argument('--headless')
+
+    # Selenium Server に接続する
+    return webdriver.Remote(
+        command_executor=command_executor,
+        desired_capabilities=options.to_capabilities(),
+        options=options,
+    )
+
+
+class SessionStats():
+    '''
+    セッションごとの処理件数と処理時間
+    '''
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.pages = 0
+        self.errors = 0
+        self.recycles = 0
+        self.seconds = 0.0
+
+    def pages_per_minute(self):
+        return 60 * self.pages / self.seconds if self.seconds else 0.0
+
+    def __repr__(self):
+        return (f'session {self.session_id}: {self.pages} pages, {self.errors} errors, '
+                f'{self.recycles} recycles, {self.pages_per_minute():.2f} pages/min')
+
+
+class BrowserPool():
+    '''
+    複数のブラウザのセッションで並列にファイリングを処理する
+
+    空いたセッションが次のファイリングを取る。max_pagesまで使ったセッションと
+    落ちたセッションは作り直す。セッションを落としたファイリングは1回だけやり直す。
+    セッションを作れなかったセッションは終わり、全部のセッションが終わったら残りのファイリングは失敗にする
+
+    Attributes
+    ----------
+    size : int
+        並列に動かすセッションの数
+    max_pages : int
+        この件数を処理したらセッションを作り直す
+    create_driver : function
+        create_driver() -> webdriver。defaultは Selenium Server のChrome
+    stats : list
+        SessionStatsのリスト
+    failed : list
+        (filing, exception) のリスト。やり直してもセッションが落ちたファイリングと、処理するセッションがなかったファイリング
+    '''
+    def __init__(self, size=4, max_pages=50, create_driver=create_driver):
+        self.size = size
+        self.max_pages = max_pages
+        self.create_driver = create_driver
+        self.stats = [SessionStats(i) for i in range(size)]
+        self.failed = []
+        self.lock = threading.Lock()
+
+    def _fail(self, filing, e):
+        logger.error(f'{filing} failed: {e}')
+        with self.lock:
+            self.failed.append((filing, e))
+
+    def _quit(self, driver):
+        try:
+            driver.quit()
+        except WebDriverException as e:
+            logger.warning(f'quit failed: {e}')
+
+    def _start(self, stats):
+        '''セッションを作る。(driver, None) か、作れなかったときは (None, exception)'''
+        try:
+            return self.create_driver(), None
+        except Exception as e:
+            logger.error(f'session {stats.session_id} could not be created: {e}')
+            return None, e
+
+    def _restart(self, stats, driver):
+        self._quit(driver)
+        stats.recycles += 1
+        return self._start(stats)
+
+    def _session(self, stats, filing_queue, retry_queue, scrape):
+        driver, _ = self._start(stats)
+        if driver is None:
+            return
+        pages = 0
+        done = False
+        while True:
+            # やり直すファイリングを先に取る。filing_queueが終わっても、やり直すファイリングがなくなるまで続ける
+            try:
+                filing, attempt = retry_queue.get_nowait()
+            except queue.Empty:
+                if done:
+                    break
+                filing = filing_queue.get()
+                if filing is _DONE:
+                    done = True
+                    continue
+                attempt = 0
+            if pages >= self.max_pages:
+                driver, e = self._restart(stats, driver)
+                pages = 0
+                if driver is None:
+                    self._fail(filing, e)
+                    return
+            start = time.time()
+            try:
+                scrape(driver, filing)
+            except WebDriverException as e:
+                # セッションが落ちたときは作り直して、ファイリングは1回だけやり直す
+                logger.warning(f'session {stats.session_id} crashed: {filing} ERROR: {e}')
+                stats.errors += 1
+                stats.seconds += time.time() - start
+                if attempt == 0:
+                    retry_queue.put((filing, attempt + 1))
+                else:
+                    self._fail(filing, e)
+                driver, _ = self._restart(stats, driver)
+                pages = 0
+                if driver is None:
+                    return
+                continue
+            except Exception as e:
+                logger.warning(f'session {stats.session_id}: {filing} ERROR: {e}')
+                stats.errors += 1
+            stats.seconds += time.time() - start
+            pages += 1
+            stats.pages += 1
+        self._quit(driver)
+
+    def _put(self, filing_queue, item, sessions):
+        '''セッションが残っている間だけitemをqueueに入れる。全部のセッションが終わっていたらFalse'''
+        while True:
+            try:
+                filing_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if not any(session.is_alive() for session in sessions):
+                    return False
+
+    def run(self, filings, scrape):
+        '''
+        filingsをすべて処理する
+
+        Parameters
+        ----------
+        filings : iterable
+            処理するファイリング
+        scrape : function
+            scrape(driver, filing)。1件のファイリングを処理する
+        '''
+        filing_queue = queue.Queue(self.size)
+        retry_queue = queue.Queue()
+        threads = [threading.Thread(target=self._session, args=(stats, filing_queue, retry_queue, scrape), daemon=True)
+                   for stats in self.stats]
+        for thread in threads:
+            thread.start()
+        no_session = WebDriverException('no browser session is available')
+        filings = iter(filings)
+        for filing in filings:
+            if not self._put(filing_queue, filing, threads):
+                self._fail(filing, no_session)
+                break
+        # 途中で全部のセッションが終わったときは、残りのファイリングを失敗にする
+        for filing in filings:
+            self._fail(filing, no_session)
+        for _ in threads:
+            if not self._put(filing_queue, _DONE, threads):
+                break
+        for thread in threads:
+            thread.join()
+        # セッションが先に終わって、取られなかったファイリング
+        for remaining in (filing_queue, retry_queue):
+            while not remaining.empty():
+                filing = remaining.get_nowait()
+                if filing is not _DONE:
+                    self._fail(filing if remaining is filing_queue else filing[0], no_session)
+        for stats in self.stats:
+            logger.info(stats)
+        return self.stats
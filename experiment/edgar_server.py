@@ -0,0 +1,402 @@
+"""
+負荷試験用のSEC EDGARのスタブサーバー
+
+    python experiment/edgar_server.py --port 8000 --filings 200 --latency 0.05 --error-rate 0.01 --max-rps 10
+    SEC_BASE_URL=http://localhost:8000 python src/cli.py index
+
+次のパスを、--fixturesのディレクトリに同じパスのファイルがあればそれを、
+なければ生成したデータを返す
+
+    /Archives/edgar/full-index/{year}/QTR{quarter}/xbrl.idx
+    /Archives/edgar/data/{cik}/{accession number}/index.json
+    /Archives/edgar/data/{cik}/{accession number}/{ticker}-{yyyymmdd}.xml, _cal.xml
+    /Archives/edgar/data/{cik}/{accession number}/{ticker}-{yyyymmdd}.htm  # INLINE_YEAR以降はインラインXBRLだけ
+    /Archives/edgar/data/{cik}/{accession number}/FilingSummary.xml, R*.htm
+"""
+import os
+import re
+import json
+import time
+import random
+import argparse
+import datetime
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+INDEX_PATTERN = re.compile(r'^/Archives/edgar/full-index/(\d{4})/QTR([1-4])/xbrl\.idx$')
+FILING_PATTERN = re.compile(r'^/Archives/edgar/data/(\d+)/(\d{10})(\d{2})([1-4])(\d{5})/([^/]+)$')
+
+# 生成するインスタンスxmlのタグ。income_statement_item/cash_flow_itemのidと同じ順番
+INCOME_STATEMENT_TAGS = {
+    1: 'Revenues',
+    2: 'OperatingIncomeLoss',
+    3: 'NonoperatingIncomeExpense',
+    4: 'NetIncomeLoss',
+    5: 'CommonStockDividendsPerShareDeclared',
+    6: 'EarningsPerShareDiluted',
+    7: 'WeightedAverageNumberOfDilutedSharesOutstanding',
+}
+CASH_FLOW_TAGS = {
+    1: 'NetCashProvidedByUsedInOperatingActivities',
+    2: 'NetCashProvidedByUsedInInvestingActivities',
+    3: 'NetCashProvidedByUsedInFinancingActivities',
+    4: 'CashAndCashEquivalentsAtCarryingValue',
+}
+
+FIRST_CIK = 1000000
+
+# この年以降のファイリングはインスタンスxmlの代わりにインラインXBRLの主文書を置く
+INLINE_YEAR = 2020
+
+
+class Filing():
+    """
+    accession numberから決まる架空のファイリング
+    accession numberは {cik(10桁)}{年(2桁)}{四半期(1桁)}{連番(5桁)} にして、パスだけで中身が決まるようにする
+    """
+    def __init__(self, cik, year, quarter, number):
+        self.cik = cik
+        self.year = year
+        self.quarter = quarter
+        self.number = number
+        self.accession_number = f'{cik:010d}-{year % 100:02d}-{quarter}{number:05d}'
+        self.directory = f'/Archives/edgar/data/{cik}/{self.accession_number.replace("-", "")}'
+        self.form_type = '10-K' if quarter == 4 else '10-Q'
+        month = 3 * quarter
+        self.period_end = datetime.date(year, month, 31 if month in (3, 12) else 30)
+        self.previous_end = self.period_end.replace(year=year - 1)
+        self.ticker = f'c{cik}'
+        self.instance_name = f'{self.ticker}-{self.period_end:%Y%m%d}.xml'
+        self.inline = year >= INLINE_YEAR
+        self.inline_name = f'{self.ticker}-{self.period_end:%Y%m%d}.htm'
+        # 会社と期間ごとに同じ値になるようにする
+        self.random = random.Random(f'{cik}-{year}-{quarter}')
+        self.values = {tag: self.random.randint(10 ** 6, 10 ** 9) for tag in
+                       list(INCOME_STATEMENT_TAGS.values()) + list(CASH_FLOW_TAGS.values())}
+        self.values['EarningsPerShareDiluted'] = round(self.random.uniform(0.1, 5.0), 2)
+        self.values['CommonStockDividendsPerShareDeclared'] = round(self.random.uniform(0.0, 1.0), 2)
+
+    @classmethod
+    def from_path(cls, cik, year, quarter, number):
+        return cls(int(cik), 2000 + int(year), int(quarter), int(number))
+
+    def index_line(self):
+        return (f'{self.cik}|COMPANY {self.cik}|{self.form_type}|{self.period_end + datetime.timedelta(days=40)}|'
+                f'edgar/data/{self.cik}/{self.accession_number}.txt')
+
+    def documents(self):
+        if self.inline:
+            # 実際のインラインXBRLのファイリングと同じく、主文書から取り出したインスタンス(_htm.xml)と_cal.xmlも置く
+            return [self.inline_name, self.inline_name.replace('.htm', '_cal.xml'),
+                    self.inline_name.replace('.htm', '_htm.xml'), 'FilingSummary.xml', 'R2.htm', 'R4.htm', 'R7.htm']
+        return [self.instance_name, self.instance_name.replace('.xml', '_cal.xml'),
+                'FilingSummary.xml', 'R2.htm', 'R4.htm', 'R7.htm']
+
+    def index_json(self):
+        return json.dumps({'directory': {
+            'item': [{'name': name, 'type': 'text.gif', 'size': ''} for name in self.documents()],
+            'name': self.directory,
+            'parent-dir': f'/Archives/edgar/data/{self.cik}',
+        }})
+
+    def instance_xml(self):
+        facts = []
+        for tag, value in self.values.items():
+            context = 'Current_Instant' if tag == CASH_FLOW_TAGS[4] else 'Current_Duration'
+            facts.append(f'  <us-gaap:{tag} contextRef="{context}" unitRef="usd" decimals="-6">{value}</us-gaap:{tag}>')
+            facts.append(f'  <us-gaap:{tag} contextRef="Previous_Duration" unitRef="usd" decimals="-6">{value // 2}</us-gaap:{tag}>')
+        start = self.period_end - datetime.timedelta(days=90)
+        return f'''<?xml version="1.0" encoding="utf-8"?>
+<xbrl xmlns="http://www.xbrl.org/2003/instance" xmlns:dei="http://xbrl.sec.gov/dei/2014-01-31" xmlns:us-gaap="http://fasb.org/us-gaap/2014-01-31">
+  <context id="Current_Duration"><period><startDate>{start}</startDate><endDate>{self.period_end}</endDate></period></context>
+  <context id="Current_Instant"><period><instant>{self.period_end}</instant></period></context>
+  <context id="Previous_Duration"><period><startDate>{start.replace(year=start.year - 1)}</startDate><endDate>{self.previous_end}</endDate></period></context>
+  <dei:DocumentFiscalYearFocus contextRef="Current_Duration">{self.year}</dei:DocumentFiscalYearFocus>
+  <dei:DocumentFiscalPeriodFocus contextRef="Current_Duration">{'FY' if self.quarter == 4 else f'Q{self.quarter}'}</dei:DocumentFiscalPeriodFocus>
+  <dei:DocumentPeriodEndDate contextRef="Current_Duration">{self.period_end}</dei:DocumentPeriodEndDate>
+{chr(10).join(facts)}
+</xbrl>
+'''
+
+    def inline_xhtml(self):
+        """インラインXBRLの主文書。値は百万単位で表示してscale="6"を付け、前期の営業利益は負の数にする"""
+        start = self.period_end - datetime.timedelta(days=90)
+        rows = []
+        for tag, value in self.values.items():
+            context = 'c-2' if tag == CASH_FLOW_TAGS[4] else 'c-1'
+            if isinstance(value, float):
+                current = f'<ix:nonFraction name="us-gaap:{tag}" contextRef="{context}" unitRef="usdPerShare" decimals="2" format="ixt:num-dot-decimal">{value}</ix:nonFraction>'
+                previous = f'<ix:nonFraction name="us-gaap:{tag}" contextRef="c-3" unitRef="usdPerShare" decimals="2" format="ixt:num-dot-decimal">{value / 2:.2f}</ix:nonFraction>'
+            else:
+                current = (f'<ix:nonFraction name="us-gaap:{tag}" contextRef="{context}" unitRef="usd" decimals="-3" scale="3" '
+                           f'format="ixt:num-dot-decimal">{value / 1000:,.3f}</ix:nonFraction>')
+                sign = ' sign="-"' if tag == 'OperatingIncomeLoss' else ''
+                previous = (f'<ix:nonFraction name="us-gaap:{tag}" contextRef="c-3" unitRef="usd" decimals="-3" scale="3"{sign} '
+                            f'format="ixt:num-dot-decimal">{value // 2 / 1000:,.3f}</ix:nonFraction>')
+            rows.append(f'<tr><td>{tag}</td><td>$ {current}</td><td>$ {previous}</td></tr>')
+        contexts = [('c-1', f'<xbrli:startDate>{start}</xbrli:startDate><xbrli:endDate>{self.period_end}</xbrli:endDate>'),
+                    ('c-2', f'<xbrli:instant>{self.period_end}</xbrli:instant>'),
+                    ('c-3', f'<xbrli:startDate>{start.replace(year=start.year - 1)}</xbrli:startDate>'
+                            f'<xbrli:endDate>{self.previous_end}</xbrli:endDate>')]
+        contexts = ''.join(f'<xbrli:context id="{id}"><xbrli:entity><xbrli:identifier scheme="http://www.sec.gov/CIK">{self.cik:010d}'
+                           f'</xbrli:identifier></xbrli:entity><xbrli:period>{period}</xbrli:period></xbrli:context>'
+                           for id, period in contexts)
+        return f'''<?xml version="1.0" encoding="utf-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:ix="http://www.xbrl.org/2013/inlineXBRL" xmlns:xbrli="http://www.xbrl.org/2003/instance"
+      xmlns:ixt="http://www.xbrl.org/inlineXBRL/transformation/2020-02-12" xmlns:dei="http://xbrl.sec.gov/dei/2020-01-31"
+      xmlns:us-gaap="http://fasb.org/us-gaap/2020-01-31">
+<head><title>{self.form_type}</title></head>
+<body>
+<div style="display:none"><ix:header><ix:hidden>
+<ix:nonNumeric name="dei:DocumentFiscalYearFocus" contextRef="c-1">{self.year}</ix:nonNumeric>
+<ix:nonNumeric name="dei:DocumentFiscalPeriodFocus" contextRef="c-1">{'FY' if self.quarter == 4 else f'Q{self.quarter}'}</ix:nonNumeric>
+</ix:hidden><ix:resources>{contexts}</ix:resources></ix:header></div>
+<p>For the period ended <ix:nonNumeric name="dei:DocumentPeriodEndDate" contextRef="c-1" format="ixt:date-monthname-day-year-en">{self.period_end:%B %d, %Y}</ix:nonNumeric></p>
+<table>
+{chr(10).join(rows)}
+</table>
+</body>
+</html>
+'''
+
+    def calculation_xml(self):
+        return '<?xml version="1.0" encoding="utf-8"?>\n<link:linkbase xmlns:link="http://www.xbrl.org/2003/linkbase"/>\n'
+
+    def filing_summary(self):
+        reports = [('Condensed Consolidated Balance Sheets', 'R2.htm'),
+                   ('Condensed Consolidated Statements of Operations', 'R4.htm'),
+                   ('Condensed Consolidated Statements of Cash Flows', 'R7.htm'),
+                   # report_listは最後のReportを読まない
+                   ('All Reports', 'Financial_Report.xlsx')]
+        reports = ''.join(f'<Report><ShortName>{name}</ShortName><LongName>{name}</LongName>'
+                          f'<HtmlFileName>{file_name}</HtmlFileName></Report>' for name, file_name in reports)
+        return f'<?xml version="1.0" encoding="utf-8"?>\n<FilingSummary><MyReports>{reports}</MyReports></FilingSummary>\n'
+
+    def _date_label(self, date):
+        month = date.strftime('%b')
+        return f'{month}{"" if month == "May" else "."} {date.day:02d}, {date.year}'
+
+    def report(self, name):
+        """R fileのhtml。$ in Millionsで、今期と前期の2列にする"""
+        millions = lambda tag: f'{self.values[tag] // 10 ** 6:,}'
+        previous = lambda tag: f'{self.values[tag] // 2 // 10 ** 6:,}'
+        if name == 'R2.htm':
+            title = 'CONDENSED CONSOLIDATED BALANCE SHEETS - USD ($)<br> $ in Millions'
+            rows = [('Current assets:', None),
+                    ('Cash and cash equivalents', CASH_FLOW_TAGS[4])]
+            periods = None
+        elif name == 'R4.htm':
+            title = 'CONDENSED CONSOLIDATED STATEMENTS OF OPERATIONS - USD ($)<br> shares in Millions, $ in Millions'
+            rows = [('Net sales', INCOME_STATEMENT_TAGS[1]),
+                    ('Operating income', INCOME_STATEMENT_TAGS[2]),
+                    ('Net income', INCOME_STATEMENT_TAGS[4]),
+                    ('Earnings per share:', None),
+                    ('Diluted (in dollars per share)', INCOME_STATEMENT_TAGS[6]),
+                    ('Diluted (in shares)', INCOME_STATEMENT_TAGS[7])]
+            periods = '3 Months Ended'
+        else:
+            title = 'CONDENSED CONSOLIDATED STATEMENTS OF CASH FLOWS - USD ($)<br> $ in Millions'
+            rows = [('Cash and cash equivalents, beginning of period', CASH_FLOW_TAGS[4]),
+                    ('Operating activities:', None),
+                    ('Cash generated by operating activities', CASH_FLOW_TAGS[1]),
+                    ('Cash generated by/(used in) investing activities', CASH_FLOW_TAGS[2]),
+                    ('Cash used in financing activities', CASH_FLOW_TAGS[3]),
+                    ('Cash and cash equivalents, end of period', CASH_FLOW_TAGS[4])]
+            periods = '3 Months Ended'
+
+        dates = [self._date_label(self.period_end), self._date_label(self.previous_end)]
+        if periods is None:
+            header = (f'<tr><th class="tl"><div><strong>{title}</strong></div></th>' +
+                      ''.join(f'<th class="th"><div>{date}</div></th>' for date in dates) + '</tr>')
+        else:
+            header = (f'<tr><th class="tl" rowspan="2"><div><strong>{title}</strong></div></th>'
+                      f'<th class="th" colspan="2">{periods}</th></tr>'
+                      '<tr>' + ''.join(f'<th class="th"><div>{date}</div></th>' for date in dates) + '</tr>')
+        body = ''
+        for label, tag in rows:
+            if tag is None:
+                body += (f'<tr class="rh"><td class="pl"><a><strong>{label}</strong></a></td>'
+                         '<td class="text">&#160;<span></span></td><td class="text">&#160;<span></span></td></tr>')
+            elif tag == INCOME_STATEMENT_TAGS[6]:
+                body += (f'<tr class="ro"><td class="pl"><a>{label}</a></td><td class="nump">$ {self.values[tag]}<span></span></td>'
+                         f'<td class="nump">$ {self.values[tag] / 2:.2f}<span></span></td></tr>')
+            else:
+                body += (f'<tr class="ro"><td class="pl"><a>{label}</a></td><td class="nump">{millions(tag)}<span></span></td>'
+                         f'<td class="nump">{previous(tag)}<span></span></td></tr>')
+        return f'<html><body><table class="report" border="0" cellspacing="2" id="idm1">{header}{body}</table></body></html>\n'
+
+    def document(self, name):
+        if name == 'index.json':
+            return self.index_json(), 'application/json'
+        if self.inline:
+            if name == self.inline_name:
+                return self.inline_xhtml(), 'text/html'
+            if name == self.inline_name.replace('.htm', '_htm.xml'):
+                return self.instance_xml(), 'application/xml'
+            if name == self.inline_name.replace('.htm', '_cal.xml'):
+                return self.calculation_xml(), 'application/xml'
+        elif name == self.instance_name:
+            return self.instance_xml(), 'application/xml'
+        elif name == self.instance_name.replace('.xml', '_cal.xml'):
+            return self.calculation_xml(), 'application/xml'
+        if name == 'FilingSummary.xml':
+            return self.filing_summary(), 'application/xml'
+        if name in ('R2.htm', 'R4.htm', 'R7.htm'):
+            return self.report(name), 'text/html'
+        return None, None
+
+
+def full_index(year, quarter, filings):
+    """xbrl.idx。load_url.get_xbrl_idxが読めるヘッダを付ける"""
+    lines = ['Description:           XBRL Index of EDGAR Dissemination Feed',
+             f'Last Data Received:    {datetime.date(year, 3 * quarter, 1):%B %d, %Y}',
+             'Comments:              webmaster@sec.gov',
+             'Anonymous FTP:         ftp://ftp.sec.gov/edgar/',
+             # EDGARの空行はスペースが1つ入っている
+             ' ', ' ', ' ',
+             'CIK|Company Name|Form Type|Date Filed|Filename',
+             '-' * 80]
+    lines += [Filing(FIRST_CIK + i, year, quarter, i).index_line() for i in range(filings)]
+    return '\n'.join(lines) + '\n'
+
+
+class Throttle():
+    """直近1秒のリクエスト数がmax_rpsを超えたら429を返すためのカウンター"""
+    def __init__(self, max_rps):
+        self.max_rps = max_rps
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def allow(self):
+        if not self.max_rps:
+            return True
+        now = time.time()
+        with self.lock:
+            self.requests = [t for t in self.requests if now - t < 1.0]
+            if len(self.requests) >= self.max_rps:
+                return False
+            self.requests.append(now)
+            return True
+
+
+class EdgarHandler(BaseHTTPRequestHandler):
+    # EdgarServerで設定する
+    config = None
+
+    def log_message(self, format, *args):
+        if self.config.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body=b'', content_type='text/plain', headers=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _fixture(self, path):
+        if self.config.fixtures is None:
+            return None
+        root = os.path.abspath(self.config.fixtures)
+        file_path = os.path.abspath(os.path.join(root, path.lstrip('/')))
+        # 文字列の前方一致では root + '_evil' のような隣のディレクトリも通るので、パスの要素で比べる
+        if os.path.commonpath([root, file_path]) != root or not os.path.isfile(file_path):
+            return None
+        with open(file_path, 'rb') as f:
+            return f.read()
+
+    def do_GET(self):
+        config = self.config
+        # load_urlは full-index//2019 のようにスラッシュが重なる
+        path = re.sub('/+', '/', self.path.split('?')[0])
+        if not config.throttle.allow():
+            self._send(429, 'Too Many Requests', headers={'Retry-After': '1'})
+            return
+        if config.latency:
+            time.sleep(random.uniform(0, 2 * config.latency))
+        if config.error_rate and random.random() < config.error_rate:
+            self._send(500, 'Internal Server Error')
+            return
+
+        fixture = self._fixture(path)
+        if fixture is not None:
+            self._send(200, fixture, 'application/octet-stream')
+            return
+        match = INDEX_PATTERN.match(path)
+        if match:
+            self._send(200, full_index(int(match.group(1)), int(match.group(2)), config.filings))
+            return
+        match = FILING_PATTERN.match(path)
+        if match:
+            cik, _, year, quarter, number, name = match.groups()
+            body, content_type = Filing.from_path(cik, year, quarter, number).document(name)
+            if body is not None:
+                self._send(200, body, content_type)
+                return
+        self._send(404, 'Not Found')
+
+
+class EdgarServer():
+    """
+    EDGARのスタブサーバー
+
+    Attributes
+    ----------
+    filings : int
+        xbrl.idx 1つあたりのファイリング数
+    latency : float
+        平均の応答の遅延(秒)。0から2倍までの一様分布
+    error_rate : float
+        500を返す割合
+    max_rps : int
+        1秒あたりのリクエストの上限。超えると429を返す。0のときは制限しない
+    fixtures : str
+        記録したレスポンスを置いたディレクトリ。EDGARと同じパスに置く
+    """
+    def __init__(self, host='127.0.0.1', port=0, filings=100, latency=0.0, error_rate=0.0, max_rps=0,
+                 fixtures=None, verbose=False):
+        self.filings = filings
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle = Throttle(max_rps)
+        self.fixtures = os.path.abspath(fixtures) if fixtures else None
+        self.verbose = verbose
+        handler = type('Handler', (EdgarHandler,), {'config': self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """別スレッドで起動する"""
+        thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='負荷試験用のSEC EDGARのスタブサーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--filings', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--max-rps', type=int, default=0)
+    parser.add_argument('--fixtures')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    server = EdgarServer(args.host, args.port, args.filings, args.latency, args.error_rate, args.max_rps,
+                         args.fixtures, args.verbose)
+    print(f'serving on {server.url}')
+    server.httpd.serve_forever()
@@ -1,12 +1,22 @@
+import os
 import re
 import sys
 import traceback
+from contextlib import nullcontext
 from datetime import datetime
 import requests
 import pandas as pd
 import pandas.io.sql as psql
 import numpy as np
 from db_util import *
+from processed_filings import ProcessedFilings
+from pipeline import Pipeline
+from deadline import Deadline, DeadlineStats, RetryQueue, http_get, is_retryable
+from filing_manifest import parse_filing_summary, classify_statements, load_manifests, statement_urls
+from processed_filings import filing_key
+from statement_table import parse_statement_table
+from profiling import ProfileReport
+import time_series
 from bs4 import BeautifulSoup
 from sqlalchemy import create_engine
 import pandas.io.sql as psql
@@ -30,15 +40,20 @@ def setup_logger(log_folder, modname=__name__):
     return logger
 
 
+# パースのプロセスからも使えるようにしておく。__main__ではsetup_loggerで置き換える
+logger = getLogger(__name__)
+
+
 class FinancialStatement:
-    BASE_URL = "https://www.sec.gov"
+    # 負荷試験ではローカルのEDGARのスタブサーバーに向ける
+    BASE_URL = os.environ.get('SEC_BASE_URL', "https://www.sec.gov")
 
     def __init__(self, path):
         self.path = path
 
     def _xml_summary(self, path):
         path_to_xml_summary = FinancialStatement.BASE_URL + path
-        content = requests.get(path_to_xml_summary).json()
+        content = http_get(path_to_xml_summary).json()
         item_name = [item['name'] for item in content['directory']['item'] if item['name'] == 'FilingSummary.xml']
         # Grab the filing summary and create a new url leading to the file so we can download it
         xml_summary = FinancialStatement.BASE_URL + content['directory']['name'] + "/" + item_name[0]
@@ -48,60 +63,21 @@ class FinancialStatement:
     def report_list(self):
         xml_summary = self._xml_summary(self.path)
         base_url = xml_summary.replace('FilingSummary.xml', '')
-        content = requests.get(xml_summary).content
-        soup = BeautifulSoup(content, 'lxml')
-        # find the 'myreports' tag because this contains all the individual reports submitted.
-        reports = soup.find('myreports')
-        # a list to store all the individual components of the report
-        report_list = []
-        # loop through each report in the 'myreports' tag but avoid the last one as this will cause an error.
-        for report in reports.find_all('report')[:-1]:
-            # let's create a dictionary to store all the different parts we need.
-            report_dict = {'name_short': report.shortname.text, 'name_long': report.longname.text}
-            try:
-                report_dict['url'] = base_url + report.htmlfilename.text
-            except AttributeError:
-                report_dict['url'] = base_url + report.xmlfilename.text
-            # append the dictionary to the master list.
-            report_list.append(report_dict)
-
-        return report_list
+        content = http_get(xml_summary).content
+        return parse_filing_summary(content, base_url)
 
     def statements_dict(self, report_list):
-        # create the list to hold the statement urls
-        statements_dict = []
-
-        for report_dict in report_list:
-            if re.match('paren', report_dict['name_short'], re.IGNORECASE):
-                continue
-            # バランスシート
-            balance_sheet_patterns = [
-                '.*balance.*', '.*financial ?position.*', '.*financial ?condition.*']
-            # 損益計算書
-            income_statement_patterns = [
-                '.*of ?income.*', '.*of ?operation.*', '.*of ?earnings']
-            # キャッシュフロー計算書
-            cash_flow_patterns = ['.*cash ?flow.*']
-            # report_list = [balontinue
-            statements_dict = {}
-            for index, patterns in enumerate([balance_sheet_patterns, income_statement_patterns, cash_flow_patterns]):
-                for pattern in patterns:
-                    tmp_title_dict = {}
-                    for report_dict in report_list:
-                        if re.match(pattern, report_dict['name_short'], re.IGNORECASE):
-                            key = f"({index}){report_dict['name_short']}"
-                            tmp_title_dict[key] = report_dict['url']
-                    if len(tmp_title_dict) == 1:
-                        statements_dict.update(tmp_title_dict)
-                    elif len(tmp_title_dict) > 1:
-                        tmp_dict = {min(tmp_title_dict): tmp_title_dict[min(tmp_title_dict)]}
-                        statements_dict.update(tmp_dict)
-                    elif len(tmp_title_dict) == 0:
-                        continue
+        return classify_statements(report_list)
 
-        return statements_dict
+    def statements_data(self, statement_name, statement_url, content=None):
+        """R fileのtableをlxmlで1回だけ走査してheaders, sections, dataに分ける"""
+        logger.info(f'statement_name is {statement_name} statement_url is {statement_url}')
+        if content is None:
+            content = http_get(statement_url).content
+        return [parse_statement_table(content, statement_name)]
 
-    def statements_data(self, statement_name, statement_url):
+    def statements_data_soup(self, statement_name, statement_url, content=None):
+        """BeautifulSoupで読む以前の実装。statement_tableのベンチマークで結果を比べるために残す"""
         # let's assume we want all the statements in a single data set.
         statements_data = []
         # define a dictionary that will store the different parts of the statement.
@@ -109,7 +85,8 @@ class FinancialStatement:
 
         # request the statement file content
         logger.info(f'statement_name is {statement_name} statement_url is {statement_url}')
-        content = requests.get(statement_url).content
+        if content is None:
+            content = http_get(statement_url).content
         report_soup = BeautifulSoup(content, 'html')
 
         first_row = report_soup.table.find_all('tr')[0].get_text()
@@ -167,21 +144,26 @@ class FinancialStatement:
         return income_header
 
     def trim_value(self):
-        income_data = self.statements_data[0]['data']
-        income_df = pd.DataFrame(income_data)
-
-        # Define the Index column, rename it, and we need to make sure to drop the old column once we reindex.
-        income_df.index = income_df[0]
-        income_df.index.name = 'category'
-        income_df = income_df.drop(0, axis=1)
-        # Get rid of the '$', '(', ')', and convert the '' to NaNs.
-        income_df = income_df.replace('[\$,)]', '', regex=True).replace(
-            '[(]', '-', regex=True).replace('', 'NaN', regex=True)
-        # everything is a string, so let's convert all the data to a float.
-        try:
-            income_df = income_df.astype(float)
-        except:
-            print(self.statement_url)
+        statement_data = self.statements_data[0]
+        if 'values' in statement_data:
+            # parse_statement_tableで数値にした配列をそのまま使う
+            income_df = pd.DataFrame(statement_data['values'], index=statement_data['labels'])
+            income_df.index.name = 'category'
+        else:
+            income_df = pd.DataFrame(statement_data['data'])
+
+            # Define the Index column, rename it, and we need to make sure to drop the old column once we reindex.
+            income_df.index = income_df[0]
+            income_df.index.name = 'category'
+            income_df = income_df.drop(0, axis=1)
+            # Get rid of the '$', '(', ')', and convert the '' to NaNs.
+            income_df = income_df.replace('[\$,)]', '', regex=True).replace(
+                '[(]', '-', regex=True).replace('', 'NaN', regex=True)
+            # everything is a string, so let's convert all the data to a float.
+            try:
+                income_df = income_df.astype(float)
+            except:
+                print(self.statement_url)
         # Change the column headers
         income_df.columns = self.header
         column_list = []
@@ -218,12 +200,14 @@ class FinancialStatement:
         return [category for category in self.values.index.values if re.search(pattern, category, re.IGNORECASE)]
 
     def insert_df(self, table_name):
-        DBUtil.insertDf(self._make_df(), table_name ,if_exists="append", index=False)
+        df = self._make_df()
+        DBUtil.insertDf(df, table_name ,if_exists="append", index=False)
+        time_series.refresh_or_log(df)
 
 class BalanceSheet(FinancialStatement):
     def __init__(self, **kwargs):
         self.__dict__.update(kwargs)
-        self.statements_data = self.statements_data(self.statement_name, self.statement_url)
+        self.statements_data = self.statements_data(self.statement_name, self.statement_url, kwargs.get('content'))
         self.header = self.income_header()
         self.values = self.trim_value()
 
@@ -231,7 +215,7 @@ class BalanceSheet(FinancialStatement):
 class ProfitLoss(FinancialStatement):
     def __init__(self, **kwargs):
         self.__dict__.update(kwargs)
-        self.statements_data = self.statements_data(self.statement_name, self.statement_url)
+        self.statements_data = self.statements_data(self.statement_name, self.statement_url, kwargs.get('content'))
         self.header = self.income_header()
         self.values = self.trim_value()
 
@@ -240,7 +224,7 @@ class ProfitLoss(FinancialStatement):
         values_diluted = []
         indices_shares_outstanding = self.find_category_with_regex('diluted')
         for i in range(len(indices_shares_outstanding)):
-            values_diluted.append(profit_loss.values[indices_shares_outstanding[i]])
+            values_diluted.append(self.values[indices_shares_outstanding[i]])
 
         if len(values_diluted) != 2:
             logger.info(f"values_diluted: {values_diluted}")
@@ -252,7 +236,7 @@ class ProfitLoss(FinancialStatement):
         values_diluted = []
         indices_shares_outstanding = self.find_category_with_regex('diluted')
         for i in range(len(indices_shares_outstanding)):
-            values_diluted.append(profit_loss.values[indices_shares_outstanding[i]])
+            values_diluted.append(self.values[indices_shares_outstanding[i]])
         if len(values_diluted) != 2:
             logger.info(f"values_diluted: {values_diluted}")
 
@@ -275,9 +259,9 @@ class ProfitLoss(FinancialStatement):
 
     def _get_operating_activities(self):
         sql = f"""SELECT operating_activities FROM cash_flow
-                   WHERE cik    = '{profit_loss.cik}' and
-                         year   = {profit_loss.year} and
-                         quater = {profit_loss.quater}
+                   WHERE cik    = '{self.cik}' and
+                         year   = {self.year} and
+                         quater = {self.quater}
                 """
         operating_activities_df = psql.read_sql(sql, DBUtil.getConnect())
 
@@ -316,7 +300,7 @@ class ProfitLoss(FinancialStatement):
 class CashFlow(FinancialStatement):
     def __init__(self, **kwargs):
         self.__dict__.update(kwargs)
-        self.statements_data = self.statements_data( self.statement_name, self.statement_url)
+        self.statements_data = self.statements_data(self.statement_name, self.statement_url, kwargs.get('content'))
         self.header = self.income_header()
         self.values = self.trim_value()
 
@@ -392,65 +376,227 @@ class CashFlow(FinancialStatement):
                              })
 
 
+def read_source_rows(year, quater, form_type, source='csv', chunksize=10000):
+    """
+    処理するファイリングを1行ずつ返すジェネレータ
+    どちらの場合も CIK, url を持つ行を返す
+
+    Arguments:
+    ----------
+    source: string
+        csvのときは ./data/{year}_QTR{quater}.csv を読み、
+        dbのときはbase_infoをサーバーサイドカーソルでchunksize行ずつ読む
+    """
+    if source == 'db':
+        sql = """SELECT cik AS "CIK", base_url || '/index.json' AS url
+                   FROM base_info
+                  WHERE form_type = %s and year = %s and "QT" = %s"""
+        for chunk in DBUtil.readChunks(sql, chunksize, (form_type, year, f'QTR{quater}')):
+            for _, row in chunk.iterrows():
+                yield row
+        return
+    source_df = pd.read_csv(f'./data/{year}_QTR{quater}.csv')
+    source_df = source_df[source_df['Form_Type'] == form_type]
+    for _, row in source_df.iterrows():
+        yield row
+
+
+def manifest_statements(manifests, url):
+    """マニフェストがあれば {'statements': statements_dict} を、なければ空の辞書を返す"""
+    manifest = manifests.get(filing_key(url))
+    return {} if manifest is None else {'statements': statement_urls(manifest)}
+
+
+def fetch_filing(filing):
+    """
+    パイプラインの取得stage。キャッシュフロー計算書のR fileをbytesで取得する
+    マニフェストがあればそのR fileを、なければFilingSummary.xmlから探す
+    """
+    # やり直しで同じdictがもう一度キューに入るので、マニフェストを取り除かない
+    statements_dict = filing.get('statements')
+    if statements_dict is None:
+        financial_statement = FinancialStatement(filing['url'])
+        statements_dict = financial_statement.statements_dict(financial_statement.report_list())
+    return {statement_name: (statement_url, http_get(statement_url).content)
+            for statement_name, statement_url in statements_dict.items() if '(2)' in statement_name}
+
+
+def parse_filing(filing, statements):
+    """パイプラインのパースstage。別のプロセスで取得済みのR fileをパースしてcash_flowの行を作る"""
+    attributes = {key: value for key, value in filing.items() if key != 'statements'}
+    cash_flow_dfs = [CashFlow(statement_name=statement_name, statement_url=statement_url, content=content,
+                              **attributes)._make_df()
+                     for statement_name, (statement_url, content) in statements.items()]
+    return pd.concat(cash_flow_dfs) if cash_flow_dfs else None
+
+
+def run_pipeline(filings, processed_filings, fetch_workers=8, parse_workers=None,
+                 budgets=None, filing_budget=None, retries=1, profile=None):
+    """
+    取得、パース、書き込みを別々のstageで同時に動かしてcash_flowを作る
+
+    Arguments:
+    ----------
+    filings: iterable
+        url, cik, year, quater, form_type を持つdict
+    processed_filings: ProcessedFilings
+        書き込んだファイリングを追加する
+    budgets, filing_budget, retries:
+        stageごとと1ファイリングの制限時間、制限時間を超えたか429や5xxだったファイリングをやり直す回数。Pipelineを参照
+    profile: ProfileReport
+        渡したときはファイリングごとのプロファイルをここに集める
+    """
+    def write(filing, cash_flow_df):
+        if cash_flow_df is None:
+            return
+        DBUtil.insertDf(cash_flow_df, 'cash_flow', if_exists="append", index=False)
+        processed_filings.update(cash_flow_df['source'])
+        # 行はもうcommitしてあるので、refreshに失敗してもファイリングを失敗にしない
+        time_series.refresh_or_log(cash_flow_df)
+
+    pipeline = Pipeline(fetch_filing, parse_filing, write, fetch_workers=fetch_workers, parse_workers=parse_workers,
+                        budgets=budgets, filing_budget=filing_budget, retries=retries, profile=profile)
+    pipeline.run(filing for filing in filings if filing['url'] not in processed_filings)
+    return pipeline
+
+
+def process_row(row, year, quater, form_type, manifests, processed_filings, results, deadline):
+    """
+    パイプラインを使わないときの1ファイリングの処理。キャッシュフロー計算書をcash_flowに書き込む
+    fetch(財務三表のURL)、extract(R fileの取得とパース)、write のstageごとに制限時間を確かめる
+
+    Arguments:
+    ----------
+    results: dict
+        損益計算書のヘッダと希薄化後EPSの項目名を追加する。runがresult.csvに書く
+    deadline: Deadline
+    """
+    FinancialStatement.cik = str(row['CIK'])
+    FinancialStatement.year = year
+    FinancialStatement.quater = quater
+    FinancialStatement.form_type = form_type
+    with deadline.stage('fetch'):
+        statements_dict = manifest_statements(manifests, row['url']).get('statements')
+        if statements_dict is None:
+            financial_statement = FinancialStatement(str(row['url']))
+            report_list = financial_statement.report_list()
+            statements_dict = financial_statement.statements_dict(report_list)
+
+    cash_flows = []
+    with deadline.stage('extract'):
+        for statement_name, statement_url in statements_dict.items():
+            if '(0)' in statement_name:
+                balance_sheet = BalanceSheet(statement_name=statement_name, statement_url=statement_url)
+            elif '(1)' in statement_name:
+                profit_loss = ProfitLoss(statement_name=statement_name, statement_url=statement_url)
+                logger.info(profit_loss.cik)
+                logger.info('='*80)
+                logger.info(f"header: {profit_loss.statements_data[0]['headers'][0][0]}")
+                results['header'].append(profit_loss.statements_data[0]['headers'][0][0])
+                logger.info(f"regex_diluted_name: {profit_loss.find_category_with_regex('diluted')}")
+                if len(profit_loss.find_category_with_regex('diluted')) > 1:
+                    results['diluted_match1'].append(profit_loss.find_category_with_regex('diluted')[0])
+                    results['diluted_match2'].append(profit_loss.find_category_with_regex('diluted')[1])
+                else:
+                    results['diluted_match1'].append(profit_loss.find_category_with_regex('diluted'))
+                    results['diluted_match2'].append(None)
+                results['url_list'].append(profit_loss.statement_url)
+                # profit_loss.insert_df('profit_loss')
+            elif '(2)' in statement_name:
+                cash_flows.append(CashFlow(statement_name=statement_name, statement_url=statement_url))
+
+    # 書き込みは途中で止めると戻せないので、超えても記録するだけにする
+    with deadline.stage('write', cancel=False):
+        for cash_flow in cash_flows:
+            cash_flow.insert_df('cash_flow')
+            processed_filings.add(cash_flow.statement_url)
+
+
+def run(start_year, end_year, start_quarter, end_quarter, form_type, source='csv', use_pipeline=False,
+        fetch_workers=8, parse_workers=None, force_reprocess=False, budgets=None, filing_budget=None, retries=1,
+        profile_dir=None):
+    """
+    start_yearからend_year、start_quarterからend_quarterまで(endは含まない)のファイリングを処理する
+
+    Arguments:
+    ----------
+    source: string
+        csvかdb。read_source_rowsを参照
+    use_pipeline: boolean
+        Trueのときは取得、パース、書き込みを並列のパイプラインで行う
+    force_reprocess: boolean
+        Trueのときは処理済みのファイリングも取得し直す
+    budgets, filing_budget, retries:
+        制限時間とやり直す回数。パイプラインを使わないときも、ファイリングごとにprocess_rowのstageで制限する。
+        run_pipelineを参照
+    profile_dir: string
+        指定したときはファイリングごとにcProfileとtracemallocでプロファイルを取り、
+        全ワーカーの分をまとめたレポートをここに書く
+    """
+    processed_filings = ProcessedFilings.load(force=force_reprocess)
+    profile = None if profile_dir is None else ProfileReport()
+    # マニフェストがあるファイリングはindex.jsonとFilingSummary.xmlを取得しない
+    manifests = load_manifests()
+    results = {'header': [], 'diluted_match1': [], 'diluted_match2': [], 'url_list': []}
+
+    for year in range(start_year, end_year):
+        for quater in range(start_quarter, end_quarter):
+            source_rows = read_source_rows(year, quater, form_type, source)
+            if use_pipeline:
+                filings = ({'url': str(row['url']), 'cik': str(row['CIK']), 'year': year, 'quater': quater,
+                            'form_type': form_type, **manifest_statements(manifests, row['url'])}
+                           for row in source_rows)
+                run_pipeline(filings, processed_filings, fetch_workers, parse_workers, budgets, filing_budget, retries,
+                             profile)
+                continue
+            # パイプラインと同じく、制限時間を超えたか429や5xxだったファイリングは待ってからやり直す
+            stats = DeadlineStats()
+            filings = source_rows
+            for attempt in range(retries + 1):
+                if attempt:
+                    logger.info(f'retrying {len(filings)} filings after {filings.wait(attempt - 1):.1f}s '
+                                f'({attempt}/{retries})')
+                retry = RetryQueue()
+                for row in filings:
+                    if str(row['url']) in processed_filings:
+                        logger.info(f"{row['url']} has already been processed")
+                        continue
+                    with nullcontext() if profile is None else profile.profile(str(row['url'])):
+                        try:
+                            process_row(row, year, quater, form_type, manifests, processed_filings, results,
+                                        Deadline(budgets, filing_budget, stats))
+                        except BaseException as e:
+                            if is_retryable(e):
+                                logger.warning(f"{row['url']} will be retried: {e}")
+                                retry.add(row, e)
+                                continue
+                            logger.error(e)
+                            logger.error(row)
+                filings = retry
+                if not filings:
+                    break
+            for row in filings:
+                logger.error(f"{row['url']} timed out or was throttled after {retries} retries")
+            logger.info(stats)
+    if profile is not None:
+        logger.info(f'profile: {profile.save(profile_dir)}')
+    pd.DataFrame(results).to_csv('./result.csv')
+
+
 if __name__ == '__main__':
     # 保存するファイル名を指定
     # log_folder = '{0}.log'.format(datetime.date.today())
     # ログの初期設定を行う
     logger = setup_logger('logging.log')
     start_year = 2018
-    year = 2018
     end_year = 2019
     start_quarter = 1
-    quater = 1
     end_quarter = 2
     form_type = '10-K'
-    # start_year = int(os.environ['start_year'])
-    # end_year = int(os.environ['end_year'])
-    # start_quarter = int(os.environ['start_quarter'])
-    # end_quarter = int(os.environ['end_quarter'])
-    # form_type = os.environ['form_type']
-    header_list = []
-    name_list_1 = []
-    name_list_2 = []
-    url_list = []
-
-    for year in range(start_year, end_year):
-        for quater in range(start_quarter, end_quarter):
-            source_df = pd.read_csv(f'./data/{year}_QTR{quater}.csv')
-            source_df = source_df[source_df['Form_Type'] == form_type]
-            for _, row in source_df.iterrows():
-                try:
-                    # logger.info(row)
-                    FinancialStatement.cik = str(row['CIK'])
-                    FinancialStatement.year = year
-                    FinancialStatement.quater = quater
-                    FinancialStatement.form_type = form_type
-                    financial_statement = FinancialStatement(str(row['url']))
-                    report_list = financial_statement.report_list()
-                    statements_dict = financial_statement.statements_dict(report_list)
-
-                    for statement_name, statement_url in statements_dict.items():
-                        if '(0)' in statement_name:
-                            balance_sheet = BalanceSheet(statement_name=statement_name, statement_url=statement_url)
-                        elif '(1)' in statement_name:
-                            profit_loss = ProfitLoss(statement_name=statement_name, statement_url=statement_url)
-                            logger.info(profit_loss.cik)
-                            logger.info('='*80)
-                            logger.info(f"header: {profit_loss.statements_data[0]['headers'][0][0]}")
-                            header_list.append(profit_loss.statements_data[0]['headers'][0][0])
-                            logger.info(f"regex_diluted_name: {profit_loss.find_category_with_regex('diluted')}")
-                            if len(profit_loss.find_category_with_regex('diluted')) > 1:
-                              name_list_1.append(profit_loss.find_category_with_regex('diluted')[0])
-                              name_list_2.append(profit_loss.find_category_with_regex('diluted')[1])
-                            else:
-                                name_list_1.append(profit_loss.find_category_with_regex('diluted'))
-                                name_list_2.append(None)
-                            url_list.append(profit_loss.statement_url)
-                            # profit_loss.insert_df('profit_loss')
-                        elif '(2)' in statement_name:
-                            cash_flow = CashFlow(statement_name=statement_name, statement_url=statement_url)
-                            cash_flow.insert_df('cash_flow')
-                except BaseException as e:
-                    logger.error(e)
-                    logger.error(row)
-    pd.DataFrame({'header': header_list, 'diluted_match1': name_list_1, 'diluted_match2': name_list_2, 'url_list': url_list}).to_csv('./result.csv')
+    # 環境変数から読む場合は cli.py の rfile を使う
+    run(start_year, end_year, start_quarter, end_quarter, form_type,
+        source=os.environ.get('source', 'csv'),
+        use_pipeline=os.environ.get('pipeline', '0') == '1',
+        fetch_workers=int(os.environ.get('fetch_workers', 8)),
+        parse_workers=int(os.environ.get('parse_workers', os.cpu_count())),
+        force_reprocess=os.environ.get('force_reprocess', '0') == '1')
@@ -0,0 +1,154 @@
+"""
+EDGARのスタブサーバーに対して、各処理のファイリング/秒を計測する
+
+    python experiment/load_test.py --filings 200 --latency 0.05 --error-rate 0.01 --max-rps 50
+
+DBへの書き込みは計測から外し、件数だけ数える。--sqliteを付けると組み込みのSQLiteに実際に書き込む
+
+    python experiment/load_test.py --sqlite :memory:
+"""
+import os
+import sys
+import time
+import argparse
+import logging
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'src'))
+sys.path.append(os.path.join(ROOT, 'experiment'))
+
+from edgar_server import EdgarServer, Filing, FIRST_CIK, INCOME_STATEMENT_TAGS, CASH_FLOW_TAGS
+
+
+class Result():
+    def __init__(self, name, filings, failed, seconds, profile=None):
+        self.name = name
+        self.filings = filings
+        self.failed = failed
+        self.seconds = seconds
+        # --profileのときに書いたレポートのパス
+        self.profile = profile
+
+    def __repr__(self):
+        rate = self.filings / self.seconds if self.seconds else 0.0
+        line = f'{self.name:<24} {self.filings:>6} filings {self.failed:>6} failed {self.seconds:>8.2f} s {rate:>8.2f} filings/s'
+        return line if self.profile is None else f'{line}\n{"":<24} profile: {self.profile}'
+
+
+# --sqliteのときは件数を数えてから元のinsertDfで書き込む
+WRITE = False
+
+
+def stub_insert(rows):
+    """DBUtil.insertDfの代わりに件数だけ数える"""
+    import db_util
+    insert = db_util.DBUtil.__dict__.get('_insertDf', db_util.DBUtil.insertDf)
+    db_util.DBUtil._insertDf = insert
+
+    def insertDf(df, table_name, if_exists="append", index=False, keys=None):
+        rows[table_name] = rows.get(table_name, 0) + len(df)
+        if WRITE:
+            insert(df, table_name, if_exists, index, keys)
+    db_util.DBUtil.insertDf = staticmethod(insertDf)
+    if not WRITE:
+        # company_seriesのCREATE TABLEもDBに行かないようにする。refreshの行はinsertDfで数える
+        import time_series
+        time_series.create_table = lambda: None
+
+
+def bench_full_index(year, quarter):
+    import load_url
+    rows = {}
+    stub_insert(rows)
+    start = time.time()
+    # download_full_indexはカレントディレクトリにxbrl.idxを落とすので、year年の4四半期を取得する
+    load_url.download_full_index(year, year + 1)
+    return Result('download_full_index', rows.get('base_info', 0), 0, time.time() - start)
+
+
+def bench_xbrl(filings):
+    import xbrl
+    tags = {'income_statement_item': INCOME_STATEMENT_TAGS, 'cash_flow_item': CASH_FLOW_TAGS}
+    failed = 0
+    start = time.time()
+    for filing in filings:
+        try:
+            income_statement = xbrl.IncomeStatement(base_url=filing.directory, tags=tags['income_statement_item'])
+            cash_flow = xbrl.CashflowStatement(url=income_statement.url, tags=tags['cash_flow_item'])
+            cash_flow.facts = income_statement.facts
+            income_statement.to_dict()
+            cash_flow.to_dict()
+        except Exception as e:
+            logging.warning(f'{filing.directory}: {e}')
+            failed += 1
+    return Result('xbrl.FinancialStatement', len(filings) - failed, failed, time.time() - start)
+
+
+def bench_rfile(filings, fetch_workers, parse_workers, profile_dir=None, retries=5):
+    import financial_statement
+    from profiling import ProfileReport
+    from processed_filings import ProcessedFilings
+    rows = {}
+    stub_insert(rows)
+    start = time.time()
+    items = ({'url': filing.directory + '/index.json', 'cik': str(filing.cik), 'year': filing.year,
+              'quater': filing.quarter, 'form_type': filing.form_type} for filing in filings)
+    profile = None if profile_dir is None else ProfileReport()
+    pipeline = financial_statement.run_pipeline(items, ProcessedFilings(), fetch_workers, parse_workers, retries=retries,
+                                                profile=profile)
+    seconds = time.time() - start
+    path = None if profile is None else profile.save(profile_dir)
+    return Result('experiment runner', pipeline.written, len(pipeline.failed) + len(pipeline.timed_out), seconds, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='EDGARのスタブサーバーに対する負荷試験')
+    parser.add_argument('--url', help='起動済みのスタブサーバー。指定がなければこのプロセスで起動する')
+    parser.add_argument('--filings', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--max-rps', type=int, default=0)
+    parser.add_argument('--year', type=int, default=2019)
+    parser.add_argument('--fetch-workers', type=int, default=8)
+    parser.add_argument('--parse-workers', type=int, default=None)
+    parser.add_argument('--benchmarks', nargs='+', default=['index', 'xbrl', 'rfile'])
+    parser.add_argument('--retries', type=int, default=5,
+                        help='rfileで制限時間を超えたか429や5xxだったファイリングをやり直す回数')
+    parser.add_argument('--profile', metavar='DIR', help='rfileのプロファイルをまとめたレポートをDIRに書く')
+    parser.add_argument('--sqlite', metavar='PATH', help='PostgreSQLの代わりにSQLiteに書き込む。:memory: でメモリ上のDB')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    global WRITE
+    if args.sqlite:
+        os.environ['DATABASE_BACKEND'] = 'sqlite'
+        os.environ['DATABASE_PATH'] = args.sqlite
+        WRITE = True
+
+    server = None
+    url = args.url
+    if url is None:
+        server = EdgarServer(filings=args.filings, latency=args.latency, error_rate=args.error_rate,
+                             max_rps=args.max_rps).start()
+        url = server.url
+    # 各モジュールはimportするときにSEC_BASE_URLを読む
+    os.environ['SEC_BASE_URL'] = url
+
+    filings = [Filing(FIRST_CIK + i, args.year, 1, i) for i in range(args.filings)]
+    results = []
+    try:
+        if 'index' in args.benchmarks:
+            results.append(bench_full_index(args.year, 1))
+        if 'xbrl' in args.benchmarks:
+            results.append(bench_xbrl(filings))
+        if 'rfile' in args.benchmarks:
+            results.append(bench_rfile(filings, args.fetch_workers, args.parse_workers, args.profile, args.retries))
+    finally:
+        if server is not None:
+            server.stop()
+    for result in results:
+        print(result)
+    return results
+
+
+if __name__ == '__main__':
+    main()
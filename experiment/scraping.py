@@ -1,3 +1,4 @@
+import os
 import csv
 import re
 import time
@@ -8,24 +9,13 @@ from enum import Enum
 from urllib.request import urlopen
 from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.common.exceptions import ElementNotInteractableException, NoSuchElementException
+from selenium.common.exceptions import ElementNotInteractableException, NoSuchElementException, WebDriverException
+from browser_pool import BrowserPool
 
-logging.basicConfig(filename='logs/development.log',level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Chrome のオプションを設定する
-options = webdriver.ChromeOptions()
-options.add_argument('--headless')
 
-# Selenium Server に接続する
-driver = webdriver.Remote(
-    command_executor='http://localhost:4444/wd/hub',
-    desired_capabilities=options.to_capabilities(),
-    options=options,
-)
-
-
-def get_table_id() -> int:
+def get_table_id(driver: webdriver) -> int:
     table = driver.find_element_by_class_name('report')
     table_id = table.get_attribute('id')
     logger.info(f'table_id: {table_id}')
@@ -33,7 +23,7 @@ def get_table_id() -> int:
     return table_id
 
 
-def get_table_contents(table_id: int) -> webdriver:
+def get_table_contents(driver: webdriver, table_id: int) -> webdriver:
     table_contents = driver.find_element_by_xpath(
         f"//*[@id='{table_id}']/tbody")
     return table_contents
@@ -55,7 +45,7 @@ def get_th_tag_num(table_contents: webdriver) -> int:
     return th_tag_num
 
 
-def get_td_tag_num(tr_tag_num: int) -> int:
+def get_td_tag_num(driver: webdriver, table_id: int, tr_tag_num: int) -> int:
     '''
     tableの列数を取得するメソッド。
     先頭行はheaderになっていて正しく列数を取得できないので、最終行から取得するようにする
@@ -76,7 +66,7 @@ def format_columns_to_df(columns: list):
     return df
 
 
-def get_statements_title_list():
+def get_statements_title_list(driver: webdriver):
     '''
     Financial Statementのタブをクリックして表示されるstatementの一覧を取得するメソッド
     '''
@@ -93,12 +83,12 @@ def get_statements_title_list():
     return statements_title_list
 
 
-def get_statement_title():
+def get_statement_title(driver: webdriver, url: str):
     '''
     Financial Statementのタブをクリックして表示されるstatementから
     balance sheet, income statement, cash flowを表示させる<a>のテキストを取得する
     '''
-    statements_title_list = get_statements_title_list()
+    statements_title_list = get_statements_title_list(driver)
     flag_dict = {'balance_sheet': False, 'income_statement': False, 'cash_flow': False}
 
     statements_url = []
@@ -133,61 +123,85 @@ def get_statement_title():
     return statements_url
 
 
-if __name__ == '__main__':
-    source_df = pd.read_csv('./data/2019_QTR4.csv')
-    source_df = source_df[source_df['Form_Type'] == '10-Q']
+def scrape_filing(driver: webdriver, filing: dict):
+    '''
+    1件のファイリングのビューアを開いて、財務三表をcsvに保存するメソッド
+    '''
+    cik = filing['cik']
+    accession_number = filing['accession_number']
+
+    # Financial Statementsタブを開いて財務三表を表示させる
+    url = f'https://www.sec.gov/cgi-bin/viewer?action=view&cik={cik}&accession_number={accession_number}&xbrl_type=v#'
+    logger.info(f'{url} + の情報を取得します')
+    driver.get(url)
+    try:
+        driver.find_element_by_xpath(
+            "//*[text()='Financial Statements']").click()
+    except NoSuchElementException:
+        time.sleep(5)
+        driver.find_element_by_xpath(
+            "//*[text()='Financial Statements']").click()
 
-    for _, row in source_df.iterrows():
-        cik = str(row['CIK'])
-        accession_number = row['accession_number']
 
-        # Financial Statementsタブを開いて財務三表を表示させる
-        url = f'https://www.sec.gov/cgi-bin/viewer?action=view&cik={cik}&accession_number={accession_number}&xbrl_type=v#'
-        logger.info(f'{url} + の情報を取得します ({_} / {len(source_df)})')
-        driver.get(url)
+    statements_title_list = get_statement_title(driver, url)
+
+    for title in statements_title_list:
         try:
-            driver.find_element_by_xpath(
-                "//*[text()='Financial Statements']").click()
-        except NoSuchElementException:
-            sleep(5)
-            driver.find_element_by_xpath(
-                "//*[text()='Financial Statements']").click()
+            driver.find_element_by_xpath(f"//*[text()='{title}']").click()
+            table_id = get_table_id(driver)
+            table_contents = get_table_contents(driver, table_id)
+            tr_tag_num = get_tr_tag_num(table_contents)
+            td_tag_num = get_td_tag_num(driver, table_id, tr_tag_num)
+
+            columns_list = [[] for i in range(td_tag_num)]
+
+            # headerの数を取得する
+            th_tag_num = get_th_tag_num(table_contents)
+            for tr in range(th_tag_num, tr_tag_num + 1):
+                for td in range(1, td_tag_num + 1):
+                    try:
+                        value = driver.find_element_by_xpath(
+                            f"//*[@id='{table_id}']/tbody/tr[{tr}]/td[{td}]").text
+                    except:
+                        value = driver.find_element_by_xpath(
+                            f"//*[@id='{table_id}']/tbody/tr[{tr}]/td[{td}]/a").text
+                    columns_list[td-1] += [value]
+
+            table_df = format_columns_to_df(columns_list)
+            row_df = table_df.iloc[:, 0:2].to_csv(
+                f"./{cik}_{title.replace(' ', '_')}")
+
+        except (NoSuchElementException, ElementNotInteractableException) as e:
+            logger.warning(f'title: {title} ERROR: {e}')
+        except WebDriverException:
+            # セッションが落ちたときは、BrowserPoolがセッションを作り直してファイリングをやり直す
+            raise
+        except Exception as e:
+            logger.warning(f'title: {title} ERROR: {e}')
+    logger.info('-'*140)
+
+
+def run(csv_path='./data/2019_QTR4.csv', form_type='10-Q', sessions=4, max_pages=50):
+    '''
+    csvのファイリングをBrowserPoolで並列に処理するメソッド
+
+    Parameters
+    ----------
+    sessions : int
+        並列に動かすブラウザの数
+    max_pages : int
+        セッションを作り直すまでのページ数
+    '''
+    source_df = pd.read_csv(csv_path)
+    source_df = source_df[source_df['Form_Type'] == form_type]
 
+    browser_pool = BrowserPool(size=sessions, max_pages=max_pages)
+    filings = ({'cik': str(row['CIK']), 'accession_number': row['accession_number']}
+               for _, row in source_df.iterrows())
+    return browser_pool.run(filings, scrape_filing)
 
-        statements_title_list = get_statement_title()
 
-        for title in statements_title_list:
-            try:
-                driver.find_element_by_xpath(f"//*[text()='{title}']").click()
-                table_id = get_table_id()
-                table_contents = get_table_contents(table_id)
-                tr_tag_num = get_tr_tag_num(table_contents)
-                td_tag_num = get_td_tag_num(tr_tag_num)
-
-                columns_list = [[] for i in range(td_tag_num)]
-
-                # headerの数を取得する
-                th_tag_num = get_th_tag_num(table_contents)
-                for tr in range(th_tag_num, tr_tag_num + 1):
-                    for td in range(1, td_tag_num + 1):
-                        try:
-                            value = driver.find_element_by_xpath(
-                                f"//*[@id='{table_id}']/tbody/tr[{tr}]/td[{td}]").text
-                        except:
-                            value = driver.find_element_by_xpath(
-                                f"//*[@id='{table_id}']/tbody/tr[{tr}]/td[{td}]/a").text
-                        columns_list[td-1] += [value]
-
-                table_df = format_columns_to_df(columns_list)
-                row_df = table_df.iloc[:, 0:2].to_csv(
-                    f"./{cik}_{title.replace(' ', '_')}")
-
-            except Exception as e:
-                logger.warning(f'title: {title} ERROR: {e}')
-
-
-                sql = f'''insert into blance_sheets {'(' + ','.join(row_df.iloc[0,:].astype(str).to_list()) + ')'}
-                          values {'(' + ','.join(row_df.iloc[1,:].astype(str).to_list()) + ')'}'''
-        logger.info('-'*140)
-    # ブラウザを終了する
-    driver.quit()
+if __name__ == '__main__':
+    logging.basicConfig(filename='logs/development.log',level=logging.INFO)
+    run(sessions=int(os.environ.get('browser_sessions', 4)),
+        max_pages=int(os.environ.get('max_pages', 50)))
@@ -0,0 +1,192 @@
+"""
+バッチのエントリーポイント
+
+    python src/cli.py index   # full-indexをbase_infoに入れる
+    python src/cli.py fsds 2019q4.zip  # Financial Statement Data Setsを入れる
+    python src/cli.py manifest  # index.jsonとFilingSummary.xmlからマニフェストを作る
+    python src/cli.py xbrl    # インスタンスxmlから財務諸表を取得する
+    python src/cli.py rfile   # R fileから財務諸表を取得する
+    python src/cli.py scrape  # ビューアをSeleniumで開いて財務諸表を取得する
+    python src/cli.py series --rebuild --export series.npz  # 会社ごとの時系列を作り直して書き出す
+
+起動を速くするため、各サブコマンドは自分が使うモジュールだけを関数の中でimportする。
+期間などのdefaultはDockerfileの環境変数から読む
+
+PostgreSQLがない環境では組み込みのSQLiteを使える
+
+    DATABASE_BACKEND=sqlite DATABASE_PATH=edgar.db python src/cli.py index
+"""
+import os
+import sys
+import argparse
+import logging
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'src'))
+sys.path.append(os.path.join(ROOT, 'experiment'))
+
+
+def env(name, default=None, type=str):
+    value = os.environ.get(name)
+    return default if value in (None, '') else type(value)
+
+
+def env_flag(name):
+    return env(name, '0') == '1'
+
+
+def index_command(args):
+    import load_url
+    load_url.download_full_index(args.start_year, args.end_year)
+
+
+def fsds_command(args):
+    import load_fsds
+    load_fsds.load_fsds(args.paths, form_type=args.form_type, force=args.force)
+
+
+def manifest_command(args):
+    import db_util
+    import filing_manifest
+    sql = '''SELECT base_url FROM base_info
+              WHERE form_type = %s and year = %s and "QT" = %s'''
+    for year in range(args.start_year, args.end_year):
+        for quater in range(args.start_quarter, args.end_quarter):
+            rows = db_util.DBUtil.readRows(sql, params=(args.form_type, year, f'QTR{quater}'))
+            filing_manifest.build_manifests([base_url for base_url, in rows], workers=args.workers)
+
+
+def xbrl_command(args):
+    import xbrl
+    for year in range(args.start_year, args.end_year):
+        for quater in range(args.start_quarter, args.end_quarter):
+            df, unresolved = xbrl.extract(year, quater, args.form_type, budgets=budgets(args),
+                                          filing_budget=args.filing_budget, retries=args.retries,
+                                          profile_dir=args.profile)
+            df.to_csv(f'./xbrl_{year}_QTR{quater}.csv', index=False)
+            if not unresolved.empty:
+                # 値のない行にせず、あとでやり直すファイリングとして別のファイルに残す
+                path = f'./xbrl_{year}_QTR{quater}_retry.csv'
+                unresolved.to_csv(path, index=False)
+                logging.warning(f'{len(unresolved)} filings timed out or were throttled, written to {path}')
+
+
+def rfile_command(args):
+    import financial_statement
+    financial_statement.run(args.start_year, args.end_year, args.start_quarter, args.end_quarter,
+                            args.form_type, source=args.source, use_pipeline=args.pipeline,
+                            fetch_workers=args.fetch_workers, parse_workers=args.parse_workers,
+                            force_reprocess=args.force, budgets=budgets(args),
+                            filing_budget=args.filing_budget, retries=args.retries, profile_dir=args.profile)
+
+
+def scrape_command(args):
+    import scraping
+    scraping.run(args.csv_path, form_type=args.form_type, sessions=args.sessions, max_pages=args.max_pages)
+
+
+def series_command(args):
+    import time_series
+    if args.rebuild:
+        time_series.rebuild()
+    if args.export:
+        store = time_series.TimeSeriesStore.from_db()
+        store.save(args.export)
+        logging.info(f'{len(store.ciks)} companies, {len(store.periods)} periods written to {args.export}')
+
+
+def add_period_arguments(parser):
+    # rangeと同じで、end_year, end_quarterは含まない
+    parser.add_argument('--start-year', type=int, default=env('start_year', 2012, int))
+    parser.add_argument('--end-year', type=int, default=env('end_year', 2013, int))
+    parser.add_argument('--start-quarter', type=int, default=env('start_quarter', 1, int))
+    parser.add_argument('--end-quarter', type=int, default=env('end_quarter', 2, int))
+
+
+def add_deadline_arguments(parser):
+    # 秒。0以下はそのstageを制限しない
+    parser.add_argument('--fetch-budget', type=float, default=env('fetch_budget', 60, float))
+    parser.add_argument('--parse-budget', type=float, default=env('parse_budget', 30, float))
+    parser.add_argument('--extract-budget', type=float, default=env('extract_budget', 30, float))
+    parser.add_argument('--write-budget', type=float, default=env('write_budget', 60, float))
+    parser.add_argument('--filing-budget', type=float, default=env('filing_budget', 120, float),
+                        help='1ファイリングの制限時間(秒)')
+    parser.add_argument('--retries', type=int, default=env('retries', 1, int),
+                        help='制限時間を超えたファイリングと429や5xxで失敗したファイリングを最後にやり直す回数')
+
+
+def budgets(args):
+    budgets = {'fetch': args.fetch_budget, 'parse': args.parse_budget,
+               'extract': args.extract_budget, 'write': args.write_budget}
+    return {stage: seconds for stage, seconds in budgets.items() if seconds > 0}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='SEC EDGARから財務諸表を取得するバッチ')
+    parser.add_argument('--form-type', default=env('form_type', '10-Q'))
+    parser.add_argument('--log-file', metavar='PATH', default=env('log_file'), help='ログをPATHにも書く')
+    parser.add_argument('--profile', metavar='DIR', default=env('profile_dir'),
+                        help='ファイリングごとのcProfileとtracemallocをまとめたレポートをDIRに書く')
+    parser.add_argument('--force', action='store_true', default=env_flag('force_reprocess'),
+                        help='処理済みのファイリングも取得し直す')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    parser_index = subparsers.add_parser('index', help='full-indexのxbrl.idxをbase_infoに入れる')
+    parser_index.add_argument('--start-year', type=int, default=2010)
+    parser_index.add_argument('--end-year', type=int, default=None, help='この年の前年まで。defaultは今年')
+    parser_index.set_defaults(func=index_command)
+
+    parser_fsds = subparsers.add_parser('fsds', help='Financial Statement Data Setsのzipを入れる')
+    parser_fsds.add_argument('paths', nargs='+')
+    parser_fsds.set_defaults(func=fsds_command)
+
+    parser_manifest = subparsers.add_parser('manifest', help='ファイリングのマニフェストを作る')
+    add_period_arguments(parser_manifest)
+    parser_manifest.add_argument('--workers', type=int, default=env('fetch_workers', 8, int))
+    parser_manifest.set_defaults(func=manifest_command)
+
+    parser_xbrl = subparsers.add_parser('xbrl', help='インスタンスxmlから財務諸表を取得する')
+    add_period_arguments(parser_xbrl)
+    add_deadline_arguments(parser_xbrl)
+    parser_xbrl.set_defaults(func=xbrl_command)
+
+    parser_rfile = subparsers.add_parser('rfile', help='R fileから財務諸表を取得する')
+    add_period_arguments(parser_rfile)
+    add_deadline_arguments(parser_rfile)
+    parser_rfile.add_argument('--source', choices=['csv', 'db'], default=env('source', 'csv'))
+    parser_rfile.add_argument('--pipeline', action='store_true', default=env_flag('pipeline'))
+    parser_rfile.add_argument('--fetch-workers', type=int, default=env('fetch_workers', 8, int))
+    parser_rfile.add_argument('--parse-workers', type=int, default=env('parse_workers', None, int))
+    parser_rfile.set_defaults(func=rfile_command)
+
+    parser_scrape = subparsers.add_parser('scrape', help='ビューアをSeleniumで開いて財務諸表を取得する')
+    parser_scrape.add_argument('csv_path', nargs='?', default='./data/2019_QTR4.csv')
+    parser_scrape.add_argument('--sessions', type=int, default=env('browser_sessions', 4, int))
+    parser_scrape.add_argument('--max-pages', type=int, default=env('max_pages', 50, int))
+    parser_scrape.set_defaults(func=scrape_command)
+
+    parser_series = subparsers.add_parser('series', help='会社ごとの時系列(company_series)を作る')
+    parser_series.add_argument('--rebuild', action='store_true', help='cash_flowとprofit_lossの全行から作り直す')
+    parser_series.add_argument('--export', metavar='PATH', help='TimeSeriesStoreをnpzに書き出す')
+    parser_series.set_defaults(func=series_command)
+    return parser
+
+
+def setup_logging(log_file=None):
+    """ルートのロガーだけを1回設定する。各モジュールのロガーはここに伝わるので、ハンドラを足さない"""
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        handlers=handlers)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    setup_logging(args.log_file)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,20 @@
+import io
 import os
+import uuid
+import sqlite3
+import threading
 import psycopg2 as pg
+import pandas as pd
 import logging
+from time import sleep
 from sqlalchemy import create_engine
 
-class DBUtil():
-    @staticmethod
-    def getConnect():
+
+class PostgresBackend():
+    """
+    DATABASE_USERNAME, DATABASE_HOST, DATABASE_PASSWORD, DATABASE_PORT, DATABASE_NAME で接続するPostgreSQL
+    """
+    def connect(self):
         conn = pg.connect(
             user=os.environ["DATABASE_USERNAME"],
             host=os.environ["DATABASE_HOST"],
@@ -17,8 +26,7 @@ class DBUtil():
         logging.info(conn)
         return conn
 
-    @staticmethod
-    def getEngine():
+    def engine(self):
         engine = create_engine(
             "postgresql://" +
             os.environ["DATABASE_USERNAME"] +
@@ -32,8 +40,244 @@ class DBUtil():
             os.environ["DATABASE_NAME"] + "")
         return engine
 
+    def execute(self, sql, params=None):
+        conn = self.connect()
+        try:
+            with conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(sql, params)
+        finally:
+            conn.close()
+
+    def fetch(self, sql, fetch_size, params):
+        """名前付きカーソル(サーバーサイドカーソル)からfetch_size行ずつ (rows, columns) を返す"""
+        conn = self.connect()
+        try:
+            # 名前付きカーソルはトランザクションの中でしか使えない
+            with conn:
+                with conn.cursor(name=f'stream_{uuid.uuid4().hex}') as cursor:
+                    cursor.itersize = fetch_size
+                    cursor.execute(sql, params)
+                    while True:
+                        rows = cursor.fetchmany(fetch_size)
+                        if not rows:
+                            break
+                        yield rows, [column[0] for column in cursor.description]
+        finally:
+            conn.close()
+
+    def insert(self, df, table_name, if_exists, index):
+        try:
+            engine = self.engine()
+        except:
+            sleep(5)
+            engine = self.engine()
+        df.to_sql(table_name, engine, if_exists=if_exists, index=index)
+
+    @staticmethod
+    def _copy_csv(df):
+        """
+        COPYに渡すCSVを作る
+        NaNのためにfloatになった整数のカラム(year, quater, accessionなど)は、2019.0 のままだと
+        integerのカラムにCOPYできないのでInt64にして 2019 と書く
+        """
+        df = df.copy()
+        for column in df.columns[[dtype.kind == 'f' for dtype in df.dtypes]]:
+            values = df[column].dropna()
+            if (values % 1 == 0).all() and (values.abs() < 2 ** 63).all():
+                df[column] = df[column].astype('Int64')
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        return buffer
+
+    def upsert(self, df, table_name, keys):
+        """
+        一時テーブルにCOPYでまとめて入れてから、1つのトランザクションで
+        INSERT ... ON CONFLICT でtable_nameにマージする
+        """
+        columns = list(df.columns)
+        staging_table_name = f'{table_name}_staging'
+        buffer = self._copy_csv(df)
+
+        conn = self.connect()
+        try:
+            # with conn はブロックを抜けるときにcommitし、例外のときはrollbackする
+            with conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(f'CREATE TEMP TABLE "{staging_table_name}" '
+                                   f'(LIKE "{table_name}" INCLUDING DEFAULTS) ON COMMIT DROP')
+                    cursor.copy_expert(f'COPY "{staging_table_name}" ({DBUtil._quote(columns)}) '
+                                       f"FROM STDIN WITH CSV NULL ''", buffer)
+                    cursor.execute(DBUtil._upsert_sql(table_name, staging_table_name, columns, keys))
+                    logging.info(f'{cursor.rowcount} rows upserted into {table_name}')
+        finally:
+            conn.close()
+
+
+class SQLiteBackend():
+    """
+    外部のサーバーなしで動かすためのSQLite。開発やベンチマーク、CIで使う
+
+    SQLの %s のパラメータは ? に置き換える。テーブルはinsertDfやupsertDfのときにdfから作る
+
+    Attributes
+    ----------
+    path : str
+        DBのファイルのパス。':memory:' のときはプロセスの中だけのDBにする
+    """
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self.uri = path == ':memory:'
+        if self.uri:
+            # 接続ごとに別のDBにならないように共有キャッシュにして、最後の接続が閉じて消えないように1つ開いておく
+            self.database = f'file:edgar_{uuid.uuid4().hex}?mode=memory&cache=shared'
+            self._keep_alive = self.connect()
+        else:
+            self.database = path
+
+    def connect(self):
+        return sqlite3.connect(self.database, uri=self.uri, check_same_thread=False, timeout=30)
+
+    def engine(self):
+        return create_engine('sqlite://', creator=self.connect)
+
+    @staticmethod
+    def _sql(sql):
+        return sql.replace('%s', '?')
+
+    def execute(self, sql, params=None):
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute(self._sql(sql), params or ())
+        finally:
+            conn.close()
+
+    def fetch(self, sql, fetch_size, params):
+        conn = self.connect()
+        try:
+            cursor = conn.execute(self._sql(sql), params or ())
+            columns = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield rows, columns
+        finally:
+            conn.close()
+
+    def insert(self, df, table_name, if_exists, index):
+        conn = self.connect()
+        try:
+            df.to_sql(table_name, conn, if_exists=if_exists, index=index)
+        finally:
+            conn.close()
+
+    def upsert(self, df, table_name, keys):
+        """
+        INSERT ... ON CONFLICT をexecutemanyでまとめて実行する
+        テーブルがなければkeysをprimary keyにして作り、あればkeysのunique indexを作る
+        """
+        columns = list(df.columns)
+        values = ', '.join('?' for _ in columns)
+        conflict = DBUtil._conflict_sql(columns, keys)
+        sql = f'INSERT INTO "{table_name}" ({DBUtil._quote(columns)}) VALUES ({values}) ON CONFLICT ({DBUtil._quote(keys)}) {conflict}'
+        rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+        conn = self.connect()
+        try:
+            with conn:
+                exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)).fetchone()
+                if exists:
+                    conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{table_name}_{"_".join(keys)}_key" '
+                                 f'ON "{table_name}" ({DBUtil._quote(keys)})')
+                else:
+                    conn.execute(pd.io.sql.get_schema(df, table_name, keys=keys, con=conn))
+                cursor = conn.executemany(sql, rows)
+                logging.info(f'{cursor.rowcount} rows upserted into {table_name}')
+        finally:
+            conn.close()
+
+
+BACKENDS = {'postgres': PostgresBackend, 'sqlite': SQLiteBackend}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+class DBUtil():
     @staticmethod
-    def insertDf(df, table_name, if_exists="append", index=False):
+    def backend():
+        """
+        DATABASE_BACKEND(postgres か sqlite, defaultはpostgres)のバックエンド
+        sqliteのときはDATABASE_PATHのファイルを使う。defaultはメモリ上のDB
+        同じ設定のあいだは同じインスタンスを返す
+        """
+        name = os.environ.get('DATABASE_BACKEND', 'postgres')
+        if name not in BACKENDS:
+            raise ValueError(f'unknown DATABASE_BACKEND: {name}')
+        key = (name, os.environ.get('DATABASE_PATH', ':memory:') if name == 'sqlite' else None)
+        with _backends_lock:
+            if key not in _backends:
+                _backends[key] = BACKENDS[name]() if key[1] is None else BACKENDS[name](key[1])
+            return _backends[key]
+
+    @staticmethod
+    def getConnect():
+        return DBUtil.backend().connect()
+
+    @staticmethod
+    def getEngine():
+        return DBUtil.backend().engine()
+
+    @staticmethod
+    def execute(sql, params=None):
+        """結果を返さないSQL(CREATE TABLEなど)を1つのトランザクションで実行する"""
+        DBUtil.backend().execute(sql, params)
+
+    @staticmethod
+    def readRows(sql, fetch_size=10000, params=None):
+        """
+        SELECTの結果を少しずつ取得して、1行ずつtupleで返すジェネレータ
+        PostgreSQLではサーバーサイドカーソルを使い、結果をすべてクライアントのメモリに載せないので、件数が多くてもメモリは一定
+
+        Arguments:
+        ----------
+        sql: string
+            実行するSELECT文
+        fetch_size: int
+            1回のラウンドトリップで取得する行数
+        params: tuple or dict
+            sqlに渡すパラメータ
+        """
+        for rows, _ in DBUtil._fetch(sql, fetch_size, params):
+            yield from rows
+
+    @staticmethod
+    def readChunks(sql, chunksize=10000, params=None):
+        """
+        SELECTの結果をchunksize行ずつのdataframeで返すジェネレータ
+
+        Arguments:
+        ----------
+        sql: string
+            実行するSELECT文
+        chunksize: int
+            1つのdataframeの行数
+        params: tuple or dict
+            sqlに渡すパラメータ
+        """
+        for rows, columns in DBUtil._fetch(sql, chunksize, params):
+            yield pd.DataFrame.from_records(rows, columns=columns)
+
+    @staticmethod
+    def _fetch(sql, fetch_size, params):
+        """fetch_size行ずつ (rows, columns) を返す。PostgreSQLではサーバーサイドカーソルを使う"""
+        yield from DBUtil.backend().fetch(sql, fetch_size, params)
+
+    @staticmethod
+    def insertDf(df, table_name, if_exists="append", index=False, keys=None):
         """
         dfをinsertするメソッド
 
@@ -44,15 +288,59 @@ class DBUtil():
         table_name: string
          dataframeを格納したいテーブル名
         if_exists: string
-            データベースにデータが存在しているとき、appendするかreplaceするか選ぶ
+            データベースにデータが存在しているとき、appendするかreplaceするかupsertするか選ぶ
             defaultはappend
         index: boolean
             dataframeのindexを格納するかどうか。
             defaultはFalse
+        keys: list
+            upsertのときに重複を判定するカラム。
+            テーブルにこのカラムのunique制約かprimary keyが必要
         """
-        try:
-            engine = DBUtil.getEngine()
-        except:
-            sleep(5)
-            engine = DBUtil.getEngine()
-        df.to_sql(table_name, engine, if_exists=if_exists, index=index)
+        if if_exists == "upsert":
+            DBUtil.upsertDf(df.reset_index() if index else df, table_name, keys)
+            return
+        DBUtil.backend().insert(df, table_name, if_exists, index)
+
+    @staticmethod
+    def _quote(names):
+        """"QT" のような大文字のカラムもそのまま使えるように、カラム名をダブルクォートで囲む"""
+        return ', '.join(f'"{name}"' for name in names)
+
+    @staticmethod
+    def _upsert_sql(table_name, staging_table_name, columns, keys):
+        """staging tableからtable_nameへ INSERT ... ON CONFLICT するSQLを作る"""
+        quote = DBUtil._quote
+        return (f'INSERT INTO "{table_name}" ({quote(columns)}) '
+                f'SELECT {quote(columns)} FROM "{staging_table_name}" '
+                f'ON CONFLICT ({quote(keys)}) {DBUtil._conflict_sql(columns, keys)}')
+
+    @staticmethod
+    def _conflict_sql(columns, keys):
+        """ON CONFLICTのあとに続ける、keys以外のカラムを更新するSQL"""
+        updates = [column for column in columns if column not in keys]
+        if updates:
+            return 'DO UPDATE SET ' + ', '.join(f'"{column}" = EXCLUDED."{column}"' for column in updates)
+        return 'DO NOTHING'
+
+    @staticmethod
+    def upsertDf(df, table_name, keys):
+        """
+        dfをupsertするメソッド
+        1つのトランザクションで INSERT ... ON CONFLICT でtable_nameにマージする
+        PostgreSQLでは一時テーブルにCOPYでまとめて入れてからマージする
+
+        Arguments:
+        ----------
+        df: dataframe
+            DBにupsertしたいdataframe
+        table_name: string
+            dataframeを格納したいテーブル名
+        keys: list
+            重複を判定するカラム。テーブルにこのカラムのunique制約かprimary keyが必要
+        """
+        if not keys:
+            raise ValueError('keys are required to upsert')
+        # 同じバッチの中で同じキーが重複しているとON CONFLICTがエラーになるので、後の行を残す
+        df = df.drop_duplicates(subset=keys, keep='last')
+        DBUtil.backend().upsert(df, table_name, keys)
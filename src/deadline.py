@@ -0,0 +1,208 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+import requests
+
+# 1回のリクエストのタイムアウト(秒)。接続と読み込みの待ち時間それぞれの上限になる
+HTTP_TIMEOUT = float(os.environ.get('http_timeout', 30))
+
+# stageごとの制限時間(秒)と、1ファイリングの制限時間(秒)
+DEFAULT_BUDGETS = {'fetch': 60.0, 'parse': 30.0, 'extract': 30.0, 'write': 60.0}
+DEFAULT_FILING_BUDGET = 120.0
+
+# やり直す前に待つ時間(秒)。Retry-Afterがなければ BACKOFF, 2 * BACKOFF, 4 * BACKOFF ... と延ばし、MAX_BACKOFFで止める
+BACKOFF = float(os.environ.get('backoff', 1))
+MAX_BACKOFF = float(os.environ.get('max_backoff', 60))
+
+_local = threading.local()
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage, elapsed):
+        super().__init__(f'{stage} exceeded its deadline ({elapsed:.1f}s)')
+        self.stage = stage
+        self.elapsed = elapsed
+
+
+def is_retryable(e):
+    """
+    時間をおいてやり直せば成功しうる例外か
+    制限時間を超えたときと、429(リクエストが多すぎる)や5xx(サーバーのエラー)のレスポンス
+    """
+    if isinstance(e, DeadlineExceeded):
+        return True
+    response = e.response if isinstance(e, requests.HTTPError) else None
+    return response is not None and (response.status_code == 429 or response.status_code >= 500)
+
+
+def retry_after(e):
+    """429や503のレスポンスのRetry-After(秒)。ないとき(日付の形式のときも)はNone"""
+    response = e.response if isinstance(e, requests.HTTPError) else None
+    if response is None:
+        return None
+    try:
+        return max(float(response.headers.get('Retry-After')), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryQueue(list):
+    """
+    やり直すアイテムのリスト
+
+    Retry-Afterのうち一番長いものを覚えておき、やり直す前にその時間だけ待つ。
+    Retry-Afterがなければ上限付きの指数バックオフで待つ。複数のスレッドからaddする
+    """
+    def __init__(self, backoff=None, max_backoff=None):
+        super().__init__()
+        self.backoff = BACKOFF if backoff is None else backoff
+        self.max_backoff = MAX_BACKOFF if max_backoff is None else max_backoff
+        self.retry_after = None
+        self.lock = threading.Lock()
+
+    def add(self, item, e):
+        seconds = retry_after(e)
+        with self.lock:
+            self.append(item)
+            if seconds is not None:
+                self.retry_after = max(seconds, self.retry_after or 0.0)
+
+    def delay(self, attempt):
+        """attempt回目(0から)のやり直しの前に待つ秒数"""
+        if self.retry_after is not None:
+            return min(self.retry_after, self.max_backoff)
+        return min(self.backoff * 2 ** attempt, self.max_backoff)
+
+    def wait(self, attempt):
+        """delay(attempt)秒待って、待った秒数を返す"""
+        seconds = self.delay(attempt)
+        time.sleep(seconds)
+        return seconds
+
+
+class DeadlineStats():
+    """stageごとに制限時間を超えた回数を数える。複数のスレッドから使う"""
+    def __init__(self):
+        self.fired = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage):
+        with self.lock:
+            self.fired[stage] = self.fired.get(stage, 0) + 1
+
+    def __repr__(self):
+        return 'deadlines fired: ' + (', '.join(f'{stage}={count}' for stage, count in self.fired.items()) or 'none')
+
+
+class Deadline():
+    """
+    1ファイリングの処理の制限時間
+
+    stage()の中の処理はremaining()やcheck()で残り時間を確かめて、自分で止まる(協調的なキャンセル)。
+    stageを抜けたときに制限時間を超えていればDeadlineExceededを送出する。
+    ファイリング全体の制限時間は各stageで実際に処理した時間の合計で数え、キューで待った時間は含めない
+
+    Attributes
+    ----------
+    budgets : dict
+        {stage: 秒}。ないstageは制限しない
+    filing_budget : float
+        1ファイリングの制限時間(秒)。Noneのときは制限しない
+    stats : DeadlineStats
+        制限時間を超えた回数を記録する
+    """
+    def __init__(self, budgets=None, filing_budget=None, stats=None):
+        self.budgets = DEFAULT_BUDGETS if budgets is None else budgets
+        self.filing_budget = filing_budget
+        self.stats = stats
+        self.spent = 0.0
+        self.stage_name = None
+        self.stage_start = None
+
+    def _elapsed(self):
+        return time.monotonic() - self.stage_start
+
+    def remaining(self):
+        """今のstageの残り時間(秒)。制限がなければNone"""
+        if self.stage_name is None:
+            return None
+        limits = []
+        if self.budgets.get(self.stage_name) is not None:
+            limits.append(self.budgets[self.stage_name] - self._elapsed())
+        if self.filing_budget is not None:
+            limits.append(self.filing_budget - self.spent - self._elapsed())
+        return min(limits) if limits else None
+
+    def expire(self):
+        """制限時間を超えたことを記録してDeadlineExceededを送出する"""
+        if self.stats is not None:
+            self.stats.record(self.stage_name)
+        raise DeadlineExceeded(self.stage_name, self._elapsed())
+
+    def check(self):
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            self.expire()
+
+    def timeout(self):
+        """リクエストに付けるタイムアウト。HTTP_TIMEOUTとstageの残り時間の短い方"""
+        self.check()
+        remaining = self.remaining()
+        return HTTP_TIMEOUT if remaining is None else min(HTTP_TIMEOUT, remaining)
+
+    @contextmanager
+    def stage(self, name, cancel=True):
+        """
+        stageの処理時間を計る。この中ではhttp_getがこのDeadlineを使う
+
+        Arguments:
+        ----------
+        name: string
+            fetch, parse, extract, write など
+        cancel: boolean
+            Falseのときは制限時間を超えても記録するだけで例外にしない(書き込みのように戻せない処理に使う)
+        """
+        self.stage_name = name
+        self.stage_start = time.monotonic()
+        previous = getattr(_local, 'deadline', None)
+        _local.deadline = self
+        try:
+            self.check()
+            yield self
+            remaining = self.remaining()
+            if remaining is not None and remaining <= 0:
+                if cancel:
+                    self.expire()
+                elif self.stats is not None:
+                    self.stats.record(name)
+        finally:
+            self.spent += self._elapsed()
+            self.stage_name = None
+            _local.deadline = previous
+
+
+def current():
+    """今のスレッドで実行中のDeadline"""
+    return getattr(_local, 'deadline', None)
+
+
+def http_get(url, **kwargs):
+    """
+    タイムアウトを付けたrequests.get
+    実行中のDeadlineがあれば、そのstageの残り時間もタイムアウトの上限にする
+    4xxと5xxのレスポンスはrequests.HTTPErrorにして、エラーページの中身をパースに渡さない
+    """
+    deadline = current()
+    timeout = HTTP_TIMEOUT if deadline is None else deadline.timeout()
+    try:
+        response = requests.get(url, timeout=timeout, **kwargs)
+        response.raise_for_status()
+        return response
+    except requests.Timeout:
+        # stageの残り時間で打ち切ったときは制限時間を超えたとして扱う
+        if deadline is not None and timeout < HTTP_TIMEOUT:
+            deadline.expire()
+        logging.warning(f'{url} timed out after {timeout:.1f}s')
+        raise
@@ -0,0 +1,87 @@
+import re
+
+CONTEXT_PATTERN = re.compile(r'^(xbrli:)?context$')
+DIMENSION_PATTERN = re.compile(r'^(xbrli:)?(segment|scenario)$')
+PERIOD_END_DATE = 'dei:DocumentPeriodEndDate'
+
+
+class MissingFact(ValueError):
+    """値を選ぶのに必要なファクトかコンテキストがない。XBRLでない文書(エラーページなど)もこれになる"""
+
+
+class Facts():
+    """
+    ファイリングのファクトとコンテキスト。FinancialStatementはこれから値を取得する
+    インスタンスxmlからはfrom_soupで、インラインXBRLからはixbrl.parse_ixbrlで作る
+
+    Attributes
+    ----------
+    contexts : dict
+        {contextref: {'start': 日付, 'end': 日付, 'dimensional': bool}}
+        日付は 2019-09-28 形式。instantのコンテキストはendにinstantを入れる
+    facts : dict
+        {'us-gaap:revenues' 形式の小文字の名前: [(contextref, 値の文字列)]}。文書の順
+    """
+    def __init__(self):
+        self.contexts = {}
+        self.facts = {}
+
+    def add_context(self, contextref, start=None, end=None, dimensional=False):
+        self.contexts[contextref] = {'start': start, 'end': end, 'dimensional': dimensional}
+
+    def add(self, name, contextref, value):
+        self.facts.setdefault(name.lower(), []).append((contextref, value))
+
+    def contextref(self, name):
+        """nameの最初のファクトのcontextref。なければNone"""
+        facts = self.facts.get(name.lower())
+        return facts[0][0] if facts else None
+
+    def text(self, name):
+        """nameの最初のファクトの値。なければNone"""
+        facts = self.facts.get(name.lower())
+        return facts[0][1] if facts else None
+
+    def end_date(self, contextref):
+        """contextrefの終了日。コンテキストがなければMissingFact"""
+        context = self.contexts.get(contextref)
+        if context is None:
+            raise MissingFact(f'context {contextref} not found')
+        return context['end']
+
+    def period_end_date(self):
+        """
+        dei:DocumentPeriodEndDateの値。ファイリングの値はこの日付のコンテキストから選ぶ
+        dei:DocumentPeriodEndDateかそのコンテキストがなければMissingFact
+        """
+        contextref = self.contextref(PERIOD_END_DATE)
+        if contextref is None:
+            raise MissingFact(f'{PERIOD_END_DATE} not found')
+        self.end_date(contextref)
+        return self.text(PERIOD_END_DATE)
+
+    def value(self, name, end_date):
+        """
+        コンテキストの終了日がend_dateのnameの値。なければNone
+        セグメントなどのディメンションがないコンテキスト(会社全体の値)を優先する
+        """
+        values = [(self.contexts[contextref]['dimensional'], value)
+                  for contextref, value in self.facts.get(name.lower(), [])
+                  if contextref in self.contexts and self.contexts[contextref]['end'] == end_date]
+        values.sort(key=lambda x: x[0])
+        return values[0][1] if values else None
+
+    @classmethod
+    def from_soup(cls, soup):
+        """インスタンスxmlのBeautifulSoupから作る"""
+        facts = cls()
+        for context in soup.find_all(CONTEXT_PATTERN):
+            dates = {}
+            for name in ('startdate', 'enddate', 'instant'):
+                tag = context.find(re.compile(rf'^(xbrli:)?{name}$'))
+                dates[name] = None if tag is None else tag.get_text().strip()
+            facts.add_context(context['id'], dates['startdate'], dates['enddate'] or dates['instant'],
+                              context.find(DIMENSION_PATTERN) is not None)
+        for tag in soup.find_all(contextref=True):
+            facts.add(tag.name, tag['contextref'], tag.get_text().strip())
+        return facts
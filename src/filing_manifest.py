@@ -0,0 +1,218 @@
+import os
+import re
+import json
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from bs4 import BeautifulSoup
+import db_util
+from deadline import http_get
+from processed_filings import filing_key
+
+# 負荷試験ではローカルのEDGARのスタブサーバーに向ける
+SEC_BASE_URL = os.environ.get('SEC_BASE_URL', 'https://www.sec.gov')
+
+TABLE_NAME = 'filing_manifest'
+
+CREATE_TABLE_SQL = f'''CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+    accession     bigint PRIMARY KEY,
+    cik           text,
+    base_url      text,
+    documents     text,
+    instance_name text,
+    statements    text,
+    created_at    text
+)'''
+
+# バランスシート、損益計算書、キャッシュフロー計算書の順
+STATEMENT_PATTERNS = [
+    ['.*balance.*', '.*financial ?position.*', '.*financial ?condition.*'],
+    ['.*of ?income.*', '.*of ?operation.*', '.*of ?earnings'],
+    ['.*cash ?flow.*'],
+]
+
+
+def parse_filing_summary(content, base_url):
+    """
+    FilingSummary.xmlから各レポートの名前とURLのリストを作る
+
+    Arguments:
+    ----------
+    content: bytes
+        FilingSummary.xmlの中身
+    base_url: string
+        レポートのファイル名の前に付けるURL
+    """
+    soup = BeautifulSoup(content, 'lxml')
+    # find the 'myreports' tag because this contains all the individual reports submitted.
+    reports = soup.find('myreports')
+    report_list = []
+    # loop through each report in the 'myreports' tag but avoid the last one as this will cause an error.
+    for report in reports.find_all('report')[:-1]:
+        report_dict = {'name_short': report.shortname.text, 'name_long': report.longname.text}
+        try:
+            report_dict['url'] = base_url + report.htmlfilename.text
+        except AttributeError:
+            report_dict['url'] = base_url + report.xmlfilename.text
+        report_list.append(report_dict)
+    return report_list
+
+
+def classify_statements(report_list):
+    """
+    レポートのリストから財務三表を選び {(0)name: url} の辞書にする
+    (0)はバランスシート、(1)は損益計算書、(2)はキャッシュフロー計算書
+    """
+    if all(re.match('paren', report_dict['name_short'], re.IGNORECASE) for report_dict in report_list):
+        return {}
+    statements_dict = {}
+    for index, patterns in enumerate(STATEMENT_PATTERNS):
+        for pattern in patterns:
+            tmp_title_dict = {}
+            for report_dict in report_list:
+                if re.match(pattern, report_dict['name_short'], re.IGNORECASE):
+                    key = f"({index}){report_dict['name_short']}"
+                    tmp_title_dict[key] = report_dict['url']
+            if len(tmp_title_dict) == 1:
+                statements_dict.update(tmp_title_dict)
+            elif len(tmp_title_dict) > 1:
+                statements_dict[min(tmp_title_dict)] = tmp_title_dict[min(tmp_title_dict)]
+    return statements_dict
+
+
+# R fileと、EDGARの添付資料(ex-21.htm, aapl-20200926xex211.htm, d817654dex991.htm, a10-kexhibit2119.htm など)と
+# インデックスのページ。exはファイル名の先頭か区切り文字、日付の数字の後にあるものだけにして、flex-20200331.htm を除かない
+EXCLUDED_DOCUMENT_PATTERN = re.compile(r'^R\d+\.htm$|exhibit|(^|[-_]|\d[dx]?)ex-?\d|[-_]index', re.IGNORECASE)
+
+
+def instance_document(items):
+    """
+    index.jsonのdirectory.itemから値を読む文書のファイル名を選ぶ
+    インラインXBRLのファイリング(主文書から取り出した_htm.xmlがある)は主文書の.htm、
+    _cal.xmlと同じ名前のインスタンスxmlがあればそのxml、
+    どちらもなければR fileと添付資料を除いた一番大きい.htm。見つからなければNone
+
+    Arguments:
+    ----------
+    items: list
+        name, size を持つdict
+    """
+    names = [item['name'] for item in items]
+    for name in names:
+        if name.endswith('_htm.xml'):
+            document = name[:-len('_htm.xml')] + '.htm'
+            return document if document in names else name
+    for name in names:
+        if name.endswith('_cal.xml') and name.replace('_cal.xml', '.xml') in names:
+            return name.replace('_cal.xml', '.xml')
+    documents = [item for item in items if item['name'].endswith('.htm')
+                 and not EXCLUDED_DOCUMENT_PATTERN.search(item['name'])]
+    if not documents:
+        return None
+    return max(documents, key=lambda item: int(item.get('size') or 0))['name']
+
+
+def build_manifest(base_url):
+    """
+    ファイリングのindex.jsonとFilingSummary.xmlを取得して、マニフェストを作る
+
+    Arguments:
+    ----------
+    base_url: string
+        /Archives/edgar/data/{cik}/{accession number} 形式のディレクトリ
+
+    Returns
+    -------
+    dict : accession, cik, base_url, documents, instance_name, statements
+        statementsの値はbase_urlからの相対パス
+    """
+    base_url = re.sub(r'/index\.json$', '', base_url)
+    content = http_get(SEC_BASE_URL + base_url + '/index.json').json()
+    documents = [item['name'] for item in content['directory']['item']]
+    manifest = {
+        'accession': filing_key(base_url),
+        'cik': base_url.split('/')[-2],
+        'base_url': base_url,
+        'documents': documents,
+        'instance_name': instance_document(content['directory']['item']),
+        'statements': {},
+    }
+    if 'FilingSummary.xml' in documents:
+        summary = http_get(SEC_BASE_URL + base_url + '/FilingSummary.xml').content
+        manifest['statements'] = classify_statements(parse_filing_summary(summary, ''))
+    return manifest
+
+
+def create_table():
+    db_util.DBUtil.execute(CREATE_TABLE_SQL)
+
+
+def save_manifests(manifests):
+    """マニフェストをまとめてupsertする"""
+    if not manifests:
+        return
+    df = pd.DataFrame(manifests)
+    df['documents'] = df['documents'].map(json.dumps)
+    df['statements'] = df['statements'].map(json.dumps)
+    df['created_at'] = datetime.now().strftime('%Y-%m-%d  %H:%M:%S')
+    db_util.DBUtil.insertDf(df, TABLE_NAME, if_exists='upsert', keys=['accession'])
+
+
+def load_manifests():
+    """
+    保存済みのマニフェストを読み込む
+
+    Returns
+    -------
+    dict : {accession: manifest}。filing_keyで引く
+    """
+    manifests = {}
+    sql = f'SELECT accession, cik, base_url, documents, instance_name, statements FROM {TABLE_NAME}'
+    try:
+        for accession, cik, base_url, documents, instance_name, statements in db_util.DBUtil.readRows(sql):
+            manifests[accession] = {'accession': accession, 'cik': cik, 'base_url': base_url,
+                                    'documents': json.loads(documents), 'instance_name': instance_name,
+                                    'statements': json.loads(statements)}
+    except Exception as e:
+        logging.warning(f'{TABLE_NAME} could not be loaded: {e}')
+    return manifests
+
+
+def statement_urls(manifest):
+    """マニフェストのstatementsを statements_dict と同じ {name: url} にする"""
+    return {name: SEC_BASE_URL + manifest['base_url'] + '/' + path for name, path in manifest['statements'].items()}
+
+
+def build_manifests(base_urls, workers=8, batch_size=500):
+    """
+    マニフェストがないファイリングだけマニフェストを作ってbatch_size件ずつ保存する
+
+    Arguments:
+    ----------
+    base_urls: iterable
+        /Archives/edgar/data/{cik}/{accession number} 形式のディレクトリ
+    workers: int
+        並列にリクエストするスレッドの数
+    """
+    create_table()
+    manifests = load_manifests()
+    base_urls = [base_url for base_url in base_urls if filing_key(base_url) not in manifests]
+    logging.info(f'building {len(base_urls)} manifests')
+
+    def build(base_url):
+        try:
+            return build_manifest(base_url)
+        except Exception as e:
+            logging.warning(f'{base_url}: {e}')
+            return None
+
+    batch = []
+    with ThreadPoolExecutor(workers) as executor:
+        for manifest in executor.map(build, base_urls):
+            if manifest is not None:
+                batch.append(manifest)
+            if len(batch) >= batch_size:
+                save_manifests(batch)
+                batch = []
+    save_manifests(batch)
@@ -0,0 +1,157 @@
+"""
+インラインXBRL(iXBRL)のファイリングから、主文書の.htmを1回だけ走査してファクトを取り出す
+
+2019年以降のファイリングの多くは_cal.xmlや別のインスタンスxmlがなく、ファクトが.htmの中にある。
+ix:nonFraction と ix:nonNumeric をファクトに、ix:resources の xbrli:context をコンテキストにして、
+インスタンスxmlと同じFactsにする。数値はscaleとsignを適用した文字列にする
+"""
+import io
+import re
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from lxml import etree
+from facts import Facts
+
+IX_NAMESPACES = ('http://www.xbrl.org/2013/inlineXBRL', 'http://www.xbrl.org/2008/inlineXBRL')
+XBRLI_NAMESPACE = 'http://www.xbrl.org/2003/instance'
+XSI_NIL = '{http://www.w3.org/2001/XMLSchema-instance}nil'
+
+MONTHS = {name: i for i, name in enumerate(['jan', 'feb', 'mar', 'apr', 'may', 'jun',
+                                            'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], 1)}
+# 値が0のときに使われる文字
+ZERO_TEXTS = ('', '-', '–', '—')
+
+
+def is_inline(content):
+    """contentがインラインXBRLの文書か"""
+    return any(namespace.encode() in content for namespace in IX_NAMESPACES)
+
+
+def _split(tag):
+    """'{namespace}name' を (namespace, name) にする"""
+    if not isinstance(tag, str) or not tag.startswith('{'):
+        return '', tag
+    namespace, _, name = tag[1:].partition('}')
+    return namespace, name
+
+
+def _format_name(element):
+    """format属性の 'ixt:num-dot-decimal' を 'numdotdecimal' にする"""
+    return element.get('format', '').rpartition(':')[2].lower().replace('-', '')
+
+
+def _number_text(number):
+    if number == number.to_integral_value():
+        return str(int(number))
+    return format(number.normalize(), 'f')
+
+
+def nonfraction_value(element):
+    """
+    ix:nonFractionの値をformat、scale、signを適用した数値の文字列にする。xsi:nilのときはNone
+    """
+    if element.get(XSI_NIL) == 'true':
+        return None
+    text = ''.join(element.itertext()).strip()
+    format_name = _format_name(element)
+    if format_name in ('zerodash', 'fixedzero') or text in ZERO_TEXTS:
+        number = Decimal(0)
+    else:
+        digits = re.sub(r'[^0-9,.]', '', text)
+        if 'commadecimal' in format_name:
+            digits = digits.replace('.', '').replace(',', '.')
+        else:
+            digits = digits.replace(',', '')
+        try:
+            number = Decimal(digits)
+        except InvalidOperation:
+            return None
+    number = number.scaleb(int(element.get('scale', 0)))
+    if element.get('sign') == '-':
+        number = -number
+    return _number_text(number)
+
+
+def date_value(format_name, text):
+    """
+    ixtの日付の変換(datemonthdayyearen, dateslashus, datedaymonthyearなど)で 2019-09-28 形式にする
+    変換できないときはtextのまま
+    """
+    numbers = [int(number) for number in re.findall(r'\d+', text)]
+    month = next((MONTHS[word[:3].lower()] for word in re.findall(r'[A-Za-z]+', text) if word[:3].lower() in MONTHS), None)
+    order = format_name[len('date'):]
+    try:
+        if month is not None:
+            day, year = (numbers[1], numbers[0]) if order.startswith('year') else (numbers[0], numbers[-1])
+        elif order.startswith('year'):
+            year, month, day = numbers[:3]
+        elif order.startswith('day') or 'eu' in order:
+            day, month, year = numbers[:3]
+        else:
+            month, day, year = numbers[:3]
+        if year < 100:
+            year += 2000
+        return date(year, month, day).isoformat()
+    except (IndexError, ValueError):
+        return text
+
+
+def nonnumeric_value(element):
+    text = ''.join(element.itertext()).strip()
+    format_name = _format_name(element)
+    if format_name.startswith('date'):
+        return date_value(format_name, text)
+    return text
+
+
+def _add_context(facts, element):
+    dates = {}
+    dimensional = False
+    for child in element.iter():
+        _, name = _split(child.tag)
+        if name in ('startDate', 'endDate', 'instant'):
+            dates[name] = (child.text or '').strip()
+        elif name in ('segment', 'scenario'):
+            dimensional = True
+    facts.add_context(element.get('id'), dates.get('startDate'), dates.get('endDate') or dates.get('instant'),
+                      dimensional)
+
+
+def parse_ixbrl(content):
+    """
+    インラインXBRLの文書を1回だけ走査してFactsを作る
+
+    ファクトとコンテキストの中にいないときは、走査が終わった要素を消してメモリを増やさない
+
+    Arguments:
+    ----------
+    content: bytes
+        主文書の.htm(XHTML)
+
+    Returns
+    -------
+    Facts
+    """
+    facts = Facts()
+    # 読み終わるまで消せない要素(ファクトとコンテキスト)の入れ子の深さ
+    keep = 0
+    for event, element in etree.iterparse(io.BytesIO(content), events=('start', 'end'), huge_tree=True):
+        namespace, name = _split(element.tag)
+        kept = (namespace in IX_NAMESPACES and name in ('nonFraction', 'nonNumeric')) or \
+               (namespace == XBRLI_NAMESPACE and name == 'context')
+        if event == 'start':
+            keep += kept
+            continue
+        if kept:
+            keep -= 1
+            if name == 'context':
+                _add_context(facts, element)
+            else:
+                value = nonfraction_value(element) if name == 'nonFraction' else nonnumeric_value(element)
+                if value is not None:
+                    facts.add(element.get('name'), element.get('contextRef'), value)
+        if keep == 0:
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    return facts
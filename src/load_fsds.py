@@ -0,0 +1,229 @@
+import io
+import os
+import re
+import sys
+import csv
+import zipfile
+import logging
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pandas.io.sql as psql
+import db_util
+import time_series
+from processed_filings import ProcessedFilings
+
+# https://www.sec.gov/dera/data/financial-statement-data-sets の 2019q4.zip のようなファイル名
+ARCHIVE_NAME_PATTERN = re.compile(r'(\d{4})q([1-4])\.zip$', re.IGNORECASE)
+
+# 出力テーブルのカラムと、income_statement_item/cash_flow_itemのidの対応
+# xbrl.IncomeStatement, xbrl.CashflowStatement の get_tag(id) と同じ番号
+INCOME_STATEMENT_ITEMS = {
+    'revenues': 1,
+    'operating_income_loss': 2,
+    'nonoperating_income_expense': 3,
+    'net_income_loss': 4,
+    'dividend': 5,
+    'eps': 6,
+    'shares_outstanding': 7,
+}
+CASH_FLOW_ITEMS = {
+    'operating_activities': 1,
+    'investing_activities': 2,
+    'financing_activities': 3,
+    'cash': 4,
+}
+
+
+def read_member(zip_file, name, usecols, chunksize=None):
+    """
+    zipの中のtsvを展開せずにそのまま読む
+
+    Arguments:
+    ----------
+    zip_file: zipfile.ZipFile
+        Financial Statement Data Setsのzip
+    name: string
+        sub.txt, num.txt など
+    usecols: list
+        読み込むカラム
+    chunksize: int
+        指定したときはdataframeのイテレータを返す
+    """
+    f = io.TextIOWrapper(zip_file.open(name), encoding='utf-8', errors='replace')
+    return pd.read_csv(f, sep='\t', usecols=usecols, dtype=str, quoting=csv.QUOTE_NONE,
+                       keep_default_na=False, chunksize=chunksize)
+
+
+def read_submissions(zip_file, form_type):
+    """sub.txtから対象のform typeの提出書類だけを取り出す"""
+    submissions = read_member(zip_file, 'sub.txt', ['adsh', 'cik', 'form', 'period', 'fy'])
+    submissions = submissions[submissions['form'] == form_type].copy()
+    submissions['fy'] = pd.to_numeric(submissions['fy'], errors='coerce')
+    return submissions
+
+
+def read_numbers(zip_file, adsh, tags, chunksize=100000):
+    """
+    num.txtをchunkごとに読み、対象の提出書類と対象のタグの行だけ残す
+
+    Arguments:
+    ----------
+    adsh: set
+        対象の提出書類のaccession number
+    tags: set
+        income_statement_item/cash_flow_itemに登録されているタグ
+    """
+    chunks = []
+    usecols = ['adsh', 'tag', 'version', 'coreg', 'ddate', 'qtrs', 'value']
+    for chunk in read_member(zip_file, 'num.txt', usecols, chunksize=chunksize):
+        chunk = chunk[chunk['adsh'].isin(adsh) & chunk['tag'].isin(tags) &
+                      (chunk['coreg'] == '') & chunk['version'].str.startswith('us-gaap') &
+                      (chunk['value'] != '')]
+        chunks.append(chunk.drop(['version', 'coreg'], axis=1))
+    # num.txtに行がなくchunkが1つもないときは、同じカラムの空のdataframeにする
+    columns = [column for column in usecols if column not in ('version', 'coreg')]
+    numbers = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=columns)
+    numbers['qtrs'] = numbers['qtrs'].astype(int)
+    numbers['value'] = numbers['value'].astype(float)
+    return numbers
+
+
+def load_item_tags():
+    """income_statement_itemとcash_flow_itemのタグをまとめて取得する"""
+    item_tags = []
+    for statement in ['income_statement', 'cash_flow']:
+        sql = f'SELECT id, tag, year FROM {statement}_item'
+        tag_df = psql.read_sql(sql, db_util.DBUtil.getConnect())
+        tag_df['statement'] = statement
+        item_tags.append(tag_df)
+    return pd.concat(item_tags, ignore_index=True)
+
+
+def select_values(numbers, submissions, item_tags):
+    """
+    提出書類ごと、項目ごとに値を1つに絞る
+
+    期末日(period)の値を使う。期間の値は損益計算書では一番短い期間(四半期)、
+    キャッシュフロー計算書では一番長い期間(期首からの累計)を使う。
+    キャッシュの期首残高は期末日より前で一番古い日付の値を使う
+    """
+    # その年のタグが登録されていなければ一番新しい年のタグを使う
+    years = item_tags['year'].unique()
+    submissions = submissions.assign(year=submissions['fy'].where(submissions['fy'].isin(years), years.max()))
+    numbers = numbers.merge(submissions[['adsh', 'period', 'year']], on='adsh')
+    numbers = numbers.merge(item_tags, on=['tag', 'year'])
+
+    at_period = numbers[numbers['ddate'] == numbers['period']]
+    at_period = at_period.assign(order=np.where(at_period['statement'] == 'cash_flow', -at_period['qtrs'], at_period['qtrs']))
+    at_period = at_period.sort_values('order').drop_duplicates(['adsh', 'statement', 'id'])
+    values = at_period.pivot_table(index='adsh', columns=['statement', 'id'], values='value', aggfunc='first')
+
+    cash_id = CASH_FLOW_ITEMS['cash']
+    beginning = numbers[(numbers['statement'] == 'cash_flow') & (numbers['id'] == cash_id) &
+                        (numbers['qtrs'] == 0) & (numbers['ddate'] < numbers['period'])]
+    beginning = beginning.sort_values('ddate').drop_duplicates('adsh').set_index('adsh')['value']
+    values[('cash_flow', 'beginning')] = beginning
+    return values
+
+
+def source_url(submissions):
+    """ProcessedFilingsで判定できるように、ファイリングのディレクトリのURLをsourceにする"""
+    return ('https://www.sec.gov/Archives/edgar/data/' + submissions['cik'] + '/' +
+            submissions['adsh'].str.replace('-', '') + '/')
+
+
+def create_cash_flow_df(values):
+    column = lambda id: values.get(('cash_flow', id))
+    cash_flow_df = pd.DataFrame({
+        'operating_activities': column(CASH_FLOW_ITEMS['operating_activities']),
+        'financing_activities': column(CASH_FLOW_ITEMS['financing_activities']),
+        'investing_activities': column(CASH_FLOW_ITEMS['investing_activities']),
+        'cash_beginning_of_period': column('beginning'),
+        'cash_end_of_period': column(CASH_FLOW_ITEMS['cash']),
+    }, index=values.index)
+    return cash_flow_df.dropna(how='all')
+
+
+def create_profit_loss_df(values):
+    """
+    ProfitLoss._make_df と同じ定義でprofit_lossの行を作る
+    spsはepsと同じ希薄化後EPS、cfpsは減価償却費を0とした営業キャッシュフロー / 希薄化後株式数
+    """
+    column = lambda id: values.get(('income_statement', id), pd.Series(np.nan, index=values.index))
+    shares_outstanding = column(INCOME_STATEMENT_ITEMS['shares_outstanding'])
+    eps = column(INCOME_STATEMENT_ITEMS['eps'])
+    operating_activities = values.get(('cash_flow', CASH_FLOW_ITEMS['operating_activities']), np.nan)
+    profit_loss_df = pd.DataFrame({
+        'dps': column(INCOME_STATEMENT_ITEMS['dividend']).fillna(0.0),
+        'eps': eps,
+        'cfps': operating_activities / shares_outstanding,
+        'sps': eps,
+        'shares_outstanding': shares_outstanding,
+    }, index=values.index)
+    return profit_loss_df.dropna(subset=['eps', 'shares_outstanding'], how='all')
+
+
+def add_filing_columns(df, submissions, year, quater):
+    """_make_df と同じ提出書類のカラムを付ける"""
+    submissions = submissions.set_index('adsh').loc[df.index].reset_index()
+    df['cik'] = submissions['cik'].values
+    df['year'] = year
+    df['quater'] = quater
+    df['form_type'] = submissions['form'].values
+    df['created_at'] = datetime.now().strftime('%Y-%m-%d  %H:%M:%S')
+    df['source'] = source_url(submissions).values
+    return df.reset_index(drop=True)
+
+
+def extract_fsds(path, item_tags, form_type='10-Q', processed_filings=None):
+    """
+    Financial Statement Data Setsのzipからcash_flowとprofit_lossのdataframeを作る
+
+    Arguments:
+    ----------
+    path: string
+        2019q4.zip のようなzipのパス
+    item_tags: dataframe
+        id, tag, year, statement を持つdataframe。load_item_tagsの戻り値
+    form_type: string
+        10-K, 10-Q など
+    processed_filings: ProcessedFilings
+        指定したときは処理済みのファイリングを除く
+
+    Returns
+    -------
+    tuple : (cash_flow_df, profit_loss_df)
+    """
+    year, quater = map(int, ARCHIVE_NAME_PATTERN.search(os.path.basename(path)).groups())
+    with zipfile.ZipFile(path) as zip_file:
+        submissions = read_submissions(zip_file, form_type)
+        if processed_filings is not None:
+            submissions = submissions[~source_url(submissions).map(processed_filings.__contains__)]
+        numbers = read_numbers(zip_file, set(submissions['adsh']), set(item_tags['tag']))
+    logging.info(f'{path}: {len(submissions)} submissions, {len(numbers)} numbers')
+
+    values = select_values(numbers, submissions, item_tags)
+    cash_flow_df = add_filing_columns(create_cash_flow_df(values), submissions, year, quater)
+    profit_loss_df = add_filing_columns(create_profit_loss_df(values), submissions, year, quater)
+    return cash_flow_df, profit_loss_df
+
+
+def load_fsds(paths, form_type='10-Q', force=False):
+    """zipを順に読み、cash_flowとprofit_lossにまとめてinsertするメソッド"""
+    item_tags = load_item_tags()
+    processed_filings = ProcessedFilings.load(force=force)
+    for path in paths:
+        cash_flow_df, profit_loss_df = extract_fsds(path, item_tags, form_type, processed_filings)
+        db_util.DBUtil.insertDf(cash_flow_df, 'cash_flow')
+        db_util.DBUtil.insertDf(profit_loss_df, 'profit_loss')
+        processed_filings.update(cash_flow_df['source'])
+        processed_filings.update(profit_loss_df['source'])
+        time_series.refresh_or_log(cash_flow_df)
+        time_series.refresh_or_log(profit_loss_df)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    load_fsds(sys.argv[1:], form_type=os.environ.get('form_type', '10-Q'),
+              force=os.environ.get('force_reprocess', '0') == '1')
@@ -1,6 +1,8 @@
 import os
 import re
 import csv
+import logging
+import numpy as np
 import pandas as pd
 import datetime
 import urllib.request
@@ -8,6 +10,9 @@ import requests
 from bs4 import BeautifulSoup
 import db_util
 
+# 負荷試験ではローカルのEDGARのスタブサーバーに向ける
+SEC_BASE_URL = os.environ.get('SEC_BASE_URL', 'https://www.sec.gov')
+
 
 def get_xbrl_idx(file):
     """xbrl.idxの内容を取得"""
@@ -38,41 +43,125 @@ def get_xbrl_idx(file):
     return labels, data
 
 
-def create_disclosed_info_df(data, year, term):
-    """ファイルのぱすを特定するためのdfを作るメソッド"""
-    CIK = []
-    Company_Name = []
-    Form_Type = []
-    Date_Filed = []
-    Filename = []
-    for datum in data:
-        CIK += [datum[0]]
-        Company_Name += [datum[1]]
-        Form_Type += [datum[2]]
-        Date_Filed += [datum[3]]
-        Filename += [datum[4]]
-
-    disclosed_info_df = pd.DataFrame(
-        data={'cik': CIK, 'company_name': Company_Name, 'form_type': Form_Type, 'date_filed': Date_Filed, 'file_name': Filename})
-    disclosed_info_df = disclosed_info_df.sort_values('company_name')
-    disclosed_info_df['file_path'] = disclosed_info_df['file_name'].str.replace('-', '').replace('.txt', '.json')
-    disclosed_info_df['base_url'] = '/Archives/' + disclosed_info_df['file_path'].str.replace('.txt', '')
-    disclosed_info_df['year'] = year
-    disclosed_info_df['QT'] = term
-    disclosed_info_df.drop(['file_path', 'file_name'], axis=1, inplace=True)
+# xbrl.idxのFilename。edgar/data/{cik}/{accession number}.txt
+FILE_NAME_PATTERN = re.compile(r'^edgar/data/\d{1,10}/\d{10}-\d{2}-\d{6}\.txt\Z')
+CIK_PATTERN = re.compile(r'^\d{1,10}\Z')
+FORM_TYPE_PATTERN = re.compile(r'^[0-9A-Z][0-9A-Z \-/.]*\Z')
+COLUMNS = ['cik', 'company_name', 'form_type', 'date_filed', 'file_name']
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def build_disclosed_info(data, year, term):
+    """
+    xbrl.idxのデータ行からbase_infoの行を作り、不正な行を分ける
+
+    先にcikとディレクトリの比較、日付、form typeの種類で絞り、Filenameの正規表現はそれを通った行だけで検証する。
+    base_urlとaccession numberは切り出しで作る。
+    date_filedは日付に、form_typeはcategoryにする。indexはaccession number(数字だけ)のint。
+    共同登録者(co-registrant)は同じaccession numberを別のcikのディレクトリで持つので、重複はbase_urlで判定する
+
+    Arguments:
+    ----------
+    data: list
+        get_xbrl_idxのデータ行
+    year: int
+    term: string
+        QTR1 など
+
+    Returns
+    -------
+    tuple : (disclosed_info_df, rejected_df)
+        rejected_dfは元の5カラムと理由(reason)を持つ。カラムの数が違う行(malformed)はlineに元の行を入れる
+    """
+    rows = [row for row in data if len(row) == 5]
+    malformed = pd.DataFrame({'line': ['|'.join(row) for row in data if len(row) != 5]})
+    malformed['reason'] = 'malformed'
 
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    ciks, file_names = df['cik'].tolist(), df['file_name'].tolist()
+    date_filed = pd.to_datetime(df['date_filed'], format=DATE_FORMAT, errors='coerce')
+    # 先に安い切り出しの比較と日付で絞り、正規表現はそれを通った行だけに使う
+    # FILE_NAME_PATTERNに当てはまる行は {directory}/{accession number}.txt で、accession numberは20文字
+    cik_mismatch = np.array([file_name[:-25] != 'edgar/data/' + cik for cik, file_name in zip(ciks, file_names)],
+                            dtype=bool)
+    invalid_date = date_filed.isna().to_numpy()
+    # form typeは種類が少ないので、種類ごとに1回だけ正規表現を使う
+    form_types = [form_type for form_type in df['form_type'].unique() if FORM_TYPE_PATTERN.match(form_type)]
+    invalid_form_type = ~df['form_type'].isin(form_types).to_numpy()
+    candidates = np.flatnonzero(~(cik_mismatch | invalid_date | invalid_form_type))
+    invalid_file_name = np.ones(len(df), dtype=bool)
+    invalid_file_name[candidates] = [FILE_NAME_PATTERN.match(file_names[i]) is None for i in candidates]
+    valid = np.zeros(len(df), dtype=bool)
+    valid[candidates] = ~invalid_file_name[candidates]
+
+    rejected = df[~valid]
+    if not valid.all():
+        df, date_filed = df[valid], date_filed[valid]
+        file_names = [file_names[i] for i in np.flatnonzero(valid)]
+    # ディレクトリのcikは数字なので、数字だけの行はcikの区切りの'-'もない
+    base_url = pd.Series(['/Archives/' + file_name[:-4].replace('-', '') for file_name in file_names], index=df.index,
+                         dtype=object)
+    duplicated = base_url.duplicated().to_numpy()
+
+    # 不正な行だけ、先に当てはまった理由を1つ付ける。正規表現は不正な行のファイル名にも使い直す
+    if len(rejected):
+        invalid_cik = ~rejected['cik'].str.match(CIK_PATTERN).to_numpy(dtype=bool)
+        rejected_file_name = ~rejected['file_name'].str.match(FILE_NAME_PATTERN).to_numpy(dtype=bool)
+        invalid = {'invalid form type': invalid_form_type[~valid], 'invalid date': invalid_date[~valid],
+                   'invalid file name': rejected_file_name, 'cik mismatch': cik_mismatch[~valid]}
+        rejected = rejected.assign(reason=np.select([invalid_cik] + list(invalid.values()), ['invalid cik'] + list(invalid),
+                                                    default=''))
+    rejected = pd.concat([rejected, df[duplicated].assign(reason='duplicate'), malformed],
+                         ignore_index=True, sort=False)
+    if duplicated.any():
+        df, date_filed, base_url = df[~duplicated], date_filed[~duplicated], base_url[~duplicated]
+
+    disclosed_info_df = pd.DataFrame({
+        'cik': df['cik'],
+        'company_name': df['company_name'],
+        'form_type': df['form_type'].astype('category'),
+        'date_filed': date_filed,
+        'base_url': base_url,
+        'year': year,
+        'QT': term,
+    })
+    disclosed_info_df.index = pd.Index([int(url[-18:]) for url in base_url], dtype='int64', name='accession')
+    return disclosed_info_df, rejected
+
+
+def report_rejected(rejected, year, term, samples=5):
+    """不正な行の件数を理由ごとにログに出す"""
+    if rejected.empty:
+        return
+    counts = ', '.join(f'{reason}={count}' for reason, count in rejected['reason'].value_counts().items())
+    logging.warning(f'{year} {term}: {len(rejected)} rows rejected ({counts})')
+    for _, row in rejected.head(samples).iterrows():
+        logging.warning(f"  {row['reason']}: {row.drop('reason').dropna().to_dict()}")
+
+
+def create_disclosed_info_df(data, year, term):
+    """ファイルのぱすを特定するためのdfを作るメソッド。不正な行は除いてログに出す"""
+    disclosed_info_df, rejected = build_disclosed_info(data, year, term)
+    report_rejected(rejected, year, term)
     return disclosed_info_df
 
-def download_full_index():
+def download_full_index(start_year=2010, end_year=None):
     """
     form typeとそのファイルのパスを示すデータをダウンロードしてを作成して、
     それをcsvにするメソッド。将来的にはcsvではなくdbに格納するようにする
+
+    Arguments:
+    ----------
+    start_year: int
+        取得を始める年
+    end_year: int
+        この年の前年まで取得する。defaultは今年
     """
-    base_url = 'https://www.sec.gov/Archives/edgar/full-index/'
+    base_url = SEC_BASE_URL + '/Archives/edgar/full-index/'
     dt_now = datetime.datetime.now()
-    this_year = dt_now.year
+    this_year = dt_now.year if end_year is None else end_year
     # TODO 2019までしか取れていない
-    for year in range(2010, this_year):
+    for year in range(start_year, this_year):
         for term in range(1, 5):
             term = 'QTR' + str(term)
             url = base_url + '/' + str(year) + '/' + term + '/xbrl.idx'
@@ -80,6 +169,8 @@ def download_full_index():
             urllib.request.urlretrieve(url, download_path)
             columns, data = get_xbrl_idx(download_path)
             disclosed_info_df = create_disclosed_info_df(data, year, term)
+            # base_infoのdate_filedはこれまでどおり 2019-05-01 形式の文字列で入れる
+            disclosed_info_df['date_filed'] = disclosed_info_df['date_filed'].dt.strftime(DATE_FORMAT)
             db_util.DBUtil.insertDf(disclosed_info_df, 'base_info')
             os.remove(download_path)
 
@@ -0,0 +1,199 @@
+import os
+import queue
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from deadline import Deadline, DeadlineStats, RetryQueue, is_retryable
+from profiling import filing_url, profile_call
+
+# 各stageの終わりを次のstageに伝える
+_DONE = object()
+
+
+class Pipeline():
+    """
+    取得(I/O) -> パース(CPU) -> 書き込み の3つのstageでファイリングを処理する
+
+    取得はスレッド、パースはプロセスプールで並列に動かし、書き込みは1つのスレッドで行う。
+    stageの間は上限付きのキューでつなぐので、後ろのstageが詰まると前のstageが待つ(backpressure)
+
+    Attributes
+    ----------
+    fetch : function
+        fetch(item) -> raw。ネットワークからbytesなどを取得する
+    parse : function
+        parse(item, raw) -> rows。プロセスに渡すのでpickleできるトップレベルの関数にする
+    write : function
+        write(item, rows)。DBへの書き込みなど
+    fetch_workers : int
+        取得するスレッドの数
+    parse_workers : int
+        パースするプロセスの数。defaultはCPUの数
+    queue_size : int
+        stageの間のキューの上限
+    budgets : dict
+        {'fetch': 秒, 'parse': 秒, 'write': 秒}。Noneのときはdeadline.DEFAULT_BUDGETS
+    filing_budget : float
+        1ファイリングの制限時間(秒)。Noneのときは制限しない
+    retries : int
+        制限時間を超えたファイリングと、429や5xxで失敗したファイリングを最後にやり直す回数
+    failed : list
+        (item, stage, exception) のリスト。itemsの読み込みに失敗したときは (None, 'feed', exception)
+    backoff : float
+        やり直す前に待つ時間(秒)。Retry-Afterがあればそちらを使い、なければやり直すたびに倍にする
+    timed_out : RetryQueue
+        最後まで制限時間を超えたか、429や5xxで失敗したファイリング(リトライキュー)
+    deadline_stats : DeadlineStats
+        stageごとに制限時間を超えた回数
+    profile : ProfileReport
+        渡したときだけ、stageごとのcProfileとパースstageのtracemallocをここに集める
+    """
+    def __init__(self, fetch, parse, write, fetch_workers=8, parse_workers=None, queue_size=None,
+                 budgets=None, filing_budget=None, retries=0, profile=None, backoff=None):
+        self.fetch = fetch
+        self.parse = parse
+        self.write = write
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers or os.cpu_count()
+        self.queue_size = queue_size or 2 * max(self.fetch_workers, self.parse_workers)
+        self.budgets = budgets
+        self.filing_budget = filing_budget
+        self.retries = retries
+        self.failed = []
+        self.backoff = backoff
+        self.timed_out = RetryQueue(backoff)
+        self.deadline_stats = DeadlineStats()
+        self.profile = profile
+        self.written = 0
+
+    def _call(self, stage, function, item, *args):
+        """profileのときはfunctionをプロファイルして記録する。メモリはスレッドをまたいで混ざるので計らない"""
+        if self.profile is None:
+            return function(item, *args)
+        result, record = profile_call(function, item, *args, memory=False)
+        self.profile.add(filing_url(item), stage, record)
+        return result
+
+    def _fail(self, item, stage, e):
+        if is_retryable(e):
+            logging.warning(f'{stage} will be retried: {item} {e}')
+            self.timed_out.add(item, e)
+            return
+        logging.error(f'{stage} failed: {item} {e}')
+        self.failed.append((item, stage, e))
+
+    def _feed(self, items, fetch_queue):
+        """itemsを取得のキューに入れる。itemsが例外を出しても(DBの読み込みの失敗など)、_DONEは必ず送る"""
+        try:
+            for item in items:
+                fetch_queue.put(item)
+        except Exception as e:
+            self._fail(None, 'feed', e)
+        finally:
+            for _ in range(self.fetch_workers):
+                fetch_queue.put(_DONE)
+
+    def _fetch_worker(self, fetch_queue, parse_queue):
+        while True:
+            item = fetch_queue.get()
+            if item is _DONE:
+                return
+            deadline = Deadline(self.budgets, self.filing_budget, self.deadline_stats)
+            try:
+                with deadline.stage('fetch'):
+                    raw = self._call('fetch', self.fetch, item)
+                parse_queue.put((item, raw, deadline))
+            except Exception as e:
+                self._fail(item, 'fetch', e)
+
+    def _close(self, threads, next_queue, workers):
+        """前のstageのスレッドが全部終わったら、次のstageのスレッドの数だけ_DONEを送る"""
+        for thread in threads:
+            thread.join()
+        for _ in range(workers):
+            next_queue.put(_DONE)
+
+    def _parse_worker(self, executor, parse_queue, write_queue):
+        while True:
+            task = parse_queue.get()
+            if task is _DONE:
+                write_queue.put(_DONE)
+                return
+            item, raw, deadline = task
+            try:
+                with deadline.stage('parse'):
+                    if self.profile is None:
+                        future = executor.submit(self.parse, item, raw)
+                    else:
+                        future = executor.submit(profile_call, self.parse, item, raw)
+                    try:
+                        rows = future.result(timeout=deadline.remaining())
+                        if self.profile is not None:
+                            rows, record = rows
+                            self.profile.add(filing_url(item), 'parse', record)
+                    except TimeoutError:
+                        # 実行中のプロセスは止められないので、結果を使わずに次へ進む
+                        future.cancel()
+                        deadline.expire()
+                write_queue.put((item, rows, deadline))
+            except Exception as e:
+                self._fail(item, 'parse', e)
+
+    def _write_worker(self, write_queue):
+        finished = 0
+        while finished < self.parse_workers:
+            task = write_queue.get()
+            if task is _DONE:
+                finished += 1
+                continue
+            item, rows, deadline = task
+            try:
+                # 書き込みは途中で止めると戻せないので、超えても記録するだけにする
+                with deadline.stage('write', cancel=False):
+                    self._call('write', self.write, item, rows)
+                self.written += 1
+            except Exception as e:
+                self._fail(item, 'write', e)
+
+    def run(self, items):
+        """
+        itemsをすべて処理して、書き込めた件数を返す
+        制限時間を超えたファイリングと429や5xxで失敗したファイリングはretriesの回数までやり直す
+
+        Parameters
+        ----------
+        items : iterable
+            処理するファイリング。ジェネレータでもよい
+        """
+        self._run(items)
+        for retry in range(self.retries):
+            if not self.timed_out:
+                break
+            items, self.timed_out = self.timed_out, RetryQueue(self.backoff)
+            # 同じ制限の時間内に続けてリクエストしないように、Retry-Afterかバックオフの時間だけ待つ
+            logging.info(f'retrying {len(items)} timed out or throttled filings after {items.delay(retry):.1f}s '
+                         f'({retry + 1}/{self.retries})')
+            items.wait(retry)
+            self._run(list(items))
+        logging.info(f'{self.written} written, {len(self.failed)} failed, {len(self.timed_out)} timed out')
+        logging.info(self.deadline_stats)
+        return self.written
+
+    def _run(self, items):
+        fetch_queue = queue.Queue(self.queue_size)
+        parse_queue = queue.Queue(self.queue_size)
+        write_queue = queue.Queue(self.queue_size)
+
+        with ProcessPoolExecutor(self.parse_workers) as executor:
+            fetch_threads = [threading.Thread(target=self._fetch_worker, args=(fetch_queue, parse_queue), daemon=True)
+                             for _ in range(self.fetch_workers)]
+            # パースのスレッドは処理中のプロセスの結果を待つだけなので、プロセスと同じ数にする
+            parse_threads = [threading.Thread(target=self._parse_worker, args=(executor, parse_queue, write_queue), daemon=True)
+                             for _ in range(self.parse_workers)]
+            threads = [threading.Thread(target=self._feed, args=(items, fetch_queue), daemon=True),
+                       threading.Thread(target=self._close, args=(fetch_threads, parse_queue, self.parse_workers), daemon=True)]
+            for thread in fetch_threads + parse_threads + threads:
+                thread.start()
+            self._write_worker(write_queue)
+            for thread in threads + parse_threads:
+                thread.join()
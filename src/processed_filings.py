@@ -0,0 +1,89 @@
+import re
+import logging
+import pandas.io.sql as psql
+import db_util
+
+# /Archives/edgar/data/{cik}/{accession number(ハイフンなし18桁)}/...
+FILING_KEY_PATTERN = re.compile(r'/data/\d+/(\d{18})(?:/|$)')
+
+
+def filing_key(url):
+    """
+    ファイリングのURLからaccession numberを取り出して整数にする
+    index.json, FilingSummary.xml, R*.htm のどのURLでも同じキーになる
+
+    Parameters
+    ----------
+    url : str
+        ファイリング配下のURLまたはパス
+
+    Returns
+    -------
+    int : accession number。取り出せないときはNone
+    """
+    match = FILING_KEY_PATTERN.search(str(url))
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+class ProcessedFilings():
+    """
+    処理済みのファイリングを保持して、再実行時に同じファイリングを取得しないようにする
+    accession numberを整数のsetで持つので、数百万件でもメモリは小さい
+
+    Attributes
+    ----------
+    keys : set
+        処理済みのaccession number
+    force : boolean
+        Trueのときはすべてのファイリングを未処理として扱う
+    """
+    TABLES = ('cash_flow', 'profit_loss')
+
+    def __init__(self, keys=(), force=False):
+        self.keys = set(keys)
+        self.force = force
+
+    @classmethod
+    def load(cls, tables=TABLES, force=False):
+        """
+        出力テーブルのsourceから処理済みのファイリングを一度だけ読み込む
+
+        Parameters
+        ----------
+        tables : tuple
+            sourceカラムを持つ出力テーブル
+        force : boolean
+            Trueのときは読み込まずに、すべて再処理する
+        """
+        processed_filings = cls(force=force)
+        if force:
+            return processed_filings
+        for table in tables:
+            sql = f'SELECT DISTINCT source FROM {table}'
+            try:
+                source_df = psql.read_sql(sql, db_util.DBUtil.getConnect())
+            except psql.DatabaseError as e:
+                logging.warning(f'{table} could not be loaded: {e}')
+                continue
+            processed_filings.update(source_df['source'])
+        logging.info(f'{len(processed_filings)} filings have already been processed')
+        return processed_filings
+
+    def add(self, url):
+        key = filing_key(url)
+        if key is not None:
+            self.keys.add(key)
+
+    def update(self, urls):
+        for url in urls:
+            self.add(url)
+
+    def __contains__(self, url):
+        if self.force:
+            return False
+        return filing_key(url) in self.keys
+
+    def __len__(self):
+        return len(self.keys)
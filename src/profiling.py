@@ -0,0 +1,208 @@
+"""
+バッチのプロファイリング(オプトイン)
+
+ファイリングごとにcProfileの統計とtracemallocのピーク、メモリを多く確保した行を取り、
+ワーカーのプロセスやスレッドの結果を1つのProfileReportにまとめる。
+
+    report = ProfileReport()
+    with report.profile(url):             # 同じプロセスの処理
+        ...
+    rows, record = profile_call(parse, filing, raw)   # プロセスプールではこれをsubmitする
+    report.add(url, 'parse', record)
+    report.save('./profile')              # profile.txt と profile.pstats(snakevizなどで開ける)
+
+tracemallocはプロセス全体のメモリを数えるので、スレッドで並列に動くstageではほかのファイリングの分も含まれる。
+そのためパイプラインでは、1プロセスで1ファイリングずつ処理するパースstageだけメモリを計る
+"""
+import io
+import os
+import time
+import pstats
+import cProfile
+import tracemalloc
+import threading
+from contextlib import contextmanager
+
+# 処理が遅くなったときにまず見る関数
+HOT_PATHS = ('get_value', 'end_date', 'statements_dict', 'trim_value', 'insertDf', 'parse_statement_table')
+
+# 1ファイリングで記録するメモリを多く確保した行の数
+TOP_ALLOCATIONS = 5
+
+
+class ProfileRecord():
+    """
+    1ファイリングの1stageのプロファイル。プロセスの間で受け渡せるようにpickleできる値だけ持つ
+
+    pstats.Statsにそのまま渡せるように、create_stats()とstatsを持つ
+
+    Attributes
+    ----------
+    seconds : float
+    peak : int
+        tracemallocのピーク(bytes)。計っていないときはNone
+    allocations : list
+        [(ファイル:行, bytes)]。確保したメモリが多い順
+    stats : dict
+        cProfile.Profile.stats
+    """
+    def __init__(self, seconds, peak, allocations, stats):
+        self.seconds = seconds
+        self.peak = peak
+        self.allocations = allocations
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+@contextmanager
+def _profiling(memory=True):
+    """ブロックの処理を計って、終わったらProfileRecordを1つだけ入れたリストにする"""
+    records = []
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    if memory:
+        # reset_peakはPython 3.9から。3.8ではこの関数で開始したときだけピークが1ファイリング分になる
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield records
+    finally:
+        profiler.disable()
+        seconds = time.perf_counter() - start
+        peak = None
+        allocations = []
+        if memory:
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            allocations = [(str(stat.traceback[0]), stat.size_diff)
+                           for stat in after.compare_to(before, 'lineno')[:TOP_ALLOCATIONS] if stat.size_diff > 0]
+            if started:
+                tracemalloc.stop()
+        profiler.create_stats()
+        records.append(ProfileRecord(seconds, peak, allocations, profiler.stats))
+
+
+def profile_call(function, *args, memory=True):
+    """
+    function(*args)をプロファイルして (戻り値, ProfileRecord) を返す
+    プロセスプールでは function の代わりにこの関数をsubmitする
+    """
+    with _profiling(memory) as records:
+        result = function(*args)
+    return result, records[0]
+
+
+def filing_url(item):
+    """パイプラインのitemからレポートに出す名前を取る。dictならurl"""
+    if isinstance(item, dict):
+        return item.get('url', str(item))
+    return str(item)
+
+
+class ProfileReport():
+    """
+    ファイリングごとのProfileRecordを集めて、1つのレポートにまとめる。複数のスレッドから使う
+
+    Attributes
+    ----------
+    filings : dict
+        {url: {stage: ProfileRecord}}
+    """
+    def __init__(self):
+        self.filings = {}
+        self.lock = threading.Lock()
+
+    def add(self, url, stage, record):
+        with self.lock:
+            self.filings.setdefault(url, {})[stage] = record
+
+    @contextmanager
+    def profile(self, url, stage='filing', memory=True):
+        """ブロックの処理をurlのstageとして記録する。例外が出ても記録する"""
+        try:
+            with _profiling(memory) as records:
+                yield
+        finally:
+            self.add(url, stage, records[0])
+
+    def seconds(self, url):
+        return sum(record.seconds for record in self.filings[url].values())
+
+    def peak(self, url):
+        return max((record.peak for record in self.filings[url].values() if record.peak is not None), default=None)
+
+    def slowest(self, n=10):
+        """[(url, 秒)] を遅い順に"""
+        return sorted(((url, self.seconds(url)) for url in self.filings), key=lambda x: x[1], reverse=True)[:n]
+
+    def hungriest(self, n=10):
+        """[(url, bytes)] をtracemallocのピークが大きい順に"""
+        peaks = [(url, self.peak(url)) for url in self.filings]
+        return sorted([x for x in peaks if x[1] is not None], key=lambda x: x[1], reverse=True)[:n]
+
+    def stats(self):
+        """全ファイリング、全stageのcProfileをまとめたpstats.Stats。なければNone"""
+        # pstats.Statsは渡したもののstatsを空にして使うので、コピーを渡す
+        records = [ProfileRecord(record.seconds, record.peak, record.allocations, dict(record.stats))
+                   for stages in self.filings.values() for record in stages.values() if record.stats]
+        if not records:
+            return None
+        stats = pstats.Stats(records[0], stream=io.StringIO())
+        for record in records[1:]:
+            stats.add(record)
+        return stats
+
+    def allocations(self, n=10):
+        """[(ファイル:行, bytes)] を全ファイリングで足し合わせて多い順に"""
+        sizes = {}
+        for stages in self.filings.values():
+            for record in stages.values():
+                for location, size in record.allocations:
+                    sizes[location] = sizes.get(location, 0) + size
+        return sorted(sizes.items(), key=lambda x: x[1], reverse=True)[:n]
+
+    def format(self, n=10):
+        lines = [f'profiled {len(self.filings)} filings, '
+                 f'{sum(self.seconds(url) for url in self.filings):.1f}s in total']
+
+        lines += ['', 'slowest filings']
+        for url, seconds in self.slowest(n):
+            stages = ', '.join(f'{stage}={record.seconds:.3f}s' for stage, record in self.filings[url].items())
+            lines.append(f'{seconds:9.3f}s  {url}  ({stages})')
+
+        lines += ['', 'most memory-hungry filings (tracemalloc peak)']
+        for url, peak in self.hungriest(n):
+            top = next((record.allocations[0] for record in self.filings[url].values() if record.allocations), None)
+            top = '' if top is None else f'  top: {top[0]} {top[1] / 1024:.0f}KiB'
+            lines.append(f'{peak / 1024 / 1024:8.1f}MiB  {url}{top}')
+
+        lines += ['', 'top allocators (all filings)']
+        lines += [f'{size / 1024:10.0f}KiB  {location}' for location, size in self.allocations(n)]
+
+        stats = self.stats()
+        if stats is not None:
+            stats.stream = io.StringIO()
+            stats.sort_stats('cumulative').print_stats('|'.join(rf'\({name}\)' for name in HOT_PATHS))
+            lines += ['', 'hot paths', stats.stream.getvalue().strip()]
+            stats.stream = io.StringIO()
+            stats.sort_stats('tottime').print_stats(n)
+            lines += ['', f'top {n} functions by own time', stats.stream.getvalue().strip()]
+        return '\n'.join(lines)
+
+    def save(self, directory, n=10):
+        """directoryに profile.txt と まとめたcProfileの profile.pstats を書き、profile.txtのパスを返す"""
+        os.makedirs(directory, exist_ok=True)
+        stats = self.stats()
+        if stats is not None:
+            stats.dump_stats(os.path.join(directory, 'profile.pstats'))
+        path = os.path.join(directory, 'profile.txt')
+        with open(path, 'w') as f:
+            f.write(self.format(n) + '\n')
+        return path
@@ -0,0 +1,83 @@
+import re
+import lxml.html
+import numpy as np
+
+# '$1,234' や '(1,234)' を数値にする
+NUMBER_CLEAN_PATTERN = re.compile(r'[$,)\s]')
+
+
+def to_float(text):
+    """
+    R fileのセルの文字列を数値にする。'(1,234)'は負の数、数値でないものはNaN
+    """
+    text = NUMBER_CLEAN_PATTERN.sub('', text).replace('(', '-')
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+
+def _data_row(cells):
+    """
+    statements_dataの通常行と同じ値のリストにする
+    空のセルは'Nan'、入れ子のtdがあるときはその文字列を使う
+    """
+    row = []
+    for cell in cells:
+        if cell.text_content():
+            nested = next(cell.iterdescendants('td'), None)
+            if nested is None:
+                return [cell.text_content().strip() for cell in cells]
+            row.append(nested.text_content())
+        else:
+            row.append('Nan')
+    return row
+
+
+def parse_statement_table(content, statement_name=None):
+    """
+    R fileの最初のtableを1回だけ走査して、header行、section行、通常行に分ける
+
+    Arguments:
+    ----------
+    content: bytes
+        R fileのhtml
+    statement_name: string
+        結果にそのまま入れる
+
+    Returns
+    -------
+    dict : statement_name, headers, sections, data, labels, values
+        headers, sections, data は statements_data と同じ
+        labelsは通常行の項目名、valuesは通常行の値の(行, 列)のfloatの配列
+    """
+    table = lxml.html.fromstring(content).find('.//table')
+    headers = []
+    sections = []
+    data = []
+    for row in table.iter('tr'):
+        cells = []
+        header_cells = []
+        has_strong = False
+        for element in row.iterdescendants():
+            tag = element.tag
+            if tag == 'td':
+                cells.append(element)
+            elif tag == 'th':
+                header_cells.append(element)
+            elif tag == 'strong':
+                has_strong = True
+        if header_cells:
+            headers.append([cell.text_content().strip() for cell in header_cells])
+        elif has_strong:
+            sections.append(cells[0].text_content().strip())
+        else:
+            data.append(_data_row(cells))
+
+    labels = [row[0] for row in data]
+    width = max((len(row) for row in data), default=1) - 1
+    values = np.full((len(data), width), np.nan)
+    for i, row in enumerate(data):
+        values[i, :len(row) - 1] = [to_float(text) for text in row[1:]]
+    return {'statement_name': statement_name, 'headers': headers, 'sections': sections, 'data': data,
+            'labels': labels, 'values': values}
@@ -0,0 +1,223 @@
+"""
+会社(CIK)ごとの四半期の時系列
+
+cash_flowとprofit_lossの行を (cik, year, quater) ごとに1行にまとめた company_series テーブルを作り、
+ファイリングを書き込むたびにrefreshでその行だけupsertする(差分更新)。
+
+読むときはTimeSeriesStoreに (会社, 期間, 項目) の3次元の配列として読み込む。
+会社の全期間はCIKの辞書から1回で引け、ある期間の全会社は配列のスライスで取り出せる
+
+    store = TimeSeriesStore.from_db()
+    store.history('320193')               # 1社の全期間
+    store.cross_section(2019, 4, ['eps'])  # 1期間の全会社
+"""
+import logging
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import db_util
+
+TABLE_NAME = 'company_series'
+
+CASH_FLOW_COLUMNS = ('operating_activities', 'financing_activities', 'investing_activities',
+                     'cash_beginning_of_period', 'cash_end_of_period')
+PROFIT_LOSS_COLUMNS = ('dps', 'eps', 'cfps', 'sps', 'shares_outstanding')
+METRICS = CASH_FLOW_COLUMNS + PROFIT_LOSS_COLUMNS
+KEYS = ['cik', 'year', 'quater']
+
+CREATE_TABLE_SQL = f'''CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+    cik        text,
+    year       integer,
+    quater     integer,
+    form_type  text,
+{''.join(f'    {column:<24} double precision,{chr(10)}' for column in METRICS)}    updated_at text,
+    PRIMARY KEY (cik, year, quater)
+)'''
+
+_created = set()
+_created_lock = threading.Lock()
+
+
+def create_table():
+    """プロセスごとに1回だけ CREATE TABLE IF NOT EXISTS を実行する"""
+    backend = db_util.DBUtil.backend()
+    with _created_lock:
+        if id(backend) not in _created:
+            db_util.DBUtil.execute(CREATE_TABLE_SQL)
+            _created.add(id(backend))
+
+
+def period(year, quater):
+    """(year, quater) を並べ替えられる整数にする"""
+    return np.asarray(year, dtype=np.int64) * 4 + np.asarray(quater, dtype=np.int64) - 1
+
+
+def series_rows(df):
+    """cash_flowかprofit_lossのdataframeをcompany_seriesの行にする。dfにない項目のカラムは含めない"""
+    metrics = [column for column in METRICS if column in df.columns]
+    rows = df[KEYS + ['form_type'] + metrics].copy()
+    rows['cik'] = rows['cik'].astype(str)
+    rows['year'] = rows['year'].astype(int)
+    rows['quater'] = rows['quater'].astype(int)
+    rows[metrics] = rows[metrics].apply(pd.to_numeric, errors='coerce')
+    return rows
+
+
+def refresh(df):
+    """
+    書き込んだcash_flowかprofit_lossの行をcompany_seriesにupsertする
+    dfにある項目だけを更新するので、cash_flowとprofit_lossを別々に書き込んでも同じ行にまとまる
+    """
+    if df is None or df.empty:
+        return
+    rows = series_rows(df)
+    rows['updated_at'] = datetime.now().strftime('%Y-%m-%d  %H:%M:%S')
+    create_table()
+    db_util.DBUtil.insertDf(rows, TABLE_NAME, if_exists='upsert', keys=KEYS)
+
+
+def refresh_or_log(df):
+    """
+    refreshして、失敗したときは例外を投げずにログに残してFalseを返す
+    cash_flowやprofit_lossの行はもうcommitしてあるので、company_seriesが古いままでもファイリングは書き込めたことにする。
+    あとでrebuildすれば作り直せる
+    """
+    try:
+        refresh(df)
+        return True
+    except Exception as e:
+        logging.warning(f'failed to refresh {TABLE_NAME}, run rebuild later: {e!r}')
+        return False
+
+
+def rebuild(chunksize=100000):
+    """cash_flowとprofit_lossの全行からcompany_seriesを作り直す。最初の1回や、refreshし損ねたときに使う"""
+    for table, columns in (('cash_flow', CASH_FLOW_COLUMNS), ('profit_loss', PROFIT_LOSS_COLUMNS)):
+        sql = f'SELECT cik, year, quater, form_type, {", ".join(columns)} FROM {table}'
+        count = 0
+        for chunk in db_util.DBUtil.readChunks(sql, chunksize):
+            refresh(chunk)
+            count += len(chunk)
+        logging.info(f'{count} rows of {table} materialized into {TABLE_NAME}')
+
+
+class TimeSeriesStore():
+    """
+    company_seriesを (会社, 期間, 項目) のfloatの配列で持つ。値がないところはNaN
+
+    Attributes
+    ----------
+    metrics : list
+        項目の名前。配列の3次元目の順
+    ciks : list
+        配列の1次元目の順のCIK。追加した順
+    periods : ndarray
+        配列の2次元目の順の期間(period())。昇順
+    values : ndarray
+        (len(ciks), len(periods), len(metrics)) の配列
+    """
+    def __init__(self, metrics=METRICS):
+        self.metrics = list(metrics)
+        self.metric_index = {metric: i for i, metric in enumerate(self.metrics)}
+        self.ciks = []
+        self.cik_index = {}
+        self.periods = np.empty(0, dtype=np.int64)
+        # 会社の数は増えていくので、1次元目は余裕を持って確保して、使っている分だけvaluesで見せる
+        self._values = np.full((0, 0, len(self.metrics)), np.nan)
+
+    @property
+    def values(self):
+        return self._values[:len(self.ciks)]
+
+    def _add_ciks(self, ciks):
+        new = [cik for cik in dict.fromkeys(ciks) if cik not in self.cik_index]
+        for cik in new:
+            self.cik_index[cik] = len(self.ciks)
+            self.ciks.append(cik)
+        if len(self.ciks) > self._values.shape[0]:
+            capacity = max(len(self.ciks), 2 * self._values.shape[0], 16)
+            values = np.full((capacity, self._values.shape[1], len(self.metrics)), np.nan)
+            values[:self._values.shape[0]] = self._values
+            self._values = values
+
+    def _add_periods(self, periods):
+        new = np.setdiff1d(periods, self.periods)
+        if len(new) == 0:
+            return
+        merged = np.union1d(self.periods, new)
+        values = np.full((self._values.shape[0], len(merged), len(self.metrics)), np.nan)
+        values[:, np.searchsorted(merged, self.periods)] = self._values
+        self.periods = merged
+        self._values = values
+
+    def refresh(self, df):
+        """
+        company_seriesの行(cik, year, quater と項目のカラム)を配列に反映する
+        dfにない項目と、dfでNaNの値はそのまま残す
+        """
+        if df.empty:
+            return
+        ciks = df['cik'].astype(str).to_numpy()
+        periods = period(df['year'].to_numpy(), df['quater'].to_numpy())
+        self._add_ciks(ciks)
+        self._add_periods(periods)
+        rows = np.fromiter((self.cik_index[cik] for cik in ciks), dtype=np.int64, count=len(ciks))
+        columns = np.searchsorted(self.periods, periods)
+        for metric in self.metrics:
+            if metric not in df.columns:
+                continue
+            values = pd.to_numeric(df[metric], errors='coerce').to_numpy(dtype=float)
+            present = ~np.isnan(values)
+            self._values[rows[present], columns[present], self.metric_index[metric]] = values[present]
+
+    def _metric_positions(self, metrics):
+        metrics = self.metrics if metrics is None else list(metrics)
+        return metrics, [self.metric_index[metric] for metric in metrics]
+
+    def history(self, cik, metrics=None):
+        """
+        1社の全期間。index は (year, quater)、値が1つもない期間は除く。知らないCIKはKeyError
+        """
+        metrics, positions = self._metric_positions(metrics)
+        values = self._values[self.cik_index[str(cik)]][:, positions]
+        present = ~np.isnan(values).all(axis=1)
+        index = pd.MultiIndex.from_arrays([self.periods[present] // 4, self.periods[present] % 4 + 1],
+                                          names=['year', 'quater'])
+        return pd.DataFrame(values[present], index=index, columns=metrics)
+
+    def cross_section(self, year, quater, metrics=None):
+        """1期間の全会社。index は cik、値が1つもない会社は除く"""
+        metrics, positions = self._metric_positions(metrics)
+        position = np.searchsorted(self.periods, period(year, quater))
+        if position == len(self.periods) or self.periods[position] != period(year, quater):
+            return pd.DataFrame(columns=metrics, index=pd.Index([], name='cik'))
+        values = self.values[:, position][:, positions]
+        present = ~np.isnan(values).all(axis=1)
+        return pd.DataFrame(values[present], index=pd.Index(np.array(self.ciks, dtype=object)[present], name='cik'),
+                            columns=metrics)
+
+    def save(self, path):
+        """npzに書く"""
+        np.savez_compressed(path, metrics=np.array(self.metrics), ciks=np.array(self.ciks, dtype=str),
+                            periods=self.periods, values=self.values)
+
+    @classmethod
+    def load(cls, path):
+        """saveで書いたnpzを読む"""
+        with np.load(path) as data:
+            store = cls(data['metrics'].tolist())
+            store.ciks = data['ciks'].tolist()
+            store.cik_index = {cik: i for i, cik in enumerate(store.ciks)}
+            store.periods = data['periods']
+            store._values = data['values']
+        return store
+
+    @classmethod
+    def from_db(cls, chunksize=100000):
+        """company_seriesを全部読み込む"""
+        store = cls()
+        sql = f'SELECT cik, year, quater, {", ".join(METRICS)} FROM {TABLE_NAME}'
+        for chunk in db_util.DBUtil.readChunks(sql, chunksize):
+            store.refresh(chunk)
+        return store
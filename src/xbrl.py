@@ -1,14 +1,27 @@
+import os
 import re
+import logging
+from contextlib import nullcontext
+from functools import cached_property
 import requests
 from bs4 import BeautifulSoup
 import pandas as pd
 import pandas.io.sql as psql
 import db_util
+from deadline import Deadline, DeadlineStats, RetryQueue, http_get, is_retryable
+from facts import Facts
+from filing_manifest import instance_document, load_manifests
+from ixbrl import is_inline, parse_ixbrl
+from processed_filings import filing_key
+from profiling import ProfileReport
 from bs4 import BeautifulSoup
 from sqlalchemy import create_engine
 import pandas.io.sql as psql
 import psycopg2 as pg
 
+# 負荷試験ではローカルのEDGARのスタブサーバーに向ける
+SEC_BASE_URL = os.environ.get('SEC_BASE_URL', 'https://www.sec.gov')
+
 # # スクレイピング対象の URL にリクエストを送り HTML を取得する
 # res = requests.get('https://www.sec.gov/Archives/edgar/data/320193/000032019319000119/a10-k20199282019_htm.xml')
 # # res = requests.get('https://www.sec.gov/Archives/edgar/data/1001463/000118518518000573/acca-20171231.xml')
@@ -17,6 +30,7 @@ import psycopg2 as pg
 class FinancialStatement:
   """
     財務諸表の各属性値や、各属性値を取得するためのメソッドを持つ
+    各属性値は初回アクセス時に計算してキャッシュする（遅延評価）
 
     Attributes
     ----------
@@ -24,19 +38,97 @@ class FinancialStatement:
         該当の財務諸表が表示されるHTMLのURL
     soup : beautifulsoup
         該当の財務諸表のHTMLのbeautifulsoup
+    facts : Facts
+        ファクトとコンテキスト。インラインXBRLのときはsoupを作らずに主文書から直接作る
     contextref : stg
        財務諸表の期間を保持するID
     conn : psycopg2
        DBの接続情報を保持する
   """
-  def __init__(self):
-    self.url = self.path_to_xml()
-    self.soup = self.get_soup()
-    self.year = self.fisical_year()
-    self.quater = self.fisical_quater()
-    self.document_period_end_date = self.document_period_end_date()
+  # 取得できる項目名。サブクラスで定義する
+  ITEMS = ()
+
+  def __init__(self, url=None, content=None, path=None, base_url=None, tags=None, instance_name=None):
+    """
+    Parameters
+    ----------
+    url : str
+        インスタンスxml、またはインラインXBRLの主文書のURL。指定がなければbase_urlから探す
+    content : bytes
+        インスタンスxml(インラインXBRLの.htm)の中身。指定したときはリクエストしない
+    path : str
+        ローカルにあるインスタンスxml(インラインXBRLの.htm)のパス
+    base_url : str
+        /Archives/edgar/data/... 形式のファイリングのディレクトリ。指定がなければDBから取得する
+    tags : dict
+        {id: tag} 形式の項目とタグの対応。指定したときはDBに問い合わせない
+    instance_name : str
+        マニフェストにあるインスタンスxmlのファイル名。指定したときはindex.jsonを取得しない
+    """
+    if url is not None:
+      self.url = url
+    self.content = content
+    self.path = path
+    self._base_url = base_url
+    self._tags = tags
+    self._instance_name = instance_name
+
+  @classmethod
+  def from_bytes(cls, content, **kwargs):
+    """メモリ上のインスタンスxmlから財務諸表を作る"""
+    return cls(content=content, **kwargs)
+
+  @classmethod
+  def from_file(cls, path, **kwargs):
+    """ローカルのインスタンスxmlから財務諸表を作る"""
+    return cls(path=path, **kwargs)
+
+  @cached_property
+  def url(self):
+    return self.path_to_xml()
+
+  @cached_property
+  def soup(self):
+    return self.get_soup()
+
+  @cached_property
+  def facts(self):
+    return self.get_facts()
+
+  @cached_property
+  def year(self):
+    return self.fisical_year()
+
+  @cached_property
+  def quater(self):
+    return self.fisical_quater()
+
+  @cached_property
+  def document_period_end_date(self):
+    return self.facts.period_end_date()
+
+  def to_dict(self, items=None):
+    """
+    指定した項目だけを計算して辞書で返す
+
+    Parameters
+    ----------
+    items : list
+        取得したい項目名のリスト。指定がなければITEMSのすべて
+
+    Returns
+    -------
+    dict : {項目名: 値}
+    """
+    items = self.ITEMS if items is None else items
+    unknown = [item for item in items if item not in self.ITEMS]
+    if unknown:
+      raise ValueError(f'unknown items: {unknown}')
+    return {item: getattr(self, item) for item in items}
 
   def base_url(self):
+    if self._base_url is not None:
+      return self._base_url
     sql = f"""SELECT company_name, base_url, year, "QT"
                 FROM base_info
                WHERE cik = '12927' and form_type = '10-Q' and year = 2011 and "QT" = 'QTR2'"""
@@ -62,12 +154,15 @@ class FinancialStatement:
       後半部分は Ticker + end period + .xmlになっているので、tickerをDBにもてたら修正したい
     """
     base_url = self.base_url()
-    # _cal.xmlを探す
-    url = 'https://www.sec.gov' + base_url + '/index.json'
-    res = requests.get(url).json()
-    item = [item['name'] for item in res['directory']['item'] if re.search(r'.*_cal.xml', item['name'])]
-    path_to_xml = item[0].replace(r'_cal', '')
-    path_to_xml = 'https://sec.gov' + base_url + '/' +  path_to_xml
+    if self._instance_name is not None:
+      return SEC_BASE_URL + base_url + '/' + self._instance_name
+    # インラインXBRLの主文書か、_cal.xmlと同じ名前のインスタンスxmlを探す
+    url = SEC_BASE_URL + base_url + '/index.json'
+    res = http_get(url).json()
+    path_to_xml = instance_document(res['directory']['item'])
+    if path_to_xml is None:
+      raise ValueError(f'{base_url}: instance document not found')
+    path_to_xml = SEC_BASE_URL + base_url + '/' +  path_to_xml
     return path_to_xml
 
   def get_soup(self):
@@ -83,10 +178,29 @@ class FinancialStatement:
     soup : beautifulsoup
         レスポンスのHTMLから変換されたBeautifulSoupオブジェクト
     """
-    res = requests.get(self.url)
-    soup = BeautifulSoup(res.text, 'lxml')
+    soup = BeautifulSoup(self.get_content(), 'lxml')
     return soup
 
+  def get_content(self):
+    """content、path、urlの順に文書の中身を取得する。取得したものはcontentに残す"""
+    if self.content is None:
+      if self.path is not None:
+        with open(self.path, 'rb') as f:
+          self.content = f.read()
+      else:
+        self.content = http_get(self.url).content
+    return self.content
+
+  def get_facts(self):
+    """
+    文書のファクトとコンテキストを取得する
+    インラインXBRLは1回の走査でファクトだけを取り出し、インスタンスxmlはsoupから作る
+    """
+    content = self.get_content()
+    if is_inline(content):
+      return parse_ixbrl(content)
+    return Facts.from_soup(self.soup)
+
   def fisical_year(self):
     """
     財務諸表の対象の期間を取得する
@@ -100,9 +214,9 @@ class FinancialStatement:
     -------
     str : year
     """
-    tag = 'dei:' + 'DocumentFiscalYearFocus'.lower()
-    self.contextref = self.soup.find(tag)['contextref']
-    year = self.soup.find(tag).get_text()
+    tag = 'dei:DocumentFiscalYearFocus'
+    self.contextref = self.facts.contextref(tag)
+    year = self.facts.text(tag)
     return year
 
   def fisical_quater(self):
@@ -118,8 +232,7 @@ class FinancialStatement:
     str : quater
         10-K : FY, 10-Q : 1, 2, 3, 4
     """
-    tag = 'dei:' + 'DocumentFiscalPeriodFocus'.lower()
-    quater = self.soup.find(tag).get_text()
+    quater = self.facts.text('dei:DocumentFiscalPeriodFocus')
     return quater
 
   def start_date(self):
@@ -153,44 +266,45 @@ class FinancialStatement:
       return: end_date : str
           財務諸表の対象期間の終了日
     """
-    try:
-      end_date = self.soup.find(id = contextref).find('enddate').get_text()
-    except AttributeError:
-      end_date = self.soup.find(id = contextref).find('instant').get_text()
-    finally:
-      print(contextref)
-    return end_date
-
-  def document_period_end_date(self):
-    tag = 'dei:' + 'DocumentPeriodEndDate'.lower()
-    end_date = self.soup.find(tag).get_text()
+    end_date = self.facts.end_date(contextref)
     return end_date
 
   def get_value(self, tag_name):
-    tags = self.soup.find_all(tag_name.lower())
-    value_list = [tag.get_text() for tag in tags if self.end_date(tag['contextref']) == self.document_period_end_date]
-    value = 0.0 if len(value_list) == 0 else value_list[0]
+    value = self.facts.value(tag_name, self.document_period_end_date)
+    value = 0.0 if value is None else value
     return value
 
+  def get_tags(self):
+    """
+    その年の項目とタグの対応をまとめて取得する。1回だけDBに問い合わせる
+
+    Returns
+    -------
+    dict : {id: tag}
+    """
+    if self._tags is None:
+      sql  = f'''SELECT id, tag FROM {self.item_table}
+                 WHERE year = {self.year}'''
+      tag_df = psql.read_sql(sql, db_util.DBUtil.getConnect())
+      self._tags = dict(zip(tag_df['id'], tag_df['tag']))
+    return self._tags
+
   def get_tag(self, id):
-    sql  = f'''SELECT * FROM {self.item_table}
-               WHERE year = {self.year} and
-                       id = {id}'''
-    tag_df = psql.read_sql(sql, db_util.DBUtil.getConnect())
-    tag = 'us-gaap:' + tag_df['tag'][0]
+    tag = 'us-gaap:' + self.get_tags()[id]
     return tag
 
 class IncomeStatement(FinancialStatement):
-  def __init__(self):
-    super().__init__()
-    self.item_table = 'income_statement_item'
-    self.revenues = self.get_revenues()
-    self.operating_income_loss = self.get_operating_income_loss()
-    self.nonoperating_income_expense = self.get_nonoperating_income_expense()
-    self.net_income_loss = self.get_net_income_loss()
-    self.dividend = self.get_dividend()
-    self.eps = self.get_eps()
-    self.shares_outstanding = self.get_shares_outstanding()
+  item_table = 'income_statement_item'
+  ITEMS = ('revenues', 'operating_income_loss', 'nonoperating_income_expense',
+           'net_income_loss', 'dividend', 'eps', 'shares_outstanding')
+
+  revenues = cached_property(lambda self: self.get_revenues())
+  operating_income_loss = cached_property(lambda self: self.get_operating_income_loss())
+  nonoperating_income_expense = cached_property(lambda self: self.get_nonoperating_income_expense())
+  net_income_loss = cached_property(lambda self: self.get_net_income_loss())
+  dividend = cached_property(lambda self: self.get_dividend())
+  eps = cached_property(lambda self: self.get_eps())
+  shares_outstanding = cached_property(lambda self: self.get_shares_outstanding())
 
   def get_revenues(self):
     tag = self.get_tag(1)
@@ -229,13 +343,14 @@ class IncomeStatement(FinancialStatement):
 
 
 class CashflowStatement(FinancialStatement):
-  def __init__(self):
-    super().__init__()
-    self.item_table = 'cash_flow_item'
-    self.cash_from_operating_activities = self.get_cash_from_operating_activities()
-    self.cash_from_investing_activities = self.get_cash_from_investing_activities()
-    self.cash_from_financial_activities = self.get_cash_from_financial_activities()
-    self.cash = self.get_cash()
+  item_table = 'cash_flow_item'
+  ITEMS = ('cash_from_operating_activities', 'cash_from_investing_activities',
+           'cash_from_financial_activities', 'cash')
+
+  cash_from_operating_activities = cached_property(lambda self: self.get_cash_from_operating_activities())
+  cash_from_investing_activities = cached_property(lambda self: self.get_cash_from_investing_activities())
+  cash_from_financial_activities = cached_property(lambda self: self.get_cash_from_financial_activities())
+  cash = cached_property(lambda self: self.get_cash())
 
   def get_cash_from_operating_activities(self):
     tag = self.get_tag(1)
@@ -260,4 +375,101 @@ class CashflowStatement(FinancialStatement):
   def instance_vars_df(self):
     instance_vars = list(self.__dict__.keys())
     instance_vars = [var for var in instance_vars if not var == 'soup' or var == 'contextref' or var == 'item_table']
-    df = pd.DataFrame(columns = instance_vars)
\ No newline at end of file
+    df = pd.DataFrame(columns = instance_vars)
+
+def extract_filing(base_url, instance_name=None, deadline=None):
+  """
+  1ファイリングの損益計算書とキャッシュフロー計算書の値を取得する
+  fetch, parse, extract のstageごとに制限時間を確かめる
+
+  Parameters
+  ----------
+  base_url : str
+  instance_name : str
+      マニフェストにあるインスタンスxml(インラインXBRLの主文書)のファイル名
+  deadline : Deadline
+
+  Returns
+  -------
+  dict : year, quater と各項目の値
+  """
+  deadline = Deadline() if deadline is None else deadline
+  income_statement = IncomeStatement(base_url=base_url, instance_name=instance_name)
+  with deadline.stage('fetch'):
+    income_statement.get_content()
+  with deadline.stage('parse'):
+    # XBRLでない文書(エラーページなど)はここでMissingFactにする
+    income_statement.document_period_end_date
+  with deadline.stage('extract'):
+    cash_flow = CashflowStatement(url=income_statement.url)
+    # 同じ文書なので、取り出したファクトを使い回す
+    cash_flow.facts = income_statement.facts
+    row = {'year': income_statement.year, 'quater': income_statement.quater}
+    row.update(income_statement.to_dict())
+    row.update(cash_flow.to_dict())
+  return row
+
+
+def extract(year, quater, form_type, budgets=None, filing_budget=None, retries=1, profile_dir=None):
+  """
+  base_infoのファイリングから損益計算書とキャッシュフロー計算書の値を取得する
+  制限時間を超えたファイリングと429や5xxで失敗したファイリングは、最後にretriesの回数までやり直す
+  それ以外の例外で失敗したファイリングは行にしない
+
+  Parameters
+  ----------
+  year : int
+  quater : int
+      1, 2, 3, 4
+  form_type : str
+      10-K, 10-Q など
+  budgets : dict
+      {'fetch': 秒, 'parse': 秒, 'extract': 秒}
+  filing_budget : float
+      1ファイリングの制限時間(秒)
+  retries : int
+  profile_dir : str
+      指定したときはファイリングごとにプロファイルを取り、まとめたレポートをここに書く
+
+  Returns
+  -------
+  tuple : (dataframe, dataframe)
+      1ファイリング1行の値と、やり直しても制限時間を超えたか429や5xxだったファイリング(cik, base_url)
+  """
+  sql = '''SELECT cik, base_url FROM base_info
+            WHERE form_type = %s and year = %s and "QT" = %s'''
+  rows = []
+  failed = 0
+  stats = DeadlineStats()
+  profile = None if profile_dir is None else ProfileReport()
+  # マニフェストがあるファイリングはindex.jsonを取得しない
+  manifests = load_manifests()
+  # base_infoはサーバーサイドカーソルで少しずつ読み、やり直すファイリングだけをリストに残す
+  filings = db_util.DBUtil.readRows(sql, params=(form_type, year, f'QTR{quater}'))
+  for attempt in range(retries + 1):
+    if attempt:
+      logging.info(f'retrying {len(filings)} filings after {filings.wait(attempt - 1):.1f}s ({attempt}/{retries})')
+    retry = RetryQueue()
+    for cik, base_url in filings:
+      row = {'cik': cik, 'base_url': base_url}
+      instance_name = manifests.get(filing_key(base_url), {}).get('instance_name')
+      try:
+        with nullcontext() if profile is None else profile.profile(base_url):
+          row.update(extract_filing(base_url, instance_name, Deadline(budgets, filing_budget, stats)))
+      except Exception as e:
+        if is_retryable(e):
+          logging.warning(f'{base_url} will be retried: {e}')
+          retry.add((cik, base_url), e)
+        else:
+          logging.warning(f'{base_url} failed: {e}')
+          failed += 1
+        continue
+      rows.append(row)
+    filings = retry
+    if not filings:
+      break
+  logging.info(f'{len(rows)} extracted, {failed} failed, {len(filings)} timed out or throttled')
+  logging.info(stats)
+  if profile is not None:
+    logging.info(f'profile written to {profile.save(profile_dir)}')
+  return pd.DataFrame(rows), pd.DataFrame(list(filings), columns=['cik', 'base_url'])
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# src/ と experiment/ のモジュールは互いに `import db_util` の形で参照しているので、パスに追加する
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+sys.path.append(os.path.join(ROOT, 'src'))
+sys.path.append(os.path.join(ROOT, 'experiment'))
@@ -0,0 +1,66 @@
+import itertools
+from selenium.common.exceptions import WebDriverException
+from browser_pool import BrowserPool
+
+
+class FakeDriver():
+  ids = itertools.count()
+
+  def __init__(self):
+    self.id = next(FakeDriver.ids)
+    self.quitted = False
+
+  def quit(self):
+    self.quitted = True
+
+
+def test_browser_pool():
+  drivers = []
+  scraped = []
+
+  def create_driver():
+    drivers.append(FakeDriver())
+    return drivers[-1]
+
+  def scrape(driver, filing):
+    if filing == 'crash':
+      raise WebDriverException('session deleted')
+    scraped.append((driver.id, filing))
+
+  browser_pool = BrowserPool(size=2, max_pages=3, create_driver=create_driver)
+  stats = browser_pool.run(['crash'] + list(range(10)), scrape)
+  assert sorted(filing for _, filing in scraped) == list(range(10))
+  # セッションを落としたファイリングは1回だけやり直して、処理した件数には入れない
+  assert sum(s.pages for s in stats) == 10
+  assert sum(s.errors for s in stats) == 2
+  assert [filing for filing, _ in browser_pool.failed] == ['crash']
+  assert len(drivers) == 2 + sum(s.recycles for s in stats)
+  assert all(driver.quitted for driver in drivers)
+
+
+def test_browser_pool_without_sessions():
+  def create_driver():
+    raise WebDriverException('grid is down')
+
+  browser_pool = BrowserPool(size=2, create_driver=create_driver)
+  browser_pool.run(range(10), lambda driver, filing: None)
+  assert sorted(filing for filing, _ in browser_pool.failed) == list(range(10))
+
+
+def test_browser_pool_session_cannot_be_recreated():
+  created = []
+
+  def create_driver():
+    if created:
+      raise WebDriverException('grid is down')
+    created.append(FakeDriver())
+    return created[-1]
+
+  def scrape(driver, filing):
+    if filing == 1:
+      raise WebDriverException('session deleted')
+
+  browser_pool = BrowserPool(size=1, create_driver=create_driver)
+  stats = browser_pool.run(range(5), scrape)
+  assert stats[0].pages == 1
+  assert sorted(filing for filing, _ in browser_pool.failed) == [1, 2, 3, 4]
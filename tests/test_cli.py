@@ -0,0 +1,26 @@
+import os
+import subprocess
+import sys
+from cli import build_parser
+
+
+def test_defaults_from_env(monkeypatch):
+  monkeypatch.setenv('start_year', '2015')
+  monkeypatch.setenv('form_type', '10-K')
+  monkeypatch.setenv('pipeline', '1')
+  args = build_parser().parse_args(['rfile'])
+  assert (args.start_year, args.form_type, args.pipeline) == (2015, '10-K', True)
+
+
+def test_help_does_not_import_subsystems():
+  code = 'import sys, cli; cli.build_parser(); print(any(m in sys.modules for m in ("pandas", "requests", "bs4", "selenium")))'
+  result = subprocess.run([sys.executable, '-c', code], cwd=os.path.join(os.path.dirname(__file__), '../src'), capture_output=True, text=True)
+  assert result.stdout.strip() == 'False'
+
+
+def test_each_log_line_is_written_once(tmp_path):
+  code = ('import logging, cli, financial_statement; cli.setup_logging(%r); '
+          'financial_statement.logger.warning("once"); logging.shutdown()') % str(tmp_path / 'batch.log')
+  result = subprocess.run([sys.executable, '-c', code], cwd=os.path.join(os.path.dirname(__file__), '../src'), capture_output=True, text=True)
+  assert result.stderr.count('once') == 1
+  assert (tmp_path / 'batch.log').read_text().count('once') == 1
@@ -0,0 +1,79 @@
+import os
+import pytest
+from db_util import DBUtil, PostgresBackend
+
+
+def test_upsert_sql():
+  sql = DBUtil._upsert_sql('cash_flow', 'cash_flow_staging', ['cik', 'year', 'operating_activities'], ['cik', 'year'])
+  assert sql == ('INSERT INTO "cash_flow" ("cik", "year", "operating_activities") '
+                 'SELECT "cik", "year", "operating_activities" FROM "cash_flow_staging" '
+                 'ON CONFLICT ("cik", "year") DO UPDATE SET "operating_activities" = EXCLUDED."operating_activities"')
+  sql = DBUtil._upsert_sql('base_info', 'base_info_staging', ['base_url'], ['base_url'])
+  assert sql.endswith('ON CONFLICT ("base_url") DO NOTHING')
+
+
+def test_upsert_requires_keys():
+  import pandas as pd
+  with pytest.raises(ValueError):
+    DBUtil.insertDf(pd.DataFrame({'cik': ['320193']}), 'cash_flow', if_exists='upsert')
+
+
+def test_postgres_copy_csv_writes_integers_without_decimal_point():
+  import pandas as pd
+  df = pd.DataFrame({'cik': ['320193', '789019'], 'year': [2019, None], 'accession': [32019319000066, None],
+                     'cash': [1.5, None]})
+  assert PostgresBackend._copy_csv(df).read() == '320193,2019,32019319000066,1.5\n789019,,,\n'
+
+
+@pytest.fixture
+def postgres(monkeypatch):
+  if not os.environ.get('DATABASE_HOST'):
+    pytest.skip('DATABASE_HOST is not set')
+  monkeypatch.setenv('DATABASE_BACKEND', 'postgres')
+
+
+def test_postgres_upsert_nullable_integers(postgres):
+  import pandas as pd
+  DBUtil.execute('DROP TABLE IF EXISTS upsert_test')
+  DBUtil.execute('CREATE TABLE upsert_test (cik text PRIMARY KEY, year integer, accession bigint)')
+  try:
+    DBUtil.insertDf(pd.DataFrame({'cik': ['320193', '789019'], 'year': [2019, None], 'accession': [32019319000066, None]}),
+                    'upsert_test', if_exists='upsert', keys=['cik'])
+    assert sorted(DBUtil.readRows('SELECT cik, year, accession FROM upsert_test')) == [
+      ('320193', 2019, 32019319000066), ('789019', None, None)]
+  finally:
+    DBUtil.execute('DROP TABLE upsert_test')
+
+
+@pytest.fixture
+def sqlite(monkeypatch, tmp_path):
+  monkeypatch.setenv('DATABASE_BACKEND', 'sqlite')
+  monkeypatch.setenv('DATABASE_PATH', str(tmp_path / 'edgar.db'))
+
+
+def test_sqlite_insert_and_read(sqlite):
+  import pandas as pd
+  df = pd.DataFrame({'cik': ['320193', '789019', '1018724'], 'year': [2019, 2019, 2020], 'QT': ['QTR1', 'QTR2', 'QTR1']})
+  DBUtil.insertDf(df, 'base_info')
+  rows = DBUtil.readRows('SELECT cik FROM base_info WHERE year = %s and "QT" = %s ORDER BY cik', fetch_size=1, params=(2019, 'QTR1'))
+  assert list(rows) == [('320193',)]
+  chunks = list(DBUtil.readChunks('SELECT * FROM base_info', chunksize=2))
+  assert [len(chunk) for chunk in chunks] == [2, 1]
+  assert list(chunks[0].columns) == ['cik', 'year', 'QT']
+
+
+def test_sqlite_upsert(sqlite):
+  import pandas as pd
+  DBUtil.insertDf(pd.DataFrame({'cik': ['320193', '789019'], 'year': [2019, 2019], 'cash': [1.0, None]}),
+                  'cash_flow', if_exists='upsert', keys=['cik', 'year'])
+  DBUtil.insertDf(pd.DataFrame({'cik': ['789019', '789019', '1018724'], 'year': [2019, 2019, 2019], 'cash': [2.0, 3.0, 4.0]}),
+                  'cash_flow', if_exists='upsert', keys=['cik', 'year'])
+  assert sorted(DBUtil.readRows('SELECT cik, cash FROM cash_flow')) == [('1018724', 4.0), ('320193', 1.0), ('789019', 3.0)]
+
+
+def test_sqlite_memory_database_is_shared(monkeypatch):
+  import pandas as pd
+  monkeypatch.setenv('DATABASE_BACKEND', 'sqlite')
+  monkeypatch.delenv('DATABASE_PATH', raising=False)
+  DBUtil.insertDf(pd.DataFrame({'source': ['a', 'b']}), 'memory_test', if_exists='replace')
+  assert pd.read_sql('SELECT COUNT(*) AS n FROM memory_test', DBUtil.getConnect())['n'][0] == 2
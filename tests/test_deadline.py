@@ -0,0 +1,82 @@
+import time
+import pytest
+import requests
+import deadline
+from deadline import Deadline, DeadlineExceeded, DeadlineStats, RetryQueue, http_get, is_retryable
+
+
+def test_stage_over_budget_raises_and_is_recorded():
+  stats = DeadlineStats()
+  filing = Deadline({'parse': 0.05}, stats=stats)
+  with filing.stage('fetch'):
+    assert filing.remaining() is None
+  with pytest.raises(DeadlineExceeded) as e:
+    with filing.stage('parse'):
+      time.sleep(0.1)
+  assert e.value.stage == 'parse'
+  assert stats.fired == {'parse': 1}
+
+
+def test_write_overrun_is_only_recorded():
+  stats = DeadlineStats()
+  filing = Deadline({'write': 0.01}, stats=stats)
+  with filing.stage('write', cancel=False):
+    time.sleep(0.05)
+  assert stats.fired == {'write': 1}
+
+
+def test_filing_budget_counts_only_stage_time():
+  filing = Deadline({}, filing_budget=0.1)
+  with filing.stage('fetch'):
+    time.sleep(0.06)
+  time.sleep(0.1)
+  with pytest.raises(DeadlineExceeded):
+    with filing.stage('parse'):
+      time.sleep(0.06)
+
+
+def test_http_get_uses_remaining_time(monkeypatch):
+  timeouts = []
+
+  def get(url, timeout):
+    timeouts.append(timeout)
+    raise requests.Timeout()
+
+  monkeypatch.setattr(requests, 'get', get)
+  with pytest.raises(requests.Timeout):
+    http_get('http://example.com')
+  filing = Deadline({'fetch': 1.0})
+  with pytest.raises(DeadlineExceeded):
+    with filing.stage('fetch'):
+      http_get('http://example.com')
+  assert timeouts[0] == deadline.HTTP_TIMEOUT and timeouts[1] <= 1.0
+
+
+def response(status_code):
+  res = requests.Response()
+  res.status_code = status_code
+  res.url = 'http://example.com'
+  return res
+
+
+def test_http_get_raises_error_status(monkeypatch):
+  statuses = iter([200, 404, 429, 503])
+  monkeypatch.setattr(requests, 'get', lambda url, timeout: response(next(statuses)))
+  assert http_get('http://example.com').status_code == 200
+  errors = []
+  for _ in range(3):
+    with pytest.raises(requests.HTTPError) as e:
+      http_get('http://example.com')
+    errors.append(e.value)
+  assert [is_retryable(e) for e in errors] == [False, True, True]
+  assert is_retryable(DeadlineExceeded('fetch', 1.0)) and not is_retryable(ValueError())
+
+
+def test_retry_queue_delay():
+  retry_queue = RetryQueue(backoff=1.0, max_backoff=5.0)
+  retry_queue.add('a', DeadlineExceeded('fetch', 1.0))
+  assert [retry_queue.delay(attempt) for attempt in range(4)] == [1.0, 2.0, 4.0, 5.0]
+  throttled = response(429)
+  throttled.headers['Retry-After'] = '3'
+  retry_queue.add('b', requests.HTTPError(response=throttled))
+  assert retry_queue == ['a', 'b'] and retry_queue.delay(0) == 3.0
@@ -0,0 +1,54 @@
+import json
+import urllib.request
+import urllib.error
+import pytest
+from edgar_server import EdgarServer, Filing, FIRST_CIK
+
+
+@pytest.fixture
+def server():
+  server = EdgarServer(filings=3).start()
+  yield server
+  server.stop()
+
+
+def get(url):
+  with urllib.request.urlopen(url) as res:
+    return res.read().decode('utf-8')
+
+
+def test_full_index_and_filing(server):
+  lines = get(server.url + '/Archives/edgar/full-index/2019/QTR2/xbrl.idx').splitlines()
+  filing = Filing(FIRST_CIK, 2019, 2, 0)
+  assert lines[-3] == filing.index_line()
+  index = json.loads(get(server.url + filing.directory + '/index.json'))
+  assert index['directory']['name'] == filing.directory
+  for item in index['directory']['item']:
+    assert get(server.url + filing.directory + '/' + item['name'])
+
+
+def test_throttle():
+  server = EdgarServer(max_rps=1).start()
+  try:
+    get(server.url + '/Archives/edgar/full-index/2019/QTR1/xbrl.idx')
+    with pytest.raises(urllib.error.HTTPError) as e:
+      get(server.url + '/Archives/edgar/full-index/2019/QTR1/xbrl.idx')
+    assert e.value.code == 429
+  finally:
+    server.stop()
+
+
+def test_fixtures_stay_inside_directory(tmp_path):
+  fixtures = tmp_path / 'fixtures'
+  (fixtures / 'Archives').mkdir(parents=True)
+  (fixtures / 'Archives' / 'note.txt').write_text('fixture')
+  (tmp_path / 'fixtures_evil').mkdir()
+  (tmp_path / 'fixtures_evil' / 'secret.txt').write_text('secret')
+  server = EdgarServer(fixtures=str(fixtures)).start()
+  try:
+    assert get(server.url + '/Archives/note.txt') == 'fixture'
+    with pytest.raises(urllib.error.HTTPError) as e:
+      get(server.url + '/../fixtures_evil/secret.txt')
+    assert e.value.code == 404
+  finally:
+    server.stop()
@@ -0,0 +1,67 @@
+import filing_manifest
+from edgar_server import EdgarServer, Filing, FIRST_CIK
+
+
+def test_classify_statements():
+  report_list = [{'name_short': 'Document and Entity Information', 'url': 'R1.htm'},
+                 {'name_short': 'CONSOLIDATED BALANCE SHEETS', 'url': 'R2.htm'},
+                 {'name_short': 'CONSOLIDATED BALANCE SHEETS (Parenthetical)', 'url': 'R3.htm'},
+                 {'name_short': 'CONSOLIDATED STATEMENTS OF OPERATIONS', 'url': 'R4.htm'},
+                 {'name_short': 'CONSOLIDATED STATEMENTS OF CASH FLOWS', 'url': 'R7.htm'}]
+  assert filing_manifest.classify_statements(report_list) == {
+    '(0)CONSOLIDATED BALANCE SHEETS': 'R2.htm',
+    '(1)CONSOLIDATED STATEMENTS OF OPERATIONS': 'R4.htm',
+    '(2)CONSOLIDATED STATEMENTS OF CASH FLOWS': 'R7.htm'}
+
+
+def test_build_manifest(monkeypatch):
+  server = EdgarServer().start()
+  monkeypatch.setattr(filing_manifest, 'SEC_BASE_URL', server.url)
+  try:
+    filing = Filing(FIRST_CIK, 2019, 1, 0)
+    manifest = filing_manifest.build_manifest(filing.directory + '/index.json')
+  finally:
+    server.stop()
+  assert manifest['accession'] == int(filing.accession_number.replace('-', ''))
+  assert manifest['base_url'] == filing.directory
+  assert manifest['instance_name'] == filing.instance_name
+  assert sorted(manifest['statements'].values()) == ['R2.htm', 'R4.htm', 'R7.htm']
+  assert filing_manifest.statement_urls(manifest)['(2)Condensed Consolidated Statements of Cash Flows'] == \
+    filing_manifest.SEC_BASE_URL + filing.directory + '/R7.htm'
+
+
+def test_instance_document_falls_back_to_inline_document():
+  items = [{'name': 'aapl-20200926.htm', 'size': '1500000'}, {'name': 'a10-kexhibit2119.htm', 'size': '3000000'},
+           {'name': 'R2.htm', 'size': '90000'}, {'name': 'FilingSummary.xml', 'size': '40000'}]
+  assert filing_manifest.instance_document(items) == 'aapl-20200926.htm'
+  # _cal.xmlがあっても、同じ名前のインスタンスxmlがなければ使わない
+  assert filing_manifest.instance_document(items + [{'name': 'aapl-20200926_cal.xml', 'size': ''}]) == 'aapl-20200926.htm'
+  assert filing_manifest.instance_document([{'name': 'R2.htm', 'size': ''}]) is None
+
+
+def test_instance_document_prefers_inline_document():
+  names = ['flex-20200331.htm', 'flex-20200331_cal.xml', 'flex-20200331_htm.xml', 'flex-20200331xex311.htm',
+           'R2.htm', 'FilingSummary.xml', '0000866374-20-000012-index.htm']
+  items = [{'name': name, 'size': '100'} for name in names]
+  assert filing_manifest.instance_document(items) == 'flex-20200331.htm'
+  # 主文書がなければ取り出したインスタンス
+  assert filing_manifest.instance_document(items[1:]) == 'flex-20200331_htm.xml'
+  # _htm.xmlがないときは、主文書の名前の末尾が ex のあとに数字でも添付資料にしない
+  assert filing_manifest.instance_document([items[0], items[3], items[4]]) == 'flex-20200331.htm'
+
+
+def test_instance_document_of_instance_xml_filing():
+  items = [{'name': name, 'size': ''} for name in ['aapl-20190928.xml', 'aapl-20190928_cal.xml', 'ex-21.htm', 'R2.htm']]
+  assert filing_manifest.instance_document(items) == 'aapl-20190928.xml'
+
+
+def test_save_and_load_manifests_on_sqlite(monkeypatch, tmp_path):
+  monkeypatch.setenv('DATABASE_BACKEND', 'sqlite')
+  monkeypatch.setenv('DATABASE_PATH', str(tmp_path / 'edgar.db'))
+  filing = Filing(FIRST_CIK, 2019, 1, 0)
+  manifest = {'accession': int(filing.accession_number.replace('-', '')), 'cik': str(filing.cik), 'base_url': filing.directory,
+              'documents': filing.documents(), 'instance_name': filing.instance_name, 'statements': {'(2)Cash Flows': 'R7.htm'}}
+  filing_manifest.create_table()
+  filing_manifest.save_manifests([manifest])
+  filing_manifest.save_manifests([dict(manifest, instance_name='changed.xml')])
+  assert filing_manifest.load_manifests() == {manifest['accession']: dict(manifest, instance_name='changed.xml')}
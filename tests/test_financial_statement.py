@@ -6,4 +6,159 @@ from src.xbrl import FinancialStatement
 
 def test_init():
   url = 'https://www.sec.gov/Archives/edgar/data/320193/000032019319000119/a10-k20199282019_htm.xml'
-  financial_statement = FinancialStatement(url)
\ No newline at end of file
+  financial_statement = FinancialStatement(url)
+
+INSTANCE_XML = b'''<?xml version="1.0" encoding="utf-8"?>
+<xbrl xmlns="http://www.xbrl.org/2003/instance" xmlns:dei="http://xbrl.sec.gov/dei/2014-01-31" xmlns:us-gaap="http://fasb.org/us-gaap/2014-01-31">
+  <context id="FD2019Q4YTD">
+    <period>
+      <startDate>2018-09-30</startDate>
+      <endDate>2019-09-28</endDate>
+    </period>
+  </context>
+  <context id="FD2018Q4YTD">
+    <period>
+      <startDate>2017-10-01</startDate>
+      <endDate>2018-09-29</endDate>
+    </period>
+  </context>
+  <dei:DocumentFiscalYearFocus contextRef="FD2019Q4YTD">2019</dei:DocumentFiscalYearFocus>
+  <dei:DocumentFiscalPeriodFocus contextRef="FD2019Q4YTD">FY</dei:DocumentFiscalPeriodFocus>
+  <dei:DocumentPeriodEndDate contextRef="FD2019Q4YTD">2019-09-28</dei:DocumentPeriodEndDate>
+  <us-gaap:Revenues contextRef="FD2018Q4YTD" decimals="-6" unitRef="usd">265595000000</us-gaap:Revenues>
+  <us-gaap:Revenues contextRef="FD2019Q4YTD" decimals="-6" unitRef="usd">260174000000</us-gaap:Revenues>
+  <us-gaap:NetIncomeLoss contextRef="FD2019Q4YTD" decimals="-6" unitRef="usd">55256000000</us-gaap:NetIncomeLoss>
+  <us-gaap:NetCashProvidedByUsedInOperatingActivities contextRef="FD2019Q4YTD" decimals="-6" unitRef="usd">69391000000</us-gaap:NetCashProvidedByUsedInOperatingActivities>
+</xbrl>
+'''
+
+
+def test_from_bytes_is_lazy():
+  from src.xbrl import IncomeStatement
+  income_statement = IncomeStatement.from_bytes(INSTANCE_XML, tags={1: 'Revenues', 4: 'NetIncomeLoss'})
+  assert 'soup' not in income_statement.__dict__
+  assert income_statement.to_dict(['revenues', 'net_income_loss']) == {'revenues': 260174000000, 'net_income_loss': 55256000000}
+  assert income_statement.year == '2019'
+  assert income_statement.quater == 'FY'
+  assert 'eps' not in income_statement.__dict__
+
+
+def test_from_file(tmp_path):
+  from src.xbrl import CashflowStatement
+  path = tmp_path / 'instance.xml'
+  path.write_bytes(INSTANCE_XML)
+  cash_flow = CashflowStatement.from_file(str(path), tags={1: 'NetCashProvidedByUsedInOperatingActivities'})
+  assert cash_flow.cash_from_operating_activities == 69391000000
+
+
+def test_missing_period_end_date_raises():
+  import pytest
+  from src.xbrl import IncomeStatement
+  from facts import MissingFact
+  with pytest.raises(MissingFact):
+    IncomeStatement.from_bytes(b'<html>404</html>', tags={1: 'Revenues'}).revenues
+  # dei:DocumentPeriodEndDateのコンテキストがない
+  content = INSTANCE_XML.replace(b'<dei:DocumentPeriodEndDate contextRef="FD2019Q4YTD">', b'<dei:DocumentPeriodEndDate contextRef="Missing">')
+  with pytest.raises(MissingFact):
+    IncomeStatement.from_bytes(content, tags={1: 'Revenues'}).revenues
+
+
+def test_extract_retries_only_retryable_filings(monkeypatch):
+  import requests
+  import db_util
+  import xbrl
+  from deadline import DeadlineExceeded, RetryQueue
+  attempts = {}
+
+  def extract_filing(base_url, instance_name, deadline):
+    attempts[base_url] = attempts.get(base_url, 0) + 1
+    if base_url == '/slow' and attempts[base_url] == 1:
+      raise DeadlineExceeded('fetch', 1.0)
+    if base_url == '/missing':
+      res = requests.Response()
+      res.status_code = 404
+      raise requests.HTTPError('404 Not Found', response=res)
+    return {'year': '2019', 'quater': 'Q1'}
+
+  # base_infoはジェネレータのまま1回だけ読む
+  monkeypatch.setattr(db_util.DBUtil, 'readRows', lambda sql, params=None: (row for row in
+                      [('1', '/ok'), ('2', '/slow'), ('3', '/missing')]))
+  monkeypatch.setattr(xbrl, 'load_manifests', dict)
+  monkeypatch.setattr(xbrl, 'extract_filing', extract_filing)
+  monkeypatch.setattr(xbrl, 'RetryQueue', lambda: RetryQueue(backoff=0.01))
+  df, unresolved = xbrl.extract(2019, 1, '10-Q', retries=1)
+  assert df['base_url'].tolist() == ['/ok', '/slow']
+  assert unresolved.empty
+  assert attempts == {'/ok': 1, '/slow': 2, '/missing': 1}
+
+  # やり直しても制限時間を超えたファイリングは値の行にしない
+  attempts.clear()
+  df, unresolved = xbrl.extract(2019, 1, '10-Q', retries=0)
+  assert df['base_url'].tolist() == ['/ok']
+  assert unresolved.values.tolist() == [['2', '/slow']]
+
+
+def test_sequential_run_retries_throttled_filings(monkeypatch, tmp_path):
+  import pandas as pd
+  import financial_statement
+  from db_util import DBUtil
+  from edgar_server import EdgarServer, Filing, FIRST_CIK
+  monkeypatch.setenv('DATABASE_BACKEND', 'sqlite')
+  monkeypatch.setenv('DATABASE_PATH', str(tmp_path / 'edgar.db'))
+  monkeypatch.chdir(tmp_path)
+  server = EdgarServer(filings=4, max_rps=8).start()
+  try:
+    filings = [Filing(FIRST_CIK + i, 2019, 1, i) for i in range(4)]
+    rows = [pd.Series({'CIK': filing.cik, 'url': filing.directory + '/index.json'}) for filing in filings]
+    monkeypatch.setattr(financial_statement.FinancialStatement, 'BASE_URL', server.url)
+    monkeypatch.setattr(financial_statement, 'read_source_rows', lambda *args: iter(rows))
+    financial_statement.run(2019, 2020, 1, 2, '10-Q', retries=5)
+  finally:
+    server.stop()
+  ciks = {cik for cik, in DBUtil.readRows('SELECT DISTINCT cik FROM cash_flow')}
+  assert ciks == {str(filing.cik) for filing in filings}
+
+
+def test_fetch_filing_keeps_manifest_for_retries(monkeypatch):
+  import financial_statement
+
+  class Response:
+    content = b'<html></html>'
+
+  def report_list(self):
+    raise AssertionError('manifest should be used')
+  monkeypatch.setattr(financial_statement.FinancialStatement, 'report_list', report_list)
+  monkeypatch.setattr(financial_statement, 'http_get', lambda url: Response())
+  filing = {'url': '/Archives/edgar/data/1/000000000119000001/index.json', 'cik': '1', 'year': 2019, 'quater': 1,
+            'form_type': '10-Q', 'statements': {'(2)Cash Flows': 'R7.htm', '(1)Balance Sheet': 'R2.htm'}}
+  # 制限時間を超えて同じdictをもう一度取得しても、マニフェストのR fileを使う
+  for _ in range(2):
+    assert financial_statement.fetch_filing(filing) == {'(2)Cash Flows': ('R7.htm', b'<html></html>')}
+  assert 'statements' in filing
+
+
+def test_pipeline_counts_filing_as_written_when_refresh_fails(monkeypatch, tmp_path):
+  import financial_statement
+  import time_series
+  from db_util import DBUtil
+  from edgar_server import EdgarServer, Filing, FIRST_CIK
+  from processed_filings import ProcessedFilings
+  monkeypatch.setenv('DATABASE_BACKEND', 'sqlite')
+  monkeypatch.setenv('DATABASE_PATH', str(tmp_path / 'edgar.db'))
+
+  def create_table():
+    raise RuntimeError('company_series is locked')
+  monkeypatch.setattr(time_series, 'create_table', create_table)
+  server = EdgarServer(filings=2).start()
+  try:
+    monkeypatch.setattr(financial_statement.FinancialStatement, 'BASE_URL', server.url)
+    filings = [{'url': Filing(FIRST_CIK + i, 2019, 1, i).directory + '/index.json', 'cik': str(FIRST_CIK + i),
+                'year': 2019, 'quater': 1, 'form_type': '10-Q'} for i in range(2)]
+    processed_filings = ProcessedFilings()
+    pipeline = financial_statement.run_pipeline(filings, processed_filings, fetch_workers=2, parse_workers=1)
+  finally:
+    server.stop()
+  # cash_flowの行はcommitしてあるので、refreshに失敗してもファイリングは書き込めたことにする
+  assert pipeline.written == 2 and not pipeline.failed
+  assert all(filing['url'] in processed_filings for filing in filings)
+  assert list(DBUtil.readRows('SELECT COUNT(DISTINCT cik) FROM cash_flow')) == [(2,)]
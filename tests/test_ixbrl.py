@@ -0,0 +1,66 @@
+from edgar_server import Filing, FIRST_CIK
+from ixbrl import is_inline, parse_ixbrl
+
+INLINE_XHTML = '''<?xml version="1.0" encoding="utf-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:ix="http://www.xbrl.org/2013/inlineXBRL"
+      xmlns:xbrli="http://www.xbrl.org/2003/instance" xmlns:xbrldi="http://xbrl.org/2006/xbrldi"
+      xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:ixt="http://www.xbrl.org/inlineXBRL/transformation/2020-02-12"
+      xmlns:dei="http://xbrl.sec.gov/dei/2020-01-31" xmlns:us-gaap="http://fasb.org/us-gaap/2020-01-31">
+<body>
+<div style="display:none"><ix:header><ix:hidden>
+  <ix:nonNumeric name="dei:DocumentFiscalYearFocus" contextRef="FY2020">2020</ix:nonNumeric>
+  <ix:nonNumeric name="dei:DocumentFiscalPeriodFocus" contextRef="FY2020">FY</ix:nonNumeric>
+</ix:hidden><ix:resources>
+  <xbrli:context id="FY2020"><xbrli:entity><xbrli:identifier scheme="http://www.sec.gov/CIK">0000320193</xbrli:identifier></xbrli:entity>
+    <xbrli:period><xbrli:startDate>2019-09-29</xbrli:startDate><xbrli:endDate>2020-09-26</xbrli:endDate></xbrli:period></xbrli:context>
+  <xbrli:context id="FY2020_iPhone"><xbrli:entity><xbrli:identifier scheme="http://www.sec.gov/CIK">0000320193</xbrli:identifier>
+    <xbrli:segment><xbrldi:explicitMember dimension="srt:ProductOrServiceAxis">aapl:IPhoneMember</xbrldi:explicitMember></xbrli:segment></xbrli:entity>
+    <xbrli:period><xbrli:startDate>2019-09-29</xbrli:startDate><xbrli:endDate>2020-09-26</xbrli:endDate></xbrli:period></xbrli:context>
+  <xbrli:context id="FY2019"><xbrli:entity><xbrli:identifier scheme="http://www.sec.gov/CIK">0000320193</xbrli:identifier></xbrli:entity>
+    <xbrli:period><xbrli:startDate>2018-09-30</xbrli:startDate><xbrli:endDate>2019-09-28</xbrli:endDate></xbrli:period></xbrli:context>
+</ix:resources></ix:header></div>
+<p>For the fiscal year ended <ix:nonNumeric name="dei:DocumentPeriodEndDate" contextRef="FY2020" format="ixt:date-monthname-day-year-en">September 26, 2020</ix:nonNumeric></p>
+<table>
+  <tr><td>iPhone</td><td><ix:nonFraction name="us-gaap:Revenues" contextRef="FY2020_iPhone" unitRef="usd" decimals="-6" scale="6" format="ixt:num-dot-decimal">137,781</ix:nonFraction></td></tr>
+  <tr><td>Total net sales</td><td><ix:nonFraction name="us-gaap:Revenues" contextRef="FY2020" unitRef="usd" decimals="-6" scale="6" format="ixt:num-dot-decimal"><span>274,515</span></ix:nonFraction></td>
+      <td><ix:nonFraction name="us-gaap:Revenues" contextRef="FY2019" unitRef="usd" decimals="-6" scale="6" format="ixt:num-dot-decimal">260,174</ix:nonFraction></td></tr>
+  <tr><td>Other income/(expense), net</td><td>(<ix:nonFraction name="us-gaap:NonoperatingIncomeExpense" contextRef="FY2020" unitRef="usd" decimals="-6" scale="6" sign="-" format="ixt:num-dot-decimal">803</ix:nonFraction>)</td></tr>
+  <tr><td>Diluted</td><td><ix:nonFraction name="us-gaap:EarningsPerShareDiluted" contextRef="FY2020" unitRef="usdPerShare" decimals="2" format="ixt:num-comma-decimal">3,28</ix:nonFraction></td></tr>
+  <tr><td>Dividends</td><td><ix:nonFraction name="us-gaap:CommonStockDividendsPerShareDeclared" contextRef="FY2020" unitRef="usdPerShare" xsi:nil="true"/></td></tr>
+  <tr><td>Operating income</td><td><ix:nonFraction name="us-gaap:OperatingIncomeLoss" contextRef="FY2020" unitRef="usd" decimals="-6" scale="6" format="ixt:fixed-zero">—</ix:nonFraction></td></tr>
+</table>
+</body>
+</html>
+'''.encode('utf-8')
+
+
+def test_parse_ixbrl_applies_scale_sign_and_format():
+  assert is_inline(INLINE_XHTML)
+  facts = parse_ixbrl(INLINE_XHTML)
+  assert facts.text('dei:DocumentPeriodEndDate') == '2020-09-26'
+  assert facts.contexts['FY2020_iPhone']['dimensional']
+  assert facts.value('us-gaap:Revenues', '2020-09-26') == '274515000000'
+  assert facts.value('us-gaap:Revenues', '2019-09-28') == '260174000000'
+  assert facts.value('us-gaap:NonoperatingIncomeExpense', '2020-09-26') == '-803000000'
+  assert facts.value('us-gaap:EarningsPerShareDiluted', '2020-09-26') == '3.28'
+  assert facts.value('us-gaap:OperatingIncomeLoss', '2020-09-26') == '0'
+  assert facts.text('us-gaap:CommonStockDividendsPerShareDeclared') is None
+
+
+def test_income_statement_reads_inline_document():
+  from src.xbrl import IncomeStatement
+  tags = {1: 'Revenues', 2: 'OperatingIncomeLoss', 3: 'NonoperatingIncomeExpense', 4: 'NetIncomeLoss',
+          5: 'CommonStockDividendsPerShareDeclared', 6: 'EarningsPerShareDiluted'}
+  income_statement = IncomeStatement.from_bytes(INLINE_XHTML, tags=tags)
+  assert income_statement.to_dict(['revenues', 'nonoperating_income_expense', 'net_income_loss', 'dividend', 'eps']) == {
+    'revenues': 274515000000, 'nonoperating_income_expense': -803000000, 'net_income_loss': 0,
+    'dividend': 0.0, 'eps': 3.28}
+  assert (income_statement.year, income_statement.quater) == ('2020', 'FY')
+  assert 'soup' not in income_statement.__dict__
+
+
+def test_generated_inline_filing_matches_instance_values():
+  filing = Filing(FIRST_CIK, 2020, 4, 0)
+  facts = parse_ixbrl(filing.inline_xhtml().encode('utf-8'))
+  for tag, value in filing.values.items():
+    assert float(facts.value('us-gaap:' + tag, str(filing.period_end))) == value
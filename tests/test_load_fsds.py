@@ -0,0 +1,74 @@
+import zipfile
+import pandas as pd
+import load_fsds
+from load_fsds import extract_fsds
+from processed_filings import ProcessedFilings
+
+SUB = '''adsh\tcik\tname\tform\tperiod\tfy\tfp
+0000320193-19-000119\t320193\tAPPLE INC\t10-K\t20190930\t2019\tFY
+0000320193-19-000076\t320193\tAPPLE INC\t10-Q\t20190630\t2019\tQ3
+'''
+
+NUM = '''adsh\ttag\tversion\tcoreg\tddate\tqtrs\tuom\tvalue\tfootnote
+0000320193-19-000076\tRevenues\tus-gaap/2018\t\t20190630\t1\tUSD\t53809000000\t
+0000320193-19-000076\tRevenues\tus-gaap/2018\t\t20190630\t3\tUSD\t208227000000\t
+0000320193-19-000076\tRevenues\tus-gaap/2018\t\t20180630\t1\tUSD\t53265000000\t
+0000320193-19-000076\tEarningsPerShareDiluted\tus-gaap/2018\t\t20190630\t1\tUSD\t2.18\t
+0000320193-19-000076\tWeightedAverageNumberOfDilutedSharesOutstanding\tus-gaap/2018\t\t20190630\t1\tshares\t4649658000\t
+0000320193-19-000076\tNetCashProvidedByUsedInOperatingActivities\tus-gaap/2018\t\t20190630\t3\tUSD\t52726000000\t
+0000320193-19-000076\tNetCashProvidedByUsedInOperatingActivities\tus-gaap/2018\t\t20190630\t1\tUSD\t11636000000\t
+0000320193-19-000076\tCashAndCashEquivalentsAtCarryingValue\tus-gaap/2018\t\t20190630\t0\tUSD\t50530000000\t
+0000320193-19-000076\tCashAndCashEquivalentsAtCarryingValue\tus-gaap/2018\t\t20180930\t0\tUSD\t25913000000\t
+0000320193-19-000076\tRevenues\tus-gaap/2018\tSubsidiary\t20190630\t1\tUSD\t1\t
+0000320193-19-000119\tRevenues\tus-gaap/2019\t\t20190930\t4\tUSD\t260174000000\t
+'''
+
+ITEM_TAGS = pd.DataFrame({
+  'id': [1, 6, 7, 1, 4],
+  'tag': ['Revenues', 'EarningsPerShareDiluted', 'WeightedAverageNumberOfDilutedSharesOutstanding',
+          'NetCashProvidedByUsedInOperatingActivities', 'CashAndCashEquivalentsAtCarryingValue'],
+  'year': [2019] * 5,
+  'statement': ['income_statement'] * 3 + ['cash_flow'] * 2,
+})
+
+
+def make_archive(tmp_path):
+  path = tmp_path / '2019q3.zip'
+  with zipfile.ZipFile(path, 'w') as zip_file:
+    zip_file.writestr('sub.txt', SUB)
+    zip_file.writestr('num.txt', NUM)
+  return str(path)
+
+
+def test_extract_fsds(tmp_path):
+  cash_flow_df, profit_loss_df = extract_fsds(make_archive(tmp_path), ITEM_TAGS, form_type='10-Q')
+  cash_flow = cash_flow_df.iloc[0]
+  assert len(cash_flow_df) == 1
+  assert cash_flow['operating_activities'] == 52726000000
+  assert cash_flow['cash_beginning_of_period'] == 25913000000
+  assert cash_flow['cash_end_of_period'] == 50530000000
+  assert (cash_flow['cik'], cash_flow['year'], cash_flow['quater']) == ('320193', 2019, 3)
+  assert cash_flow['source'] == 'https://www.sec.gov/Archives/edgar/data/320193/000032019319000076/'
+  profit_loss = profit_loss_df.iloc[0]
+  assert profit_loss['eps'] == 2.18
+  # ProfitLoss._make_df と同じく、spsは希薄化後EPS
+  assert profit_loss['sps'] == 2.18
+  assert profit_loss['cfps'] == 52726000000 / 4649658000
+
+
+def test_extract_fsds_skips_processed_filings(tmp_path):
+  processed_filings = ProcessedFilings()
+  processed_filings.add('https://www.sec.gov/Archives/edgar/data/320193/000032019319000076/R4.htm')
+  cash_flow_df, profit_loss_df = extract_fsds(make_archive(tmp_path), ITEM_TAGS, '10-Q', processed_filings)
+  assert cash_flow_df.empty and profit_loss_df.empty
+
+
+def test_extract_fsds_without_numbers(monkeypatch, tmp_path):
+  path = make_archive(tmp_path)
+  read_member = load_fsds.read_member
+  # num.txtにchunkが1つもないとき
+  monkeypatch.setattr(load_fsds, 'read_member', lambda zip_file, name, usecols, chunksize=None:
+                      iter([]) if name == 'num.txt' else read_member(zip_file, name, usecols, chunksize))
+  cash_flow_df, profit_loss_df = extract_fsds(path, ITEM_TAGS, form_type='10-Q')
+  assert cash_flow_df.empty and profit_loss_df.empty
+  assert 'cash_end_of_period' in cash_flow_df.columns and 'sps' in profit_loss_df.columns
@@ -0,0 +1,52 @@
+import pandas as pd
+from load_url import build_disclosed_info
+
+APPLE = ['320193', 'APPLE INC', '10-Q', '2019-05-01', 'edgar/data/320193/0000320193-19-000066.txt']
+
+
+def test_build_disclosed_info():
+  data = [APPLE, ['789019', 'MICROSOFT CORP', '10-Q', '2019-04-24', 'edgar/data/789019/0001564590-19-012709.txt']]
+  df, rejected = build_disclosed_info(data, 2019, 'QTR2')
+  assert rejected.empty
+  assert list(df.columns) == ['cik', 'company_name', 'form_type', 'date_filed', 'base_url', 'year', 'QT']
+  assert df['base_url'].tolist() == ['/Archives/edgar/data/320193/000032019319000066',
+                                     '/Archives/edgar/data/789019/000156459019012709']
+  assert df.index.tolist() == [32019319000066, 156459019012709]
+  assert isinstance(df['form_type'].dtype, pd.CategoricalDtype)
+  assert df['date_filed'].iloc[0] == pd.Timestamp('2019-05-01')
+  assert (df['year'] == 2019).all() and (df['QT'] == 'QTR2').all()
+
+
+def test_build_disclosed_info_rejects_invalid_rows():
+  data = [
+    APPLE,
+    ['32019a', 'APPLE INC', '10-Q', '2019-05-01', 'edgar/data/320193/0000320193-19-000067.txt'],
+    ['320193', 'APPLE INC', '10-q', '2019-05-01', 'edgar/data/320193/0000320193-19-000068.txt'],
+    ['320193', 'APPLE INC', '10-Q', '2019-13-01', 'edgar/data/320193/0000320193-19-000069.txt'],
+    ['320193', 'APPLE INC', '10-Q', '2019-05-01', 'edgar/data/320193/0000320193-19-70.txt'],
+    ['320193', 'APPLE INC', '10-Q', '2019-05-01', 'edgar/data/789019/0000320193-19-000071.txt'],
+    APPLE,
+    ['320193', 'APPLE INC'],
+  ]
+  df, rejected = build_disclosed_info(data, 2019, 'QTR2')
+  assert df['base_url'].tolist() == ['/Archives/edgar/data/320193/000032019319000066']
+  assert rejected['reason'].tolist() == ['invalid cik', 'invalid form type', 'invalid date', 'invalid file name',
+                                         'cik mismatch', 'duplicate', 'malformed']
+  assert rejected['line'].iloc[-1] == '320193|APPLE INC'
+
+
+def test_build_disclosed_info_empty():
+  df, rejected = build_disclosed_info([], 2019, 'QTR1')
+  assert df.empty and rejected.empty
+
+
+def test_build_disclosed_info_duplicates():
+  invalid_date = APPLE[:3] + ['2019-13-01'] + APPLE[4:]
+  # 共同登録者は同じaccession numberを別のcikのディレクトリで持つ
+  co_registrant = ['30371', 'DUKE ENERGY CAROLINAS', '10-Q', '2019-05-01', 'edgar/data/30371/0001326160-19-000044.txt']
+  parent = ['1326160', 'DUKE ENERGY CORP', '10-Q', '2019-05-01', 'edgar/data/1326160/0001326160-19-000044.txt']
+  df, rejected = build_disclosed_info([invalid_date, APPLE, co_registrant, parent, APPLE], 2019, 'QTR2')
+  assert df['base_url'].tolist() == ['/Archives/edgar/data/320193/000032019319000066',
+                                     '/Archives/edgar/data/30371/000132616019000044',
+                                     '/Archives/edgar/data/1326160/000132616019000044']
+  assert rejected['reason'].tolist() == ['invalid date', 'duplicate']
@@ -0,0 +1,97 @@
+import time
+import requests
+from pipeline import Pipeline
+
+
+def fetch(item):
+  if item == 3:
+    raise IOError('not found')
+  return str(item).encode()
+
+
+def parse(item, raw):
+  if item == 5:
+    raise ValueError('broken')
+  return int(raw.decode()) * 10
+
+
+def test_pipeline():
+  written = {}
+  pipeline = Pipeline(fetch, parse, written.__setitem__, fetch_workers=3, parse_workers=2, queue_size=2)
+  assert pipeline.run(range(10)) == 8
+  assert written == {i: i * 10 for i in range(10) if i not in (3, 5)}
+  assert sorted((item, stage) for item, stage, _ in pipeline.failed) == [(3, 'fetch'), (5, 'parse')]
+
+
+def test_pipeline_retries_timed_out_filings():
+  attempts = {}
+
+  def slow_fetch(item):
+    attempts[item] = attempts.get(item, 0) + 1
+    if item == 2 and attempts[item] == 1:
+      time.sleep(0.3)
+    return fetch(item)
+
+  written = {}
+  pipeline = Pipeline(slow_fetch, parse, written.__setitem__, fetch_workers=2, parse_workers=1,
+                      budgets={'fetch': 0.1}, retries=1, backoff=0.01)
+  assert pipeline.run([1, 2, 4]) == 3
+  assert written == {1: 10, 2: 20, 4: 40}
+  assert attempts[2] == 2 and pipeline.timed_out == [] and pipeline.failed == []
+  assert pipeline.deadline_stats.fired == {'fetch': 1}
+
+
+def test_pipeline_retries_throttled_filings():
+  attempts = {}
+
+  def throttled_fetch(item):
+    attempts[item] = attempts.get(item, 0) + 1
+    if item == 2 and attempts[item] == 1:
+      res = requests.Response()
+      res.status_code = 429
+      raise requests.HTTPError('429 Too Many Requests', response=res)
+    return fetch(item)
+
+  written = {}
+  pipeline = Pipeline(throttled_fetch, parse, written.__setitem__, fetch_workers=2, parse_workers=1, retries=1,
+                      backoff=0.01)
+  assert pipeline.run([1, 2, 3]) == 2
+  assert written == {1: 10, 2: 20}
+  # 404のようなエラー(ここではIOError)はやり直さない
+  assert attempts == {1: 1, 2: 2, 3: 1} and [item for item, _, _ in pipeline.failed] == [3]
+
+
+def test_pipeline_records_failing_items():
+  def items():
+    yield 1
+    raise IOError('connection lost')
+
+  written = {}
+  pipeline = Pipeline(fetch, parse, written.__setitem__, fetch_workers=2, parse_workers=1)
+  assert pipeline.run(items()) == 1
+  assert [(item, stage) for item, stage, _ in pipeline.failed] == [(None, 'feed')]
+
+
+def fetch_index(url):
+  from deadline import http_get
+  return http_get(url).content
+
+
+def parse_index(url, raw):
+  return len(raw)
+
+
+def test_pipeline_waits_for_retry_after_until_all_filings_land():
+  from edgar_server import EdgarServer, Filing, FIRST_CIK
+  server = EdgarServer(filings=12, max_rps=4).start()
+  try:
+    urls = [server.url + Filing(FIRST_CIK + i, 2019, 1, i).directory + '/index.json' for i in range(12)]
+    written = {}
+    pipeline = Pipeline(fetch_index, parse_index, written.__setitem__, fetch_workers=4, parse_workers=1, retries=5)
+    start = time.time()
+    assert pipeline.run(urls) == 12
+    assert sorted(written) == sorted(urls) and pipeline.failed == [] and pipeline.timed_out == []
+    # 1秒に4件までなので、Retry-After(1秒)を待ってやり直す
+    assert time.time() - start >= 2
+  finally:
+    server.stop()
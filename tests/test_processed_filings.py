@@ -0,0 +1,17 @@
+from processed_filings import ProcessedFilings, filing_key
+
+
+def test_filing_key():
+  index_url = '/Archives/edgar/data/320193/000032019319000119/index.json'
+  report_url = 'https://www.sec.gov/Archives/edgar/data/320193/000032019319000119/R4.htm'
+  assert filing_key(index_url) == filing_key(report_url) == 32019319000119
+  assert filing_key('https://www.sec.gov/cgi-bin/viewer') is None
+
+
+def test_processed_filings():
+  processed_filings = ProcessedFilings()
+  processed_filings.add('https://www.sec.gov/Archives/edgar/data/320193/000032019319000119/R4.htm')
+  assert '/Archives/edgar/data/320193/000032019319000119/index.json' in processed_filings
+  assert '/Archives/edgar/data/320193/000032019319000076/index.json' not in processed_filings
+  processed_filings.force = True
+  assert '/Archives/edgar/data/320193/000032019319000119/index.json' not in processed_filings
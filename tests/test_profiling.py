@@ -0,0 +1,31 @@
+import os
+from pipeline import Pipeline
+from profiling import ProfileReport, profile_call
+
+
+def fetch(item):
+  return item['url'][-1].encode()
+
+
+def parse(item, raw):
+  return [bytearray(100000 * int(raw))]
+
+
+def test_profile_call_records_time_and_memory():
+  rows, record = profile_call(parse, {'url': '/filing/5'}, b'5')
+  assert len(rows[0]) == 500000
+  assert record.peak >= 500000 and record.allocations
+  assert any(function == 'parse' for _, _, function in record.stats)
+
+
+def test_pipeline_merges_worker_profiles(tmp_path):
+  report = ProfileReport()
+  pipeline = Pipeline(fetch, parse, lambda item, rows: None, fetch_workers=2, parse_workers=2, profile=report)
+  assert pipeline.run([{'url': f'/filing/{i}'} for i in range(1, 6)]) == 5
+  assert set(report.filings) == {f'/filing/{i}' for i in range(1, 6)}
+  assert set(report.filings['/filing/1']) == {'fetch', 'parse', 'write'}
+  assert report.hungriest(1)[0][0] == '/filing/5'
+  assert report.stats().total_calls > 0
+  path = report.save(str(tmp_path))
+  assert os.path.exists(tmp_path / 'profile.pstats')
+  assert '/filing/5' in open(path).read()
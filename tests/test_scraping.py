@@ -0,0 +1,37 @@
+import pytest
+from selenium.common.exceptions import NoSuchElementException, WebDriverException
+import scraping
+
+
+class FakeElement():
+  def __init__(self, driver, xpath):
+    self.driver = driver
+    self.xpath = xpath
+
+  def click(self):
+    self.driver.clicked.append(self.xpath)
+    if 'Income' in self.xpath:
+      raise WebDriverException('session deleted')
+    if 'Balance' in self.xpath:
+      raise NoSuchElementException('no such element')
+
+
+class FakeDriver():
+  def __init__(self):
+    self.clicked = []
+
+  def get(self, url):
+    pass
+
+  def find_element_by_xpath(self, xpath):
+    return FakeElement(self, xpath)
+
+
+def test_scrape_filing_reraises_driver_errors(monkeypatch):
+  monkeypatch.setattr(scraping, 'get_statement_title', lambda driver, url: ['Balance Sheets', 'Income Statements', 'Cash Flows'])
+  driver = FakeDriver()
+  # 要素がないタイトルは飛ばすが、2番目のタイトルでセッションが落ちたらBrowserPoolに伝える
+  with pytest.raises(WebDriverException, match='session deleted'):
+    scraping.scrape_filing(driver, {'cik': '320193', 'accession_number': '0000320193-19-000066'})
+  assert [xpath for xpath in driver.clicked if 'Financial' not in xpath] == [
+    "//*[text()='Balance Sheets']", "//*[text()='Income Statements']"]
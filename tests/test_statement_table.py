@@ -0,0 +1,30 @@
+import math
+from statement_table import parse_statement_table, to_float
+
+REPORT = b'''<html><body><table class="report">
+<tr><th class="tl" rowspan="2"><div><strong>CONSOLIDATED STATEMENTS OF CASH FLOWS - USD ($)<br> $ in Millions</strong></div></th><th class="th" colspan="2">12 Months Ended</th></tr>
+<tr><th class="th"><div>Sep. 28, 2019</div></th><th class="th"><div>Sep. 29, 2018</div></th></tr>
+<tr class="re"><td class="pl"><a>Cash, beginning of period</a></td><td class="nump">$ 25,913<span></span></td><td class="nump">$ 20,289<span></span></td></tr>
+<tr class="rh"><td class="pl"><a><strong>Operating activities:</strong></a></td><td class="text">&#160;<span></span></td><td class="text">&#160;<span></span></td></tr>
+<tr class="ro"><td class="pl"><a>Cash used in financing activities</a></td><td class="num">(90,976)<span></span></td><td class="text"><span></span></td></tr>
+</table></body></html>
+'''
+
+
+def test_parse_statement_table():
+  statement = parse_statement_table(REPORT, '(2)CASH FLOWS')
+  assert statement['headers'] == [['CONSOLIDATED STATEMENTS OF CASH FLOWS - USD ($) $ in Millions', '12 Months Ended'],
+                                  ['Sep. 28, 2019', 'Sep. 29, 2018']]
+  assert statement['sections'] == ['Operating activities:']
+  assert statement['data'] == [['Cash, beginning of period', '$ 25,913', '$ 20,289'],
+                               ['Cash used in financing activities', '(90,976)', '']]
+  assert statement['labels'] == ['Cash, beginning of period', 'Cash used in financing activities']
+  assert statement['values'][0].tolist() == [25913.0, 20289.0]
+  assert statement['values'][1][0] == -90976.0
+  assert math.isnan(statement['values'][1][1])
+
+
+def test_to_float():
+  assert to_float('$ (1,234.5)') == -1234.5
+  assert math.isnan(to_float('Nan'))
+  assert math.isnan(to_float('N/A'))
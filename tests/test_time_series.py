@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+import time_series
+from db_util import DBUtil
+from time_series import TimeSeriesStore
+
+
+def cash_flow(cik, year, quater, operating_activities):
+  return {'id': None, 'operating_activities': operating_activities, 'financing_activities': 1.0, 'investing_activities': 2.0,
+          'cash_beginning_of_period': 3.0, 'cash_end_of_period': 4.0, 'cik': cik, 'year': year, 'quater': quater,
+          'form_type': '10-Q', 'created_at': '', 'source': f'/{cik}/{year}/{quater}'}
+
+
+def test_store_refresh_history_and_cross_section(tmp_path):
+  store = TimeSeriesStore()
+  store.refresh(pd.DataFrame([cash_flow('320193', 2019, 2, 10.0), cash_flow('789019', 2019, 2, 20.0)]))
+  # 後から前の期間と新しい会社が来ても順番どおりに並ぶ
+  store.refresh(pd.DataFrame([cash_flow('320193', 2019, 1, 5.0), cash_flow('1018724', 2019, 3, 30.0)]))
+  store.refresh(pd.DataFrame({'cik': ['320193'], 'year': [2019], 'quater': [2], 'eps': [1.5]}))
+
+  history = store.history('320193', ['operating_activities', 'eps'])
+  assert list(history.index) == [(2019, 1), (2019, 2)]
+  assert history['operating_activities'].tolist() == [5.0, 10.0]
+  assert np.isnan(history['eps'][(2019, 1)]) and history['eps'][(2019, 2)] == 1.5
+
+  section = store.cross_section(2019, 2, ['operating_activities'])
+  assert section['operating_activities'].to_dict() == {'320193': 10.0, '789019': 20.0}
+  assert store.cross_section(2020, 1).empty
+  with pytest.raises(KeyError):
+    store.history('0')
+
+  store.save(tmp_path / 'series.npz')
+  loaded = TimeSeriesStore.load(tmp_path / 'series.npz')
+  assert loaded.history('320193').equals(store.history('320193'))
+
+
+def test_refresh_materializes_incrementally_on_sqlite(monkeypatch, tmp_path):
+  monkeypatch.setenv('DATABASE_BACKEND', 'sqlite')
+  monkeypatch.setenv('DATABASE_PATH', str(tmp_path / 'edgar.db'))
+  time_series.refresh(pd.DataFrame([cash_flow('320193', 2019, 1, 5.0), cash_flow('320193', 2019, 2, 10.0)]))
+  time_series.refresh(pd.DataFrame({'cik': ['320193'], 'year': [2019], 'quater': [2], 'form_type': ['10-Q'],
+                                    'dps': [0.77], 'eps': [2.9], 'cfps': [None], 'sps': [None], 'shares_outstanding': [4.6e9]}))
+  time_series.refresh(pd.DataFrame([cash_flow('320193', 2019, 2, 11.0)]))
+
+  store = TimeSeriesStore.from_db()
+  history = store.history('320193', ['operating_activities', 'eps'])
+  assert history['operating_activities'].tolist() == [5.0, 11.0]
+  assert np.isnan(history['eps'].iloc[0]) and history['eps'].iloc[1] == 2.9
+  assert list(DBUtil.readRows('SELECT COUNT(*) FROM company_series')) == [(2,)]